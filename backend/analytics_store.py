@@ -0,0 +1,379 @@
+from functools import lru_cache
+from threading import Lock
+import logging
+import os
+import re
+import uuid
+
+import numpy as np
+
+from rule_parser import parse_date
+
+logger = logging.getLogger(__name__)
+
+# ── Spending Analytics ─────────────────────────────────────────────
+#
+# Column store over receipt metadata so spending questions are answered
+# with exact arithmetic over every receipt, not by the LLM adding up
+# whatever five documents retrieval returned.
+#
+# One NumPy array per field (total, tax, item_count, date as YYYYMMDD,
+# month as YYYYMM) plus dictionary-encoded merchant and category codes.
+# Rows are appended on add and tombstoned on delete; every aggregate is
+# a boolean mask + np.bincount, so group-bys take a few milliseconds
+# even at 100k receipts.  Receipts without a readable date have date 0 and are
+# left out of date-range queries.
+#
+# `save(path)` writes the live rows into one .npz (swapped in with
+# os.replace), so a restart loads the columns instead of paging every
+# receipt's metadata out of ChromaDB.
+
+FORMAT_VERSION = 1
+_SNAPSHOT_FILE = "columns.npz"
+
+CATEGORIES = (
+    "Groceries", "Dining", "Transport & Fuel", "Health & Pharmacy",
+    "Shopping", "Utilities & Bills", "Entertainment", "Other",
+)
+_OTHER = CATEGORIES.index("Other")
+
+# First match wins; merchant name is checked before the receipt text
+_CATEGORY_KEYWORDS = [
+    ("Groceries", r"grocer|supermarket|hypermarket|market|walmart|costco|kroger|aldi|lidl|"
+                  r"whole ?foods|trader ?joe|safeway|publix|carrefour|tesco|spinneys|"
+                  r"sainsbury|asda|food ?lion|wegmans|heb\b|sprouts"),
+    ("Dining", r"caf[eé]|coffee|starbucks|restaurant|pizza|burger|mcdonald|kfc|subway|grill|"
+               r"\bbar\b|bakery|diner|kitchen|bistro|sushi|taco|chipotle|domino|dunkin|eatery"),
+    ("Transport & Fuel", r"\bshell\b|exxon|chevron|\bbp\b|mobil|fuel|\bgas\b|petrol|uber|lyft|"
+                         r"taxi|parking|metro|transit|airline|railway"),
+    ("Health & Pharmacy", r"pharmac|\bcvs\b|walgreens|clinic|\bdrug|medical|dental|hospital|"
+                          r"optical|boots\b"),
+    ("Shopping", r"target|amazon|ikea|best ?buy|\bmall\b|apparel|clothing|h&m|zara|"
+                 r"home ?depot|lowe'?s|electronics|department"),
+    ("Utilities & Bills", r"electric|water|internet|mobile|telecom|verizon|at&t|vodafone|"
+                          r"utility|insurance|\brent\b"),
+    ("Entertainment", r"cinema|movie|theat(er|re)|netflix|spotify|steam|concert|ticket|museum|bowling"),
+]
+_CATEGORY_RES = [(CATEGORIES.index(name), re.compile(pattern, re.I)) for name, pattern in _CATEGORY_KEYWORDS]
+
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9]+")
+_ISO_DATE_RE = re.compile(r"(\d{4})-(\d{2})-(\d{2})")
+
+
+def categorize(merchant: str, text: str = "") -> str:
+    """Keyword-derived spending category for a receipt."""
+    for source in (merchant or "", text or ""):
+        for code, pattern in _CATEGORY_RES:
+            if pattern.search(source):
+                return CATEGORIES[code]
+    return CATEGORIES[_OTHER]
+
+
+def merchant_key(name: str) -> str:
+    return _NON_ALNUM_RE.sub("", str(name).lower())
+
+
+class SpendingAnalytics:
+    _GROW_FACTOR = 2
+
+    def __init__(self):
+        self._lock = Lock()
+        self.clear()
+
+    def __len__(self) -> int:
+        return len(self._row_of)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._row_of
+
+    def clear(self) -> None:
+        with self._lock:
+            self._row_of: dict[str, int] = {}
+            self._ids: list[str | None] = []
+            self._merchants: list[str] = []        # code → display name
+            self._merchant_code: dict[str, int] = {}
+            self._size = 0
+            self._alloc(1024)
+
+    # ── Mutation ────────────────────────────────────────────────────
+
+    def add(self, doc_id: str, metadata: dict) -> None:
+        """Add (or replace) one receipt from its Chroma metadata."""
+        self.add_many([(doc_id, metadata)])
+
+    def add_many(self, rows: list[tuple[str, dict]]) -> None:
+        if not rows:
+            return
+        # Decode in Python, then write each column with one slice assignment
+        dates = [_date_num(meta) for _, meta in rows]
+        totals = [float(meta.get("total") or 0.0) for _, meta in rows]
+        taxes = [float(meta.get("tax") or 0.0) for _, meta in rows]
+        items = [int(meta.get("item_count") or 0) for _, meta in rows]
+        categories = [_category_code(meta) for _, meta in rows]
+
+        with self._lock:
+            first = self._size
+            self._ensure_capacity(first + len(rows))
+            merchants = [self._merchant_id(str(meta.get("title") or "Unknown")) for _, meta in rows]
+
+            for offset, (doc_id, _) in enumerate(rows):
+                old = self._row_of.get(doc_id)
+                if old is not None:
+                    self._alive[old] = False
+                    self._ids[old] = None
+                self._row_of[doc_id] = first + offset
+                self._ids.append(doc_id)
+
+            last = first + len(rows)
+            self._date[first:last] = dates
+            self._month[first:last] = np.asarray(dates, dtype=np.int32) // 100
+            self._total[first:last] = totals
+            self._tax[first:last] = taxes
+            self._items[first:last] = items
+            self._merchant[first:last] = merchants
+            self._category[first:last] = categories
+            self._alive[first:last] = True
+            self._size = last
+
+    def remove(self, doc_id: str) -> bool:
+        with self._lock:
+            row = self._row_of.pop(doc_id, None)
+            if row is None:
+                return False
+            self._alive[row] = False
+            self._ids[row] = None
+            return True
+
+    # ── Queries ─────────────────────────────────────────────────────
+
+    # Every query takes the same scope keywords (see _mask): start / end
+    # (inclusive YYYYMMDD), merchants (merchant keys), min_total / max_total.
+
+    def summary(self, **scope) -> dict:
+        """Count / total / tax / average / max over the receipts in scope."""
+        with self._lock:
+            n = self._size
+            mask = self._mask(**scope)
+            totals = self._total[:n][mask]
+            count = int(mask.sum())
+            dates = self._date[:n][mask]
+            dated = dates[dates > 0]
+            return {
+                "count": count,
+                "total": round(float(totals.sum()), 2),
+                "tax": round(float(self._tax[:n][mask].sum()), 2),
+                "average": round(float(totals.mean()), 2) if count else 0.0,
+                "max": round(float(totals.max()), 2) if count else 0.0,
+                "items": int(self._items[:n][mask].sum()),
+                "first_date": _format_date(int(dated.min())) if dated.size else None,
+                "last_date": _format_date(int(dated.max())) if dated.size else None,
+                # Receipts that no date range can include
+                "undated": int((self._alive[:n] & (self._date[:n] == 0)).sum()),
+            }
+
+    def group_by(self, key: str, limit: int | None = None, **scope) -> list[dict]:
+        """
+        Totals per "merchant", "category" or "month" over the receipts in
+        scope, largest first (months in calendar order).
+        """
+        with self._lock:
+            mask = self._mask(**scope)
+            totals = self._total[:self._size][mask]
+
+            if key == "merchant":
+                codes, labels = self._merchant[:self._size][mask], self._merchants
+            elif key == "category":
+                codes, labels = self._category[:self._size][mask], CATEGORIES
+            elif key == "month":
+                months, codes = np.unique(self._month[:self._size][mask], return_inverse=True)
+                labels = [_format_month(int(m)) for m in months]
+            else:
+                raise ValueError(f"Unknown group-by key: {key}")
+
+            sums = np.bincount(codes, weights=totals, minlength=len(labels))
+            counts = np.bincount(codes, minlength=len(labels))
+
+        groups = [
+            {"key": labels[i], "count": int(counts[i]), "total": round(float(sums[i]), 2)}
+            for i in np.flatnonzero(counts)
+        ]
+        if key != "month":
+            groups.sort(key=lambda g: g["total"], reverse=True)
+        return groups[:limit] if limit else groups
+
+    def largest(self, limit: int = 5, **scope) -> list[dict]:
+        """The biggest receipts in scope."""
+        with self._lock:
+            rows = np.flatnonzero(self._mask(**scope))
+            top = rows[np.argsort(-self._total[rows], kind="stable")[:limit]]
+            return [
+                {
+                    "id": self._ids[row],
+                    "merchant": self._merchants[self._merchant[row]],
+                    "date": _format_date(int(self._date[row])),
+                    "total": round(float(self._total[row]), 2),
+                }
+                for row in top
+            ]
+
+    def filter_ids(self, **scope) -> list[str]:
+        """IDs of the receipts in scope (candidate set for filtered retrieval)."""
+        with self._lock:
+            return [self._ids[row] for row in np.flatnonzero(self._mask(**scope))]
+
+    def merchants(self) -> list[str]:
+        """Display names of every merchant with a live receipt."""
+        with self._lock:
+            codes = np.unique(self._merchant[:self._size][self._alive[:self._size]])
+            return [self._merchants[c] for c in codes]
+
+    # ── Persistence ─────────────────────────────────────────────────
+
+    def save(self, path: str, tag: str = "") -> None:
+        """
+        Write the live rows to a snapshot under `path`.  `tag` must match
+        on `load` (e.g. the metadata schema version).
+        """
+        with self._lock:
+            rows = np.flatnonzero(self._alive[:self._size])
+            columns = {
+                name: getattr(self, f"_{name}")[rows]
+                for name in ("date", "total", "tax", "items", "merchant", "category")
+            }
+            ids = [self._ids[row] for row in rows]
+            merchants = list(self._merchants)
+
+        os.makedirs(path, exist_ok=True)
+        tmp_path = os.path.join(path, f"columns.{uuid.uuid4().hex[:8]}.tmp.npz")
+        np.savez(
+            tmp_path,
+            format_version=np.array(FORMAT_VERSION),
+            tag=np.array(tag),
+            ids=np.array(ids, dtype=str),
+            merchants=np.array(merchants, dtype=str),
+            **columns,
+        )
+        os.replace(tmp_path, os.path.join(path, _SNAPSHOT_FILE))
+        logger.info(f"Analytics snapshot written ({len(ids)} receipts)")
+
+    def load(self, path: str, tag: str = "") -> bool:
+        """
+        Replace the contents with the snapshot under `path`.  Returns False
+        (and leaves the store untouched) if there is no compatible snapshot.
+        """
+        try:
+            with np.load(os.path.join(path, _SNAPSHOT_FILE), allow_pickle=False) as snapshot:
+                if int(snapshot["format_version"]) != FORMAT_VERSION or str(snapshot["tag"]) != tag:
+                    logger.info("Analytics snapshot is incompatible; ignoring it")
+                    return False
+                data = {name: snapshot[name] for name in snapshot.files}
+        except (OSError, ValueError, KeyError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning(f"Failed to read analytics snapshot: {e}")
+            return False
+
+        ids = [str(doc_id) for doc_id in data["ids"]]
+        merchants = [str(name) for name in data["merchants"]]
+        n = len(ids)
+        with self._lock:
+            self._row_of = {doc_id: row for row, doc_id in enumerate(ids)}
+            self._ids = list(ids)
+            self._merchants = merchants
+            self._merchant_code = {merchant_key(name) or "unknown": code for code, name in enumerate(merchants)}
+            self._size = n
+            self._alloc(max(n, 1024))
+            self._date[:n] = data["date"]
+            self._month[:n] = data["date"] // 100
+            self._total[:n] = data["total"]
+            self._tax[:n] = data["tax"]
+            self._items[:n] = data["items"]
+            self._merchant[:n] = data["merchant"]
+            self._category[:n] = data["category"]
+            self._alive[:n] = True
+        return True
+
+    # ── Internals ───────────────────────────────────────────────────
+
+    def _mask(self, start: int | None = None, end: int | None = None,
+              merchants: list[str] | None = None,
+              min_total: float | None = None, max_total: float | None = None) -> np.ndarray:
+        n = self._size
+        mask = self._alive[:n].copy()
+        if start is not None or end is not None:
+            dates = self._date[:n]
+            mask &= dates > 0
+            if start is not None:
+                mask &= dates >= start
+            if end is not None:
+                mask &= dates <= end
+        if merchants:
+            codes = [self._merchant_code[k] for k in merchants if k in self._merchant_code]
+            mask &= np.isin(self._merchant[:n], codes)
+        if min_total is not None:
+            mask &= self._total[:n] >= min_total
+        if max_total is not None:
+            mask &= self._total[:n] <= max_total
+        return mask
+
+    def _merchant_id(self, name: str) -> int:
+        key = merchant_key(name) or "unknown"
+        code = self._merchant_code.get(key)
+        if code is None:
+            code = len(self._merchants)
+            self._merchant_code[key] = code
+            self._merchants.append(name.strip() or "Unknown")
+        return code
+
+    def _alloc(self, capacity: int) -> None:
+        self._date = np.zeros(capacity, dtype=np.int32)
+        self._month = np.zeros(capacity, dtype=np.int32)
+        self._total = np.zeros(capacity, dtype=np.float64)
+        self._tax = np.zeros(capacity, dtype=np.float64)
+        self._items = np.zeros(capacity, dtype=np.int32)
+        self._merchant = np.zeros(capacity, dtype=np.int32)
+        self._category = np.zeros(capacity, dtype=np.int16)
+        self._alive = np.zeros(capacity, dtype=bool)
+
+    def _ensure_capacity(self, size: int) -> None:
+        capacity = len(self._alive)
+        if size <= capacity:
+            return
+        new_capacity = max(size, capacity * self._GROW_FACTOR)
+        for name in ("_date", "_month", "_total", "_tax", "_items", "_merchant", "_category", "_alive"):
+            column = getattr(self, name)
+            grown = np.zeros(new_capacity, dtype=column.dtype)
+            grown[:capacity] = column
+            setattr(self, name, grown)
+
+
+def _category_code(meta: dict) -> int:
+    category = meta.get("category") or _merchant_category(str(meta.get("title") or ""))
+    return CATEGORIES.index(category) if category in CATEGORIES else _OTHER
+
+
+@lru_cache(maxsize=4096)
+def _merchant_category(merchant: str) -> str:
+    # Receipts stored before categories existed: derive from the merchant once
+    return categorize(merchant)
+
+
+def _date_num(meta: dict) -> int:
+    if meta.get("date_num"):
+        return int(meta["date_num"])
+    return parse_date_num(str(meta.get("date") or ""))
+
+
+def parse_date_num(raw: str) -> int:
+    """Receipt date string → sortable YYYYMMDD int (0 if unreadable)."""
+    if _ISO_DATE_RE.fullmatch(raw):  # what the parser stores; skip the slow path
+        return int(raw.replace("-", ""))
+    iso = parse_date(raw)
+    return int(iso.replace("-", "")) if iso else 0
+
+
+def _format_date(num: int) -> str | None:
+    return f"{num // 10000:04d}-{num // 100 % 100:02d}-{num % 100:02d}" if num else None
+
+
+def _format_month(num: int) -> str:
+    return f"{num // 100:04d}-{num % 100:02d}" if num else "Undated"
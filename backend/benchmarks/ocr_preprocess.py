@@ -0,0 +1,130 @@
+"""
+OCR preprocessing benchmark ─ latency vs. accuracy per configuration.
+
+Run from backend/:
+    python -m benchmarks.ocr_preprocess path/to/receipt/images \
+        [--max-sides 0,2400,1600,1200,960] [--crop] [--json results.json]
+
+Every image is OCR'd once per (max_side, grayscale[, crop]) setting.
+Accuracy is the character-level similarity (difflib ratio) between the
+recognised text and a reference: `<image>.txt` next to the image if it
+exists, otherwise the full-resolution, unprocessed OCR output.
+"""
+import argparse
+import difflib
+import json
+import os
+import statistics
+import time
+
+from ocr_service import OCRService
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def _load_images(folder: str) -> list[tuple[str, bytes, str | None]]:
+    images = []
+    for name in sorted(os.listdir(folder)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        path = os.path.join(folder, name)
+        with open(path, "rb") as f:
+            data = f.read()
+        truth_path = os.path.splitext(path)[0] + ".txt"
+        truth = None
+        if os.path.exists(truth_path):
+            with open(truth_path, encoding="utf-8") as f:
+                truth = f.read()
+        images.append((name, data, truth))
+    return images
+
+
+def _configure(service: OCRService, max_side: int, grayscale: bool, crop: bool):
+    service.max_side = max_side
+    service.grayscale = grayscale
+    service.crop_to_content = crop
+
+
+def _similarity(reference: str, text: str) -> float:
+    return difflib.SequenceMatcher(None, reference, text).ratio()
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run(folder: str, max_sides: list[int], with_crop: bool) -> dict:
+    images = _load_images(folder)
+    if not images:
+        raise SystemExit(f"No images found in {folder}")
+
+    service = OCRService(load_llm=False)
+
+    # Reference pass: full resolution, colour, no crop
+    _configure(service, 0, False, False)
+    service.extract_text_from_bytes(images[0][1])  # warmup
+    references = {}
+    for name, data, truth in images:
+        references[name] = truth if truth is not None else service.extract_text_from_bytes(data).raw_text
+
+    configs = [(side, gray, False) for side in max_sides for gray in (False, True)]
+    if with_crop:
+        configs += [(side, True, True) for side in max_sides]
+
+    results = []
+    for max_side, grayscale, crop in configs:
+        _configure(service, max_side, grayscale, crop)
+        service.extract_text_from_bytes(images[0][1])  # warmup
+
+        latencies, scores = [], []
+        for name, data, _ in images:
+            started = time.perf_counter()
+            ocr = service.extract_text_from_bytes(data)
+            latencies.append(1000 * (time.perf_counter() - started))
+            scores.append(_similarity(references[name], ocr.raw_text))
+
+        results.append({
+            "max_side": max_side,
+            "grayscale": grayscale,
+            "crop_to_content": crop,
+            "images": len(images),
+            "latency_ms_mean": round(statistics.mean(latencies), 1),
+            "latency_ms_p50": round(_percentile(latencies, 50), 1),
+            "latency_ms_p95": round(_percentile(latencies, 95), 1),
+            "text_similarity_mean": round(statistics.mean(scores), 4),
+            "text_similarity_min": round(min(scores), 4),
+        })
+
+    return {
+        "reference": "ground truth .txt" if any(t for _, _, t in images) else "full-resolution OCR",
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("folder", help="Directory of receipt images")
+    parser.add_argument("--max-sides", default="0,2400,1600,1200,960",
+                        help="Comma-separated long-side limits (0 = full resolution)")
+    parser.add_argument("--crop", action="store_true", help="Also benchmark crop-to-content")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    report = run(args.folder, [int(v) for v in args.max_sides.split(",")], args.crop)
+
+    header = f"{'max_side':>8} {'gray':>5} {'crop':>5} {'mean ms':>9} {'p95 ms':>8} {'similarity':>10}"
+    print(f"Reference: {report['reference']}")
+    print(header)
+    print("-" * len(header))
+    for r in report["results"]:
+        print(f"{r['max_side']:>8} {str(r['grayscale']):>5} {str(r['crop_to_content']):>5} "
+              f"{r['latency_ms_mean']:>9} {r['latency_ms_p95']:>8} {r['text_similarity_mean']:>10}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
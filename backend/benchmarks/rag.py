@@ -0,0 +1,425 @@
+"""
+Retrieval and ingestion benchmark ─ throughput, stage latencies, memory, startup.
+
+Run from backend/:
+    python -m benchmarks.rag [--sizes 1000,10000,100000] [--queries 200] [--json results.json]
+    python -m benchmarks.rag --sizes 1000 --real-models
+
+Every corpus size gets a fresh ChromaDB store in a temp dir, filled with
+synthetic receipts in the exact text + metadata format /ocr/parse
+stores, so nothing calls OCR or the LLM.  Per size:
+
+  ingest     `add_receipt` one by one (the /ocr/parse path), then the
+             rest through `add_receipts` in import-sized batches
+  retrieval  sequential `get_relevant_context` calls, split into the
+             dense (chroma_query), sparse (bm25_score) and rerank stages
+  startup    a new process opening the filled store: import, construct,
+             and time until every background component is ready
+  memory     RSS after ingest and after startup, plus the on-disk store
+
+By default the ONNX embedder and the cross-encoder are replaced by
+cheap deterministic stand-ins (hashed bag-of-words vectors, token
+overlap scores), so runs are offline, CPU-only and reproducible; they
+measure everything around the models.  `--real-models` uses the real
+ones (downloaded on first use).  Each phase runs in its own process, so
+sizes don't share caches or memory.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from multiprocessing import get_context
+
+STAGES = ("chroma_query", "bm25_score", "rerank", "retrieve")
+
+
+# ── Corpus ──────────────────────────────────────────────────────────
+
+_MERCHANTS = {
+    "Groceries": ("Walmart", "Costco Wholesale", "Trader Joe's", "Whole Foods Market", "Kroger", "Aldi"),
+    "Dining": ("Starbucks", "Corner Cafe", "Chipotle", "Domino's Pizza", "Sushi House", "Blue Bistro"),
+    "Transport & Fuel": ("Shell", "Chevron", "Uber", "City Parking"),
+    "Health & Pharmacy": ("CVS Pharmacy", "Walgreens", "Smile Dental"),
+    "Shopping": ("Target", "IKEA", "Best Buy", "Home Depot", "Zara"),
+    "Utilities & Bills": ("Verizon", "City Water", "State Electric"),
+    "Entertainment": ("AMC Cinema", "Spotify", "Bowling Alley"),
+}
+_ITEMS = {
+    "Groceries": ("Milk 2%", "Wheat Bread", "Bananas", "Large Eggs", "Chicken Breast", "Apples", "Rice 5lb",
+                  "Orange Juice", "Greek Yogurt", "Paper Towels", "Cheddar Cheese", "Ground Coffee"),
+    "Dining": ("Latte", "Cappuccino", "Burrito Bowl", "Pepperoni Pizza", "Salmon Roll", "Croissant",
+               "Iced Tea", "Caesar Salad", "Chips & Salsa"),
+    "Transport & Fuel": ("Unleaded Fuel", "Diesel", "Car Wash", "Ride Fare", "Parking 2h"),
+    "Health & Pharmacy": ("Ibuprofen", "Vitamin D", "Toothpaste", "Cleaning Visit", "Bandages", "Cough Syrup"),
+    "Shopping": ("USB-C Cable", "Desk Lamp", "Bookshelf", "Power Drill", "T-Shirt", "Headphones"),
+    "Utilities & Bills": ("Monthly Plan", "Water Service", "Electricity Usage", "Late Fee"),
+    "Entertainment": ("Movie Ticket", "Popcorn", "Premium Subscription", "Lane Rental"),
+}
+_START_DAY = date(2023, 1, 1)
+
+
+def _structured_doc(merchant: str, day: str, total: float, tax: float, items: list[dict]) -> str:
+    # Same layout as main.py's ocr_parse_endpoint
+    items_text = "\n".join(
+        f"- {item['desc']}: ${item['price']:.2f} (qty: {item['qty']})" for item in items
+    ) if items else "No items extracted"
+    return (
+        f"Receipt from: {merchant}\n"
+        f"Date: {day}\n"
+        f"Total: ${total:.2f}\n"
+        f"Tax: ${tax:.2f}\n\n"
+        f"Items:\n{items_text}"
+    )
+
+
+def synthetic_receipts(count: int, seed: int) -> list[dict]:
+    """`count` receipts as add_receipts rows ({"text", "metadata"}), deterministic per seed."""
+    rng = random.Random(seed)
+    categories = list(_MERCHANTS)
+    receipts = []
+    for _ in range(count):
+        category = rng.choice(categories)
+        merchant = rng.choice(_MERCHANTS[category])
+        day = (_START_DAY + timedelta(days=rng.randrange(730))).isoformat()
+        items = [{"desc": desc, "qty": rng.choice((1, 1, 1, 2, 3)), "price": round(rng.uniform(0.5, 60), 2)}
+                 for desc in rng.sample(_ITEMS[category], rng.randint(1, min(6, len(_ITEMS[category]))))]
+        subtotal = sum(i["qty"] * i["price"] for i in items)
+        tax = round(subtotal * rng.choice((0.0, 0.05, 0.0725, 0.08)), 2)
+        total = round(subtotal + tax, 2)
+        receipts.append({
+            "text": _structured_doc(merchant, day, total, tax, items),
+            "metadata": {
+                "source": "receipt_ocr",
+                "title": merchant,
+                "date": day,
+                "total": total,
+                "tax": tax,
+                "item_count": len(items),
+                "timestamp": f"{day}T12:00:00",
+            },
+        })
+    return receipts
+
+
+def synthetic_queries(count: int, seed: int) -> list[str]:
+    """Distinct chat questions: plain lookups plus merchant / month / amount constrained ones."""
+    rng = random.Random(seed + 1)
+    categories = list(_MERCHANTS)
+    templates = (
+        "{item}",
+        "when did I buy {item}",
+        "{item} at {merchant}",
+        "what did I get at {merchant} in {month} {year}",
+        "{item} in {month} {year}",
+        "receipts over ${amount} for {item}",
+        "how much was the {item} last time",
+    )
+    queries: list[str] = []
+    seen = set()
+    while len(queries) < count:
+        category = rng.choice(categories)
+        query = rng.choice(templates).format(
+            item=rng.choice(_ITEMS[category]).lower(),
+            merchant=rng.choice(_MERCHANTS[category]),
+            month=rng.choice(("January", "March", "June", "September", "November")),
+            year=rng.choice((2023, 2024)),
+            amount=rng.choice((20, 50, 100)),
+        )
+        if query not in seen:  # repeats would only measure the rerank cache
+            seen.add(query)
+            queries.append(query)
+    return queries
+
+
+# ── Stand-in Models ─────────────────────────────────────────────────
+
+_EMBEDDING_DIM = 384  # same width as all-MiniLM-L6-v2
+
+
+def _hash_embedding(text: str):
+    import numpy as np
+    vector = np.zeros(_EMBEDDING_DIM, dtype=np.float32)
+    for token in text.lower().split():
+        h = zlib.crc32(token.encode("utf-8"))
+        vector[h % _EMBEDDING_DIM] += 1.0 if h & 0x80000000 else -1.0
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+class _OverlapReranker:
+    """CrossEncoder stand-in: score = share of query tokens found in the document."""
+
+    def predict(self, pairs, batch_size: int = 32, **kwargs):
+        scores = []
+        for query, doc in pairs:
+            q = set(query.lower().split())
+            scores.append(len(q & set(doc.lower().split())) / len(q) if q else 0.0)
+        return scores
+
+
+def _install_stub_models() -> None:
+    # Every Chroma embedding (collection add/query, RAGService.embedder)
+    # goes through ONNXMiniLM_L6_V2.__call__, which also does the download
+    from chromadb.utils.embedding_functions import onnx_mini_lm_l6_v2
+    import rag_service
+
+    onnx_mini_lm_l6_v2.ONNXMiniLM_L6_V2.__call__ = lambda self, input: [_hash_embedding(t) for t in input]
+    rag_service.RAGService._load_reranker = staticmethod(_OverlapReranker)
+
+
+# ── Measurements ────────────────────────────────────────────────────
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def latency_ms(seconds: list[float]) -> dict:
+    if not seconds:
+        return {"n": 0}
+    ms = [1000 * s for s in seconds]
+    return {
+        "n": len(ms),
+        "mean": round(statistics.mean(ms), 3),
+        "p50": round(_percentile(ms, 50), 3),
+        "p95": round(_percentile(ms, 95), 3),
+        "p99": round(_percentile(ms, 99), 3),
+        "max": round(max(ms), 3),
+    }
+
+
+def _rss_mb() -> dict:
+    """Current and peak resident memory of this process, where the OS tells us."""
+    memory = {}
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key = "rss_mb" if line.startswith("VmRSS") else "peak_rss_mb"
+                    memory[key] = round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # kilobytes on Linux, bytes on macOS
+            memory["peak_rss_mb"] = round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+        except ImportError:
+            pass
+    return memory
+
+
+def _dir_mb(path: str) -> float:
+    size = 0
+    for root, _, files in os.walk(path):
+        size += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return round(size / (1024 * 1024), 1)
+
+
+# ── Phases (each in a fresh process) ────────────────────────────────
+
+def open_service(workdir: str, stub_models: bool):
+    """Import and construct RAGService over `workdir`/chroma_store; returns (service, timings)."""
+    os.chdir(workdir)  # RAGService keeps its store under the working directory
+    started = time.perf_counter()
+    import rag_service
+    if stub_models:
+        _install_stub_models()
+    imported = time.perf_counter()
+    service = rag_service.RAGService()
+    return service, {
+        "import_s": round(imported - started, 3),
+        "construct_s": round(time.perf_counter() - imported, 3),
+    }
+
+
+def wait_ready() -> tuple[float, dict]:
+    from startup import startup
+    started = time.perf_counter()
+    startup.start()
+    for name in startup.status()["components"]:
+        startup.result(name)
+    return time.perf_counter() - started, startup.status()["components"]
+
+
+async def _query_pass(service, queries: list[str], top_k: int, warmup: int) -> dict:
+    from metrics import capture
+
+    for query in queries[:warmup]:
+        await service.get_relevant_context(query, top_k)
+
+    stages: dict[str, list[float]] = {stage: [] for stage in STAGES}
+    end_to_end, hits = [], []
+    for query in queries[warmup:]:
+        with capture() as timings:
+            started = time.perf_counter()
+            context = await service.get_relevant_context(query, top_k)
+            end_to_end.append(time.perf_counter() - started)
+        hits.append(context.count("[Receipt ID:"))
+        for stage in STAGES:
+            if stage in timings:  # rerank is skipped when every score is cached
+                stages[stage].append(timings[stage])
+
+    return {
+        "queries": len(end_to_end),
+        "top_k": top_k,
+        "avg_hits": round(statistics.mean(hits), 2) if hits else 0.0,
+        "get_relevant_context_ms": latency_ms(end_to_end),
+        "stages_ms": {stage: latency_ms(values) for stage, values in stages.items()},
+    }
+
+
+def ingest_and_query(workdir: str, size: int, opts: dict) -> dict:
+    service, _ = open_service(workdir, opts["stub_models"])
+    wait_ready()
+    receipts = synthetic_receipts(size, opts["seed"])
+
+    # /ocr/parse path: one receipt per call
+    single = receipts[:min(opts["single"], size)]
+    per_call = []
+    started = time.perf_counter()
+    for receipt in single:
+        t = time.perf_counter()
+        service.add_receipt(receipt["text"], receipt["metadata"])
+        per_call.append(time.perf_counter() - t)
+    single_s = time.perf_counter() - started
+
+    # Bulk import path
+    rest = receipts[len(single):]
+    batch = opts["batch"]
+    started = time.perf_counter()
+    for start in range(0, len(rest), batch):
+        service.add_receipts(rest[start:start + batch])
+    bulk_s = time.perf_counter() - started
+
+    ingest = {
+        "add_receipt": {
+            "docs": len(single),
+            "docs_per_s": round(len(single) / single_s, 1) if single_s else None,
+            "latency_ms": latency_ms(per_call),
+        },
+        "add_receipts": {
+            "docs": len(rest),
+            "batch": batch,
+            "docs_per_s": round(len(rest) / bulk_s, 1) if rest and bulk_s else None,
+            "seconds": round(bulk_s, 3),
+        },
+        "stored": service.collection.count(),
+        "duplicates_skipped": service.duplicates_skipped,
+    }
+    memory = _rss_mb()
+
+    queries = synthetic_queries(opts["queries"] + opts["warmup"], opts["seed"])
+    retrieval = asyncio.run(_query_pass(service, queries, opts["top_k"], opts["warmup"]))
+    retrieval["rerank_batcher"] = service.rerank_batcher.stats()
+    retrieval["rerank_selection"] = service.retrieval_stats()
+
+    service.close()
+    return {"ingest": ingest, "retrieval": retrieval, "memory_after_ingest": memory}
+
+
+def cold_start(workdir: str, opts: dict) -> dict:
+    service, timings = open_service(workdir, opts["stub_models"])
+    ready_s, components = wait_ready()
+    result = {
+        **timings,
+        "ready_s": round(ready_s, 3),
+        "total_s": round(timings["import_s"] + timings["construct_s"] + ready_s, 3),
+        "components": components,
+        "memory": _rss_mb(),
+        "store_mb": _dir_mb(os.path.join(workdir, "chroma_store")),
+    }
+    service.close()
+    return result
+
+
+def _in_subprocess(func, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(func, *args).result()
+
+
+# ── Run ─────────────────────────────────────────────────────────────
+
+def run(sizes: list[int], opts: dict) -> dict:
+    results = []
+    for size in sizes:
+        workdir = tempfile.mkdtemp(prefix=f"spendly_bench_{size}_")
+        try:
+            row = {"size": size}
+            row.update(_in_subprocess(ingest_and_query, workdir, size, opts))
+            row["startup"] = _in_subprocess(cold_start, workdir, opts)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        results.append(row)
+        print(f"  {size} receipts done", file=sys.stderr)
+
+    return {
+        "config": {
+            **opts,
+            "sizes": sizes,
+            "models": "stub" if opts["stub_models"] else "real",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000", help="Comma-separated corpus sizes")
+    parser.add_argument("--queries", type=int, default=200, help="Timed queries per size")
+    parser.add_argument("--warmup", type=int, default=5, help="Untimed queries before those")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--single", type=int, default=200, help="Receipts stored one by one with add_receipt")
+    parser.add_argument("--batch", type=int, default=1000, help="Rows per add_receipts call")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--real-models", action="store_true",
+                        help="Use the real ONNX embedder and cross-encoder instead of stand-ins")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    opts = {
+        "queries": args.queries,
+        "warmup": args.warmup,
+        "top_k": args.top_k,
+        "single": args.single,
+        "batch": args.batch,
+        "seed": args.seed,
+        "stub_models": not args.real_models,
+    }
+    report = run(sizes, opts)
+
+    print(f"Models: {report['config']['models']}  |  {opts['queries']} queries, top_k={opts['top_k']}")
+    header = (f"{'size':>7} {'add/s':>8} {'bulk/s':>9} {'ctx p50':>8} {'ctx p95':>8} {'ctx p99':>8} "
+              f"{'dense50':>8} {'bm25 50':>8} {'rrk 50':>8} {'start s':>8} {'rss MB':>7} {'disk MB':>8}")
+    print(header)
+    print("-" * len(header))
+    for r in report["results"]:
+        ingest, retrieval, start = r["ingest"], r["retrieval"], r["startup"]
+        ctx, stages = retrieval["get_relevant_context_ms"], retrieval["stages_ms"]
+        print(f"{r['size']:>7} {ingest['add_receipt']['docs_per_s'] or '':>8} "
+              f"{ingest['add_receipts']['docs_per_s'] or '':>9} "
+              f"{ctx.get('p50', ''):>8} {ctx.get('p95', ''):>8} {ctx.get('p99', ''):>8} "
+              f"{stages['chroma_query'].get('p50', ''):>8} {stages['bm25_score'].get('p50', ''):>8} "
+              f"{stages['rerank'].get('p50', ''):>8} {start['total_s']:>8} "
+              f"{start['memory'].get('rss_mb', ''):>7} {start['store_mb']:>8}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Receipt parsing benchmark ─ accuracy and latency per parsing tier.
+
+Run from backend/:
+    python -m benchmarks.receipt_parse path/to/corpus [--llm] [--json results.json]
+    python -m benchmarks.receipt_parse --synthetic 500 [--seed 7]
+
+A corpus is a folder of `*.json` files, each
+    {"raw_text": "...", "ocr_regions": {"text_regions": [...]},   # optional
+     "expected": {"merchant": ..., "date": ..., "total": ..., "tax": ..., "items": [...]}}
+i.e. an /ocr/scan response plus hand-checked ReceiptData.  `--synthetic`
+generates printed-style receipts (with OCR-like noise) instead.
+
+Tiers:
+  rules   the local rule parser on its own (every receipt)
+  llm     gpt-4o-mini through OCRService.parse_receipt (`--llm` only)
+  tiered  rules when confident, LLM otherwise — what /ocr/parse does
+Without `--llm`, the tiered row reports how many receipts would reach the LLM.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import statistics
+import time
+
+from rule_parser import parse_receipt_rules, RULE_PARSER_MIN_CONFIDENCE
+
+FIELDS = ("merchant", "date", "total", "tax", "items")
+
+
+# ── Corpus ──────────────────────────────────────────────────────────
+
+def _load_corpus(folder: str) -> list[dict]:
+    corpus = []
+    for name in sorted(os.listdir(folder)):
+        if name.endswith(".json"):
+            with open(os.path.join(folder, name), encoding="utf-8") as f:
+                sample = json.load(f)
+            sample["name"] = name
+            corpus.append(sample)
+    return corpus
+
+
+_MERCHANTS = ("WALMART", "Target", "TRADER JOE'S", "Corner Cafe", "CVS Pharmacy", "Shell", "Costco Wholesale")
+_ITEMS = ("MILK 2%", "BREAD WHEAT", "BANANAS", "EGGS LARGE", "COFFEE", "CHICKEN BREAST", "APPLES",
+          "PAPER TOWELS", "SHAMPOO", "YOGURT", "RICE 5LB", "ORANGE JUICE", "BATTERIES AA", "CHIPS")
+
+
+def _synthetic(count: int, seed: int) -> list[dict]:
+    rng = random.Random(seed)
+    corpus = []
+    for n in range(count):
+        merchant = rng.choice(_MERCHANTS)
+        day = f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        y, m, d = day.split("-")
+        items = [{"desc": desc, "qty": float(rng.choice((1, 1, 1, 2, 3))), "price": round(rng.uniform(0.5, 25), 2)}
+                 for desc in rng.sample(_ITEMS, rng.randint(1, 8))]
+        subtotal = round(sum(i["qty"] * i["price"] for i in items), 2)
+        tax = round(subtotal * rng.choice((0.0, 0.05, 0.0725, 0.08)), 2)
+        total = round(subtotal + tax, 2)
+
+        rows: list[tuple[str, str | None]] = [
+            (f"WELCOME TO {merchant}" if rng.random() < 0.3 else merchant, None),
+            (f"{rng.randint(10, 999)} Main St  ({rng.randint(200, 999)}) 555-{rng.randint(1000, 9999)}", None),
+            (rng.choice((f"{m}/{d}/{y}", f"{y}-{m}-{d}", f"{d}.{m}.{y}" if int(d) > 12 else f"{m}/{d}/{y[2:]}"))
+             + f" {rng.randint(7, 22)}:{rng.randint(0, 59):02d}", None),
+        ]
+        for item in items:
+            line_total = item["qty"] * item["price"]
+            label = f"{int(item['qty'])} @ {item['price']:.2f} {item['desc']}" if item["qty"] > 1 else item["desc"]
+            rows.append((label, f"{line_total:.2f}"))
+        if rng.random() < 0.8:
+            rows.append(("SUBTOTAL", f"{subtotal:.2f}"))
+        if tax or rng.random() < 0.5:
+            rows.append(("TAX", f"{tax:.2f}"))
+        rows.append(("TOTAL", f"{total:.2f}"))
+        if rng.random() < 0.5:
+            paid = float(int(total) + rng.choice((1, 5, 10)))
+            rows += [("CASH", f"{paid:.2f}"), ("CHANGE", f"{paid - total:.2f}")]
+
+        # OCR noise: a misread digit now and then
+        if rng.random() < 0.15:
+            i = rng.randrange(3, len(rows))
+            label, price = rows[i]
+            if price:
+                rows[i] = (label, price.replace(rng.choice("0123456789"), rng.choice("SOlB"), 1))
+
+        regions, lines = [], []
+        for r, (label, price) in enumerate(rows):
+            y0 = 40 + 32 * r + rng.uniform(-3, 3)
+            regions.append({"text": label, "box": [20, round(y0), 20 + 11 * len(label), round(y0 + 22)]})
+            if price:
+                x1 = 460 + rng.uniform(-4, 4)
+                regions.append({"text": price, "box": [round(x1 - 11 * len(price)), round(y0 + 1),
+                                                       round(x1), round(y0 + 23)]})
+            lines.append(f"{label} {price}" if price else label)
+
+        corpus.append({
+            "name": f"synthetic_{n:05d}",
+            "raw_text": "\n".join(lines),
+            "ocr_regions": {"text_regions": regions, "image_width": 480, "image_height": 80 + 32 * len(rows)},
+            "expected": {"merchant": merchant, "date": day, "total": total, "tax": tax, "items": items},
+        })
+    return corpus
+
+
+# ── Scoring ─────────────────────────────────────────────────────────
+
+def _norm_name(value) -> str:
+    return re.sub(r"[^a-z0-9]", "", str(value or "").lower())
+
+
+def _money_eq(a, b) -> bool:
+    return a is not None and b is not None and abs(float(a) - float(b)) <= 0.01
+
+
+def _score(parsed: dict, expected: dict) -> dict[str, bool]:
+    return {
+        "merchant": bool(_norm_name(parsed.get("merchant")))
+        and _norm_name(parsed.get("merchant")) in _norm_name(expected.get("merchant")),
+        "date": parsed.get("date") == expected.get("date"),
+        "total": _money_eq(parsed.get("total"), expected.get("total")),
+        "tax": _money_eq(parsed.get("tax") or 0.0, expected.get("tax") or 0.0),
+        "items": len(parsed.get("items") or []) == len(expected.get("items") or []),
+    }
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _summarise(tier: str, scores: list[dict], latencies: list[float], **extra) -> dict:
+    row = {"tier": tier, "receipts": len(scores), **extra}
+    for name in FIELDS:
+        row[f"{name}_acc"] = round(sum(s[name] for s in scores) / len(scores), 4) if scores else 0.0
+    row["exact_acc"] = round(sum(all(s.values()) for s in scores) / len(scores), 4) if scores else 0.0
+    if latencies:
+        row["latency_ms_mean"] = round(statistics.mean(latencies), 3)
+        row["latency_ms_p50"] = round(_percentile(latencies, 50), 3)
+        row["latency_ms_p95"] = round(_percentile(latencies, 95), 3)
+    return row
+
+
+# ── Run ─────────────────────────────────────────────────────────────
+
+async def _llm_pass(service, corpus: list[dict]) -> list[tuple[dict, float]]:
+    """Sequential LLM parses, so each latency is a single request's."""
+    runs = []
+    for sample in corpus:
+        started = time.perf_counter()
+        parsed = await service.parse_receipt(sample["raw_text"])
+        runs.append((parsed.model_dump(), 1000 * (time.perf_counter() - started)))
+    return runs
+
+
+def run(corpus: list[dict], with_llm: bool) -> dict:
+    service = None
+    if with_llm:
+        from ocr_service import OCRService
+        service = OCRService(load_ocr=False)
+        service.parse_cache = None  # measure the model, not the cache
+        service.use_rule_parser = False
+
+    rule_scores, rule_lat, accepted = [], [], []
+    llm_scores, llm_lat = [], []
+    tiered_scores, tiered_lat = [], []
+
+    llm_runs = asyncio.run(_llm_pass(service, corpus)) if service is not None else None
+
+    for n, sample in enumerate(corpus):
+        regions = (sample.get("ocr_regions") or {}).get("text_regions")
+        expected = sample["expected"]
+
+        started = time.perf_counter()
+        rules = parse_receipt_rules(sample["raw_text"], regions)
+        rules_ms = 1000 * (time.perf_counter() - started)
+        rule_scores.append(_score(rules.fields(), expected))
+        rule_lat.append(rules_ms)
+
+        confident = rules.consistent and rules.confidence >= RULE_PARSER_MIN_CONFIDENCE
+        if confident:
+            accepted.append(rule_scores[-1])
+
+        if service is not None:
+            parsed, llm_ms = llm_runs[n]
+            llm_scores.append(_score(parsed, expected))
+            llm_lat.append(llm_ms)
+            tiered_scores.append(rule_scores[-1] if confident else llm_scores[-1])
+            tiered_lat.append(rules_ms if confident else rules_ms + llm_ms)
+
+    results = [
+        _summarise("rules", rule_scores, rule_lat),
+        _summarise("rules (accepted only)", accepted, [],
+                   accept_rate=round(len(accepted) / len(corpus), 4)),
+    ]
+    if service is not None:
+        results.append(_summarise("llm", llm_scores, llm_lat))
+        results.append(_summarise("tiered", tiered_scores, tiered_lat,
+                                  llm_calls=len(corpus) - len(accepted)))
+    else:
+        results.append({"tier": "tiered", "receipts": len(corpus),
+                        "llm_calls": len(corpus) - len(accepted)})
+
+    return {"min_confidence": RULE_PARSER_MIN_CONFIDENCE, "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("folder", nargs="?", help="Directory of labelled *.json receipts")
+    parser.add_argument("--synthetic", type=int, default=0, help="Generate this many receipts instead")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--llm", action="store_true", help="Also run the LLM tier (needs OPENAI_API_KEY)")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        corpus = _synthetic(args.synthetic, args.seed)
+    elif args.folder:
+        corpus = _load_corpus(args.folder)
+    else:
+        parser.error("pass a corpus folder or --synthetic N")
+    if not corpus:
+        raise SystemExit("Empty corpus")
+
+    report = run(corpus, args.llm)
+
+    header = (f"{'tier':<22} {'n':>5} {'merch':>6} {'date':>6} {'total':>6} {'tax':>6} "
+              f"{'items':>6} {'exact':>6} {'p50 ms':>8} {'p95 ms':>8}")
+    print(f"Rule parser accepts at confidence >= {report['min_confidence']}")
+    print(header)
+    print("-" * len(header))
+    for r in report["results"]:
+        if "exact_acc" not in r:
+            print(f"{r['tier']:<22} {r['receipts']:>5}   → {r['llm_calls']} receipts would reach the LLM")
+            continue
+        print(f"{r['tier']:<22} {r['receipts']:>5} {r['merchant_acc']:>6} {r['date_acc']:>6} "
+              f"{r['total_acc']:>6} {r['tax_acc']:>6} {r['items_acc']:>6} {r['exact_acc']:>6} "
+              f"{r.get('latency_ms_p50', ''):>8} {r.get('latency_ms_p95', ''):>8}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Rerank cutoff benchmark ─ recall vs. cross-encoder work per fusion setting.
+
+Run from backend/:
+    python -m benchmarks.rerank_cutoff [--size 5000] [--queries 200] [--json results.json]
+    python -m benchmarks.rerank_cutoff --real-models
+
+Fills a temporary store with the synthetic corpus of `benchmarks.rag`
+and writes "known-item" questions, each from one receipt's merchant,
+items, date or amounts.  Per question the dense and sparse rankings are
+fetched once and every candidate is scored by the cross-encoder: that
+"rerank all" order is the reference.  Each setting (fusion method ×
+RERANK_TOP_N × RERANK_MARGIN × RERANK_SKIP_AGREEMENT) is then replayed
+through fusion.py exactly as `RAGService.retrieve` applies it:
+
+  pairs       cross-encoder pairs per query (the cost; predict is ~linear in it)
+  rerank ms   measured predict time for those pairs, per query
+  skipped     share of queries where the cross-encoder did not run at all
+  overlap@k   share of the reference top-k the setting returns
+  recall@k    the receipt the question was written from is in the top-k
+  mrr         its mean reciprocal rank (0 when outside the top-k)
+
+With the stand-in models (default) the reranker is a token-overlap
+score, so the curves show the mechanics rather than model quality; use
+`--real-models` for numbers worth choosing defaults from.
+"""
+import argparse
+import asyncio
+import json
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from benchmarks.rag import latency_ms, open_service, synthetic_receipts, wait_ready
+from fusion import RerankPolicy, merge_reranked
+
+# Same cut-off RAGService.retrieve applies to cross-encoder logits
+MIN_SCORE = -5
+
+
+# ── Queries ─────────────────────────────────────────────────────────
+
+def known_item_queries(receipts: list[dict], ids: list[str], count: int, seed: int) -> list[tuple[str, str]]:
+    """(question, ID of the receipt it was written from) pairs."""
+    rng = random.Random(seed + 2)
+    templates = (
+        "{item} and {item2} from {merchant}",
+        "{merchant} receipt on {date}",
+        "the {item} I bought on {date}",
+        "{item} for ${price}",
+        "how much did I pay at {merchant} for {item}",
+        "{merchant} total ${total}",
+    )
+    queries = []
+    for index in rng.sample(range(len(receipts)), min(count, len(receipts))):
+        text, meta = receipts[index]["text"], receipts[index]["metadata"]
+        lines = [line[2:] for line in text.splitlines() if line.startswith("- ")]
+        picked = [line.rsplit(": $", 1) for line in rng.sample(lines, min(2, len(lines)))]
+        item, price = picked[0][0], picked[0][1].split(" ")[0]
+        queries.append((rng.choice(templates).format(
+            item=item.lower(),
+            item2=(picked[-1][0]).lower(),
+            price=price,
+            merchant=meta["title"],
+            date=meta["date"],
+            total=f"{meta['total']:.2f}",
+        ), ids[index]))
+    return queries
+
+
+# ── Settings ────────────────────────────────────────────────────────
+
+def settings_grid() -> list[tuple[str, RerankPolicy | None]]:
+    """(label, policy); None = fusion only, no cross-encoder."""
+    grid: list[tuple[str, RerankPolicy | None]] = [
+        ("rerank all (previous behaviour)", RerankPolicy(method="rrf", top_n=0, margin=0.0, skip_agreement=0.0)),
+        ("rrf, no rerank", None),
+    ]
+    for method in ("rrf", "weighted"):
+        for top_n in (3, 5, 8, 10, 12):
+            for margin in (0.0, 0.05, 0.1, 0.25):
+                grid.append((f"{method} top_n={top_n} margin={margin}",
+                             RerankPolicy(method=method, top_n=top_n, margin=margin, skip_agreement=0.0)))
+    for skip in (0.6, 0.8, 1.0):
+        grid.append((f"rrf top_n=10 skip>={skip}",
+                     RerankPolicy(method="rrf", top_n=10, margin=0.0, skip_agreement=skip)))
+    return grid
+
+
+# ── Run ─────────────────────────────────────────────────────────────
+
+async def _collect(service, model, queries: list[tuple[str, str]], top_k: int) -> list[dict]:
+    """Per query: both rankings, and a cross-encoder score for every candidate."""
+    runs = []
+    for query, target in queries:
+        dense, sparse = await service._search(query, top_k)
+        docs = {doc_id: hit["doc"] for doc_id, hit in dense.items()}
+        sparse_only = [doc_id for doc_id, _ in sparse if doc_id not in docs]
+        docs.update({doc_id: hit["doc"] for doc_id, hit in service._hydrate(sparse_only).items()})
+        candidate_ids = list(docs)
+        scores = model.predict([[query, docs[d]] for d in candidate_ids], batch_size=max(len(candidate_ids), 1))
+        runs.append({
+            "query": query,
+            "target": target,
+            "dense": [(doc_id, -hit["distance"]) for doc_id, hit in dense.items()],
+            "sparse": sparse,
+            "docs": docs,
+            "scores": {doc_id: float(s) for doc_id, s in zip(candidate_ids, scores)},
+        })
+    return runs
+
+
+def _replay(policy: RerankPolicy | None, runs: list[dict], model, top_k: int) -> list[dict]:
+    fusion = policy or RerankPolicy(method="rrf")
+    results = []
+    for run in runs:
+        fused = fusion.fuse(run["dense"], run["sparse"])
+        selected = [] if policy is None else policy.select(
+            fused, [d for d, _ in run["dense"]], [d for d, _ in run["sparse"]], top_k,
+        )
+        predict_s = 0.0
+        if selected:
+            started = time.perf_counter()
+            model.predict([[run["query"], run["docs"][d]] for d in selected], batch_size=len(selected))
+            predict_s = time.perf_counter() - started
+        dense_ids = {d for d, _ in run["dense"]}
+        corroborated = {d for d, _ in run["sparse"] if d in dense_ids}
+        ranked = merge_reranked(fused, {d: run["scores"][d] for d in selected}, top_k, MIN_SCORE, corroborated)
+        results.append({"ids": [doc_id for doc_id, _, _ in ranked], "pairs": len(selected), "predict_s": predict_s})
+    return results
+
+
+def _summarise(label: str, results: list[dict], reference: list[dict], runs: list[dict], top_k: int) -> dict:
+    overlap, recall, rr = [], [], []
+    for result, ref, run in zip(results, reference, runs):
+        if ref["ids"]:
+            overlap.append(len(set(result["ids"]) & set(ref["ids"])) / len(ref["ids"]))
+        rank = result["ids"].index(run["target"]) + 1 if run["target"] in result["ids"] else 0
+        recall.append(1.0 if rank else 0.0)
+        rr.append(1.0 / rank if rank else 0.0)
+    return {
+        "setting": label,
+        "pairs_per_query": round(statistics.mean(r["pairs"] for r in results), 2),
+        "rerank_ms": latency_ms([r["predict_s"] for r in results if r["pairs"]]),
+        "skipped": round(sum(1 for r in results if not r["pairs"]) / len(results), 4),
+        f"overlap_at_{top_k}": round(statistics.mean(overlap), 4) if overlap else 0.0,
+        f"recall_at_{top_k}": round(statistics.mean(recall), 4),
+        "mrr": round(statistics.mean(rr), 4),
+    }
+
+
+def run(size: int, opts: dict) -> dict:
+    workdir = tempfile.mkdtemp(prefix=f"spendly_rerank_{size}_")
+    try:
+        service, _ = open_service(workdir, opts["stub_models"])
+        wait_ready()
+        from startup import startup
+        model = startup.result("reranker")
+
+        receipts = synthetic_receipts(size, opts["seed"])
+        ids: list[str] = []
+        for start in range(0, len(receipts), 1000):
+            ids += service.add_receipts(receipts[start:start + 1000])
+
+        queries = known_item_queries(receipts, ids, opts["queries"], opts["seed"])
+        runs = asyncio.run(_collect(service, model, queries, opts["top_k"]))
+        top_k = opts["top_k"]
+
+        rows = []
+        reference = None
+        for label, policy in settings_grid():
+            results = _replay(policy, runs, model, top_k)
+            reference = reference or results  # the first setting reranks everything
+            rows.append(_summarise(label, results, reference, runs, top_k))
+        service.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "config": {**opts, "size": size, "models": "stub" if opts["stub_models"] else "real"},
+        "avg_candidates": round(statistics.mean(len(r["docs"]) for r in runs), 2),
+        "results": rows,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=5000, help="Receipts in the store")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--real-models", action="store_true",
+                        help="Use the real ONNX embedder and cross-encoder instead of stand-ins")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    opts = {"queries": args.queries, "top_k": args.top_k, "seed": args.seed, "stub_models": not args.real_models}
+    report = run(args.size, opts)
+    k = args.top_k
+
+    print(f"{args.size} receipts, {args.queries} known-item queries, top_k={k}, "
+          f"{report['avg_candidates']} candidates/query, models: {report['config']['models']}")
+    header = (f"{'setting':<36} {'pairs':>6} {'rrk ms':>7} {'skip':>6} "
+              f"{f'ovl@{k}':>7} {f'rec@{k}':>7} {'mrr':>6}")
+    print(header)
+    print("-" * len(header))
+    for r in sorted(report["results"], key=lambda r: r["pairs_per_query"]):
+        print(f"{r['setting']:<36} {r['pairs_per_query']:>6} {r['rerank_ms'].get('mean', ''):>7} "
+              f"{r['skipped']:>6} {r[f'overlap_at_{k}']:>7} {r[f'recall_at_{k}']:>7} {r['mrr']:>6}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+from typing import Any
+import hashlib
+import os
+import re
+
+from lru_cache import LRUCache
+
+# Cached OCR results keyed by image hash; 0 disables the gate
+DEDUP_IMAGE_CACHE_SIZE = int(os.getenv("DEDUP_IMAGE_CACHE_SIZE", "256"))
+# Cached parse results keyed by normalised OCR text; 0 disables the gate
+DEDUP_TEXT_CACHE_SIZE = int(os.getenv("DEDUP_TEXT_CACHE_SIZE", "1024"))
+
+
+# ── Content-Addressed Deduplication ────────────────────────────────
+#
+# The same receipt photo tends to be uploaded more than once.  Three
+# gates keep a re-upload from costing a PaddleOCR run, an LLM parse and
+# a second Chroma document:
+#
+#   image bytes      ─sha256→  cached OCRResult          (/ocr/scan)
+#   normalised text  ─sha256→  cached ReceiptData        (/ocr/parse)
+#   merchant/date/total/items ─sha1→ `dedup_key` in metadata   (add_receipt)
+#
+# The stored-receipt key includes the item lines, so two genuine
+# purchases with the same merchant, date and total (two identical
+# coffees, a split bill) are only merged when their items match too.
+# Text is normalised (case, whitespace) before hashing so a re-scan of
+# the same photo still matches when OCR output differs only in spacing.
+
+_WS_RE = re.compile(r"\s+")
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9]+")
+
+
+def image_key(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def normalize_text(text: str) -> str:
+    return _WS_RE.sub(" ", text).strip().lower()
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def item_lines(text: str) -> list[str]:
+    """The receipt's "- item: $price (qty: n)" lines, normalised and sorted."""
+    return sorted(normalize_text(line) for line in text.splitlines() if line.lstrip().startswith("- "))
+
+
+def receipt_key(merchant: str, date: str, total: float, items: list[str]) -> str | None:
+    """
+    Near-duplicate key for a stored receipt.  Returns None when the
+    fields are too generic to identify one (unknown merchant or no total),
+    so unrelated half-parsed receipts never collapse into one.
+    """
+    name = _NON_ALNUM_RE.sub("", str(merchant).lower())
+    if not name or name.startswith("unknown") or not total:
+        return None
+    raw = "|".join([name, str(date).strip().lower(), f"{round(float(total), 2):.2f}", *items])
+    return "receipt:" + hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class ContentDedup:
+    """Hash-keyed caches in front of OCR and receipt parsing."""
+
+    def __init__(self, image_entries: int = DEDUP_IMAGE_CACHE_SIZE,
+                 text_entries: int = DEDUP_TEXT_CACHE_SIZE):
+        self.images = LRUCache(image_entries)
+        self.texts = LRUCache(text_entries)
+
+    def get_ocr(self, image_bytes: bytes) -> tuple[str, Any]:
+        key = image_key(image_bytes)
+        return key, self.images.get(key)
+
+    def put_ocr(self, key: str, ocr_result: Any) -> None:
+        self.images.put(key, ocr_result)
+
+    def get_parse(self, raw_text: str) -> tuple[str, Any]:
+        key = text_key(raw_text)
+        return key, self.texts.get(key)
+
+    def put_parse(self, key: str, parsed: Any) -> None:
+        self.texts.put(key, parsed)
+
+    def stats(self) -> dict:
+        return {
+            "image": self.images.stats(),
+            "parse_text": self.texts.stats(),
+        }
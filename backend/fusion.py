@@ -0,0 +1,140 @@
+from dataclasses import dataclass
+import os
+
+# How dense and sparse rankings are merged: "rrf" (reciprocal rank) or "weighted" (normalised scores)
+RAG_FUSION = os.getenv("RAG_FUSION", "rrf").lower()
+# RRF damping constant; larger values flatten the gap between ranks
+RAG_RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+# Weighted fusion: share of the dense score (the rest is BM25)
+RAG_DENSE_WEIGHT = float(os.getenv("RAG_DENSE_WEIGHT", "0.5"))
+# Fused candidates always scored by the cross-encoder (0 = every candidate)
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "10"))
+# Candidates past the head are reranked too while their fused score trails the head's last one
+# by at most this fraction of the candidates' fused-score spread
+RERANK_MARGIN = float(os.getenv("RERANK_MARGIN", "0"))
+# Skip the cross-encoder when this share of the dense and sparse top-k agree (0 = always rerank)
+RERANK_SKIP_AGREEMENT = float(os.getenv("RERANK_SKIP_AGREEMENT", "0"))
+
+
+# ── Rank Fusion ────────────────────────────────────────────────────
+#
+# Dense (Chroma) and sparse (BM25) hits are merged into one ranking
+# before the cross-encoder runs, so its work can be limited to where
+# the ordering is actually in doubt:
+#
+#   - the fused head (RERANK_TOP_N) is always reranked;
+#   - candidates just below the head are added while their fused score
+#     is within RERANK_MARGIN (a fraction of the best-to-worst spread)
+#     of the head's last one: a near-tie at the cut is exactly where
+#     reranking changes the answer;
+#   - when both retrievers return (nearly) the same top-k, the fused
+#     order is trusted as is and the cross-encoder is skipped.
+#
+# Candidates left out keep their fused order, below the reranked ones,
+# but only those both retrievers found: with no cross-encoder score
+# there is nothing like the reranker's `min_score` to judge them by, so
+# agreement between dense and sparse search is the relevance bar (this
+# is also the whole cut-off when reranking is skipped).  Their fused
+# score is on a different scale from the reranked logits and is not
+# reported as a relevance.
+# RRF only looks at ranks, so it needs no score calibration between
+# embedding distances and BM25; weighted fusion min-max normalises each
+# list first.  `benchmarks/rerank_cutoff.py` measures recall against
+# the number of pairs scored for different settings.
+
+def reciprocal_rank(rankings: list[list[str]], k: int = RAG_RRF_K) -> dict[str, float]:
+    """RRF: sum over rankings of 1 / (k + rank)."""
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return scores
+
+
+def weighted(dense: list[tuple[str, float]], sparse: list[tuple[str, float]],
+             dense_weight: float = RAG_DENSE_WEIGHT) -> dict[str, float]:
+    """Min-max normalised scores mixed by weight; a list missing a document adds 0."""
+    scores: dict[str, float] = {}
+    for weight, ranking in ((dense_weight, dense), (1.0 - dense_weight, sparse)):
+        if not ranking:
+            continue
+        values = [score for _, score in ranking]
+        low, span = min(values), max(values) - min(values)
+        for doc_id, score in ranking:
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight * ((score - low) / span if span else 1.0)
+    return scores
+
+
+def agreement(dense_ids: list[str], sparse_ids: list[str], k: int) -> float:
+    """Share of the top-k that both retrievers returned (0 if either came back empty)."""
+    k = min(k, len(dense_ids), len(sparse_ids))
+    if k <= 0:
+        return 0.0
+    return len(set(dense_ids[:k]) & set(sparse_ids[:k])) / k
+
+
+@dataclass
+class RerankPolicy:
+    method: str = RAG_FUSION
+    rrf_k: int = RAG_RRF_K
+    dense_weight: float = RAG_DENSE_WEIGHT
+    top_n: int = RERANK_TOP_N
+    margin: float = RERANK_MARGIN
+    skip_agreement: float = RERANK_SKIP_AGREEMENT
+
+    def fuse(self, dense: list[tuple[str, float]], sparse: list[tuple[str, float]]) -> list[tuple[str, float]]:
+        """
+        Merge (doc_id, score) lists, each best first with higher = better,
+        into one (doc_id, fused score) ranking.
+        """
+        if self.method == "weighted":
+            scores = weighted(dense, sparse, self.dense_weight)
+        else:
+            scores = reciprocal_rank([[d for d, _ in dense], [d for d, _ in sparse]], self.rrf_k)
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)
+
+    def select(self, fused: list[tuple[str, float]], dense_ids: list[str],
+               sparse_ids: list[str], top_k: int) -> list[str]:
+        """Candidates worth a cross-encoder score, in fused order (empty = trust the fusion)."""
+        if self.skip_agreement > 0 and agreement(dense_ids, sparse_ids, top_k) >= self.skip_agreement:
+            return []
+        if self.top_n <= 0 or len(fused) <= self.top_n:
+            return [doc_id for doc_id, _ in fused]
+
+        selected = fused[:self.top_n]
+        cut = selected[-1][1] - self.margin * (fused[0][1] - fused[-1][1])
+        for doc_id, score in fused[self.top_n:]:
+            if self.margin <= 0 or score < cut:
+                break
+            selected.append((doc_id, score))
+        return [doc_id for doc_id, _ in selected]
+
+
+def merge_reranked(fused: list[tuple[str, float]], rerank_scores: dict[str, float],
+                   top_k: int, min_score: float, corroborated: set[str]) -> list[tuple[str, float, bool]]:
+    """
+    Final order as (doc_id, score, reranked): reranked candidates by
+    cross-encoder score (dropping those under `min_score`), then, if
+    fewer than `top_k` were kept, the next `corroborated` ones in fused
+    order with their fused score.
+    """
+    reranked = sorted(
+        ((doc_id, score) for doc_id, score in rerank_scores.items() if score >= min_score),
+        key=lambda x: x[1],
+        reverse=True,
+    )[:top_k]
+    ranked = [(doc_id, score, True) for doc_id, score in reranked]
+    fill = fused_fill(fused, rerank_scores, top_k - len(reranked), corroborated)
+    ranked += [(doc_id, score, False) for doc_id, score in fill]
+    return ranked
+
+
+def fused_fill(fused: list[tuple[str, float]], exclude: dict | set, slots: int,
+               corroborated: set[str]) -> list[tuple[str, float]]:
+    """Up to `slots` fused candidates found by both retrievers, skipping `exclude`."""
+    if slots <= 0:
+        return []
+    return [
+        (doc_id, score) for doc_id, score in fused
+        if doc_id not in exclude and doc_id in corroborated
+    ][:slots]
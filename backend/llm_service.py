@@ -1,36 +1,158 @@
 import os
-from openai import OpenAI
+import asyncio
+import logging
+import time
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from dotenv import load_dotenv
 from rag_service import RAGService
-from memory_service import memory
+from memory_service import LocalMemoryStore, MemoryService, DEFAULT_SESSION, MEMORY_SUMMARY_TOKENS
+from response_cache import SemanticResponseCache
+from metrics import CHAT_STREAM_SECONDS, CHAT_TTFT_SECONDS, METRICS_ENABLED
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Pooled HTTP connections shared by every concurrent chat stream
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "60"))
+
+# Opt-in semantic answer cache (see response_cache.py)
+CHAT_CACHE_ENABLED = os.getenv("CHAT_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+CHAT_CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", "512"))
+CHAT_CACHE_SIMILARITY = float(os.getenv("CHAT_CACHE_SIMILARITY", "0.95"))
+
+# Model that folds old turns into the rolling conversation summary (MEMORY_MODE=summary)
+MEMORY_SUMMARY_MODEL = os.getenv("MEMORY_SUMMARY_MODEL", "openai/gpt-4.1-mini")
+
+SUMMARY_PROMPT = """You maintain the running summary of a chat between a user and Trace, \
+an assistant that answers questions about the user's receipts.
+Merge the new turns into the summary. Keep what later questions may refer to: \
+merchants, dates, amounts, totals already computed, and the user's open questions or preferences.
+Drop greetings and filler. Reply with the updated summary only, at most {words} words."""
+
 class ReceiptAssistant:
-    def __init__(self, rag_service: RAGService):
+    def __init__(self, rag_service: RAGService, memory_store=None):
         # Initialize RAG service
         self.rag_service = rag_service
+        # Per-session conversation memory (LocalMemoryStore or MongoMemoryStore)
+        self.memory_store = memory_store or LocalMemoryStore()
         
-        # Initialize OpenAI client with GitHub configuration
-        self.client = OpenAI(
+        # Async OpenAI client with GitHub configuration.  One pooled
+        # httpx client is reused across requests (keep-alive, no per-call
+        # TLS handshake); reads never block the event loop.
+        self.client = AsyncOpenAI(
             base_url="https://models.github.ai/inference",
-            api_key=os.environ.get("GITHUB_TOKEN")
+            api_key=os.environ.get("GITHUB_TOKEN"),
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_CONNECTIONS,
+                ),
+                timeout=httpx.Timeout(LLM_TIMEOUT_S, connect=10.0),
+            ),
+        )
+
+        self.response_cache = (
+            SemanticResponseCache(CHAT_CACHE_SIZE, CHAT_CACHE_SIMILARITY)
+            if CHAT_CACHE_ENABLED else None
         )
+        # Background summary updates (kept referenced until done)
+        self._memory_tasks: set[asyncio.Task] = set()
+
+    async def _summarize(self, summary: str, transcript: str) -> str:
+        """Fold `transcript` into the running conversation `summary`."""
+        response = await self.client.chat.completions.create(
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT.format(words=MEMORY_SUMMARY_TOKENS * 3 // 4)},
+                {"role": "user", "content": f"Summary so far:\n{summary or '(empty)'}\n\nNew turns:\n{transcript}"},
+            ],
+            model=MEMORY_SUMMARY_MODEL,
+            temperature=0,
+            max_tokens=MEMORY_SUMMARY_TOKENS,
+        )
+        return response.choices[0].message.content or ""
+
+    async def _remember(self, session_id: str, memory: MemoryService):
+        """Save the session; summarise turns that left its window off the response path."""
+        await self.memory_store.save(session_id, memory)
+        if memory.needs_compaction:
+            task = asyncio.create_task(self._compact_memory(session_id, memory))
+            self._memory_tasks.add(task)
+            task.add_done_callback(self._memory_tasks.discard)
+
+    async def _compact_memory(self, session_id: str, memory: MemoryService):
+        try:
+            await memory.compact(self._summarize)
+            # A clear (or a newer save) while the summary was written wins;
+            # this copy is stale and is dropped
+            if not await self.memory_store.save_if_current(session_id, memory):
+                logger.info(f"Chat session {session_id} changed during its summary update; not saved")
+        except Exception as e:
+            logger.error(f"Updating the summary of chat session {session_id} failed: {e}")
+
+    async def clear_memory(self, session_id: str = DEFAULT_SESSION):
+        await self.memory_store.clear(session_id)
         
-    async def ask_stream(self, query):
+    async def ask_stream(self, query, session_id: str = DEFAULT_SESSION):
         """
         Process a user query using RAG and stream the response token by token.
         Yields content chunks as they arrive from the LLM.
-        After streaming completes, the full response is saved to memory.
+        After streaming completes, the question and the full response are
+        saved to the session's memory together.
+
+        Tokens are pulled from the upstream stream only when the consumer
+        asks for the next one, so a slow SSE client slows the upstream
+        read instead of buffering.  If the consumer goes away (generator
+        closed or cancelled) the upstream request is aborted.
+
+        With the response cache enabled, a near-identical question over
+        the same receipts replays the cached answer instead.
+
+        Spending questions also get exact figures from the analytics
+        store, next to the retrieved receipts; only pure aggregates ("how
+        much did I spend last month", "spending by category") skip
+        retrieval.
         """
-        # Get relevant context from RAG service
-        context = await self.rag_service.get_relevant_context(query)
-        
-        # Get chat history
-        chat_history = memory.get_chat_history()
-        
-        # Construct the prompt with context and chat history
+        request_started = time.perf_counter()
+        memory = await self.memory_store.load(session_id)
+
+        await self.rag_service.ready()
+        intent = await asyncio.to_thread(self.rag_service.query_intent, query)
+        spending = await asyncio.to_thread(self.rag_service.spending_context, query, intent)
+        if spending is not None and intent.summary_only:
+            hits = []
+            context = "Not needed: answer from the spending summary."
+        else:
+            # Get relevant context from RAG service
+            hits = await self.rag_service.retrieve(query, intent=intent)
+            context = self.rag_service.format_context(hits)
+
+        # Recent turns verbatim plus a summary of older ones, within budget
+        history = memory.prompt_messages()
+
+        cache_key = None
+        if self.response_cache is not None:
+            cache_key = (
+                await self.rag_service.embed_query(query),
+                # Follow-ups depend on the conversation, so it is part of the key
+                self.response_cache.fingerprint(
+                    [hit["id"] for hit in hits] + ([spending] if spending else []), history,
+                ),
+                self.rag_service.corpus_version,
+            )
+            cached = self.response_cache.lookup(*cache_key)
+            if cached is not None:
+                for piece in self.response_cache.chunks(cached.answer):
+                    yield piece
+                memory.add_user_message(query)
+                memory.add_ai_message(cached.answer)
+                await self._remember(session_id, memory)
+                return
+
+        # Construct the prompt with context; history follows as chat messages
         system_prompt = f""" <system_prompt>
     <identity>
         <name>Trace</name>
@@ -49,23 +171,23 @@ class ReceiptAssistant:
         </insufficient_data>
     </error_handling>
     <context>
+        <spending_summary>{spending or 'Not applicable'}</spending_summary>
         <receipt_data>{context}</receipt_data>
     </context>
-    <conversation_history>
-        <chat>{chat_history if chat_history else 'No previous conversation'}</chat>
-    </conversation_history>
+    <instructions>
+        <instruction>The spending summary is computed exactly over every stored receipt. Quote its figures as-is; never re-add amounts yourself.</instruction>
+    </instructions>
 </system_prompt>"""
 
-        # Add user message to memory
-        memory.add_user_message(query)
-
         # Stream response from OpenAI with GitHub configuration
-        stream = self.client.chat.completions.create(
+        started = time.monotonic()
+        stream = await self.client.chat.completions.create(
             messages=[
                 {
                     "role": "system",
                     "content": system_prompt,
                 },
+                *history,
                 {
                     "role": "user",
                     "content": query,
@@ -78,11 +200,34 @@ class ReceiptAssistant:
         )
 
         full_response = ""
-        for chunk in stream:
-            if chunk.choices and chunk.choices[0].delta.content:
-                token = chunk.choices[0].delta.content
-                full_response += token
-                yield token
-
-        # Save the complete response to memory after streaming finishes
-        memory.add_ai_message(full_response)
\ No newline at end of file
+        completed = False
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    token = chunk.choices[0].delta.content
+                    if not full_response and METRICS_ENABLED:
+                        CHAT_TTFT_SECONDS.observe(time.perf_counter() - request_started)
+                    full_response += token
+                    yield token
+            completed = True
+            if METRICS_ENABLED:
+                CHAT_STREAM_SECONDS.observe(time.perf_counter() - request_started)
+        finally:
+            if not completed:
+                # Client disconnected or errored mid-stream: close the
+                # upstream HTTP response so the provider stops generating.
+                await stream.close()
+                logger.info(f"Chat stream aborted after {len(full_response)} chars")
+
+        # Save the exchange only once the answer is complete, so an aborted
+        # stream leaves no unanswered user turn in the session
+        memory.add_user_message(query)
+        memory.add_ai_message(full_response)
+        await self._remember(session_id, memory)
+
+        if cache_key is not None:
+            embedding, fingerprint, corpus_version = cache_key
+            self.response_cache.store(
+                query, embedding, fingerprint, corpus_version,
+                full_response, time.monotonic() - started,
+            )
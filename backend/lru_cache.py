@@ -0,0 +1,93 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Hashable
+
+
+# ── Bounded LRU Cache ──────────────────────────────────────────────
+#
+# Thread-safe LRU used by the hot-path caches.  Entries can carry a
+# `tag` (e.g. the receipt ID they were derived from) so every entry
+# that depends on one document can be dropped when it changes.
+
+class LRUCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: OrderedDict[Hashable, Any] = OrderedDict()
+        self._tags: dict[Hashable, set[Hashable]] = {}
+        self._key_tag: dict[Hashable, Hashable] = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, tag: Hashable | None = None) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if key in self._data:
+                self._untag(key)
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if tag is not None:
+                self._tags.setdefault(tag, set()).add(key)
+                self._key_tag[key] = tag
+
+            while len(self._data) > self.max_entries:
+                old_key, _ = self._data.popitem(last=False)
+                self._untag(old_key)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            self._untag(key)
+            return self._data.pop(key, default)
+
+    def invalidate_tag(self, tag: Hashable) -> int:
+        """Drop every entry stored under `tag`; returns how many."""
+        with self._lock:
+            keys = self._tags.pop(tag, set())
+            for key in keys:
+                self._key_tag.pop(key, None)
+                self._data.pop(key, None)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._tags.clear()
+            self._key_tag.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def _untag(self, key: Hashable) -> None:
+        tag = self._key_tag.pop(key, None)
+        if tag is None:
+            return
+        keys = self._tags.get(tag)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
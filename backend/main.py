@@ -1,14 +1,23 @@
+import time
+_import_started = time.perf_counter()
+
 from fastapi import FastAPI, HTTPException, Request, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse, StreamingResponse
-from pydantic import BaseModel, ValidationError
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
 from dotenv import load_dotenv
 from llm_service import ReceiptAssistant
 from rag_service import RAGService
-from memory_service import memory
+from memory_service import LocalMemoryStore, MongoMemoryStore, MEMORY_STORE, DEFAULT_SESSION
 from ocr_service import OCRService
+from ocr_pool import OCRPool, OCRPoolSaturated, OCR_WORKERS, OCR_BATCH_SIZE
+from dedup import ContentDedup
+from startup import startup
+from metrics import registry, ServerTimingMiddleware
 from datetime import datetime
+import asyncio
+import json
 import logging
 from pymongo import MongoClient
 import os
@@ -17,9 +26,17 @@ import os
 # env + intilize services
 load_dotenv()
 app = FastAPI()
+# Cheap to construct: models and indexes are registered with `startup`
+# and load concurrently once the app starts (see startup.py)
 rag_service = RAGService()
-ai = ReceiptAssistant(rag_service=rag_service)
-ocr_service = OCRService()
+ocr_service = OCRService(load_ocr=False)
+ocr_pool = OCRPool(local_service=ocr_service if OCR_WORKERS == 0 else None)
+if OCR_WORKERS == 0:
+    startup.add("ocr", ocr_service.load_ocr_model, warmup=lambda service: service.warmup())
+else:
+    # PaddleOCR lives in the worker processes, which warm up as they spawn
+    startup.add("ocr", ocr_pool.wait_ready)
+dedup = ContentDedup()
 
 MONGODB_URI = os.getenv("MONGODB_URI")
 if not MONGODB_URI:
@@ -28,17 +45,30 @@ client = MongoClient(MONGODB_URI)
 db = client["receipts_db"]
 receipts_collection = db["receipts"]
 
+# Chat memory per session; Mongo-backed when several workers serve chat
+memory_store = (
+    MongoMemoryStore(db["chat_sessions"]) if MEMORY_STORE == "mongo"
+    else LocalMemoryStore()
+)
+ai = ReceiptAssistant(rag_service=rag_service, memory_store=memory_store)
+
+logging.info(f"main.py imported in {time.perf_counter() - _import_started:.2f}s")
+
 # Validate services on startup
 @app.on_event("startup")
 async def validate_services():
     try:
         _ = rag_service.collection.count()
         logging.info("RAG service initialized successfully")
-        
-        # Initialize and validate memory service
-        _ = memory.get_chat_history()
-        logging.info("Memory service initialized successfully")
-        
+
+        # Reranker, embedder, indexes and OCR load in the background;
+        # /health answers now, /ready once they are all warm
+        startup.start()
+
+        # Initialize the chat session store
+        await memory_store.start()
+        logging.info(f"Memory store initialized ({MEMORY_STORE})")
+
     except Exception as e:
         logging.error(f"Failed to initialize services: {str(e)}")
         raise RuntimeError(f"Failed to initialize services: {str(e)}")
@@ -50,10 +80,18 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+# Per-route latency for /metrics; Server-Timing header if METRICS_SERVER_TIMING
+app.add_middleware(ServerTimingMiddleware)
 
 class ReceiptChatRequest(BaseModel):
     query: str
+    # Conversation to continue; clients without one share the default session
+    session_id: str = Field(DEFAULT_SESSION, min_length=1, max_length=128)
+
+class ClearChatRequest(BaseModel):
+    session_id: str = Field(DEFAULT_SESSION, min_length=1, max_length=128)
 
 # Model for storing receipts (keeping existing structure for compatibility)
 class StoreReceiptRequest(BaseModel):
@@ -63,35 +101,130 @@ class StoreReceiptRequest(BaseModel):
     items: list[dict]
     raw_text: str
 
+class StoreReceiptBatchRequest(BaseModel):
+    receipts: list[StoreReceiptRequest]
+
+class OCRRegions(BaseModel):
+    text_regions: list[dict] = []
+    image_width: int = 0
+    image_height: int = 0
+
 class ParseReceiptRequest(BaseModel):
     raw_text: str
+    # Boxes from /ocr/scan; lets the rule-based parser use the layout
+    ocr_regions: OCRRegions | None = None
+
+def scan_payload(ocr_result) -> dict:
+    """Response body shared by /ocr/scan and each /ocr/scan/batch line."""
+    return {
+        "status": "success",
+        "raw_text": ocr_result.raw_text,
+        "ocr_regions": {
+            "text_regions": [r.to_dict() for r in ocr_result.text_regions],
+            "image_width": ocr_result.image_width,
+            "image_height": ocr_result.image_height,
+        }
+    }
 
 # Step 1: Fast OCR-only — returns text + bounding boxes for the scanning animation
 @app.post("/ocr/scan")
 async def ocr_scan_endpoint(file: UploadFile = File(...)):
     try:
         image_bytes = await file.read()
-        ocr_result = ocr_service.extract_text_from_bytes(image_bytes)
+        await startup.wait("ocr")
 
-        return JSONResponse(content={
-            "status": "success",
-            "raw_text": ocr_result.raw_text,
-            "ocr_regions": {
-                "text_regions": [r.to_dict() for r in ocr_result.text_regions],
-                "image_width": ocr_result.image_width,
-                "image_height": ocr_result.image_height,
-            }
-        })
+        # Same photo uploaded again → reuse the earlier OCR result
+        image_key, ocr_result = dedup.get_ocr(image_bytes)
+        if ocr_result is None:
+            ocr_result = await ocr_pool.extract(image_bytes)
+            dedup.put_ocr(image_key, ocr_result)
+
+        return JSONResponse(content=scan_payload(ocr_result))
 
+    except OCRPoolSaturated as e:
+        logging.warning(f"OCR pool saturated: {str(e)}")
+        raise HTTPException(
+            status_code=503,
+            detail="OCR is busy, please retry shortly",
+            headers={"Retry-After": "2"},
+        )
+    except asyncio.TimeoutError:
+        logging.error("OCR timed out")
+        raise HTTPException(status_code=504, detail="OCR timed out")
     except Exception as e:
         logging.error(f"Error scanning receipt: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Bulk OCR for back-filling history: streams one NDJSON line per file as
+# its batch finishes, then a summary line with throughput.
+@app.post("/ocr/scan/batch")
+async def ocr_scan_batch_endpoint(files: list[UploadFile] = File(...)):
+    uploads = [(file.filename, await file.read()) for file in files]
+    await startup.wait("ocr")
+    chunks = [
+        (start, uploads[start:start + OCR_BATCH_SIZE])
+        for start in range(0, len(uploads), OCR_BATCH_SIZE)
+    ]
+
+    async def run_chunk(start: int, chunk: list):
+        try:
+            results = await ocr_pool.extract_batch([data for _, data in chunk])
+        except Exception as e:  # saturated / timed out / worker crash
+            results = [e] * len(chunk)
+        return start, chunk, results
+
+    async def ndjson_generator():
+        started = time.monotonic()
+        succeeded = failed = 0
+        queued = list(reversed(chunks))
+        in_flight: set[asyncio.Task] = set()
+        try:
+            while queued or in_flight:
+                # Keep at most one chunk per OCR worker in flight
+                while queued and len(in_flight) < max(ocr_pool.workers, 1):
+                    in_flight.add(asyncio.create_task(run_chunk(*queued.pop())))
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    start, chunk, results = task.result()
+                    for offset, ((filename, _), result) in enumerate(zip(chunk, results)):
+                        line = {"index": start + offset, "filename": filename}
+                        if isinstance(result, Exception):
+                            failed += 1
+                            logging.warning(f"Batch OCR failed for {filename}: {result}")
+                            line.update({"status": "error", "error": str(result) or type(result).__name__})
+                        else:
+                            succeeded += 1
+                            line.update(scan_payload(result))
+                        yield json.dumps(line) + "\n"
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+        elapsed = time.monotonic() - started
+        rate = len(uploads) / elapsed if elapsed > 0 else 0.0
+        logging.info(f"Batch OCR: {len(uploads)} files in {elapsed:.2f}s ({rate:.2f} images/s)")
+        yield json.dumps({
+            "status": "summary",
+            "files": len(uploads),
+            "succeeded": succeeded,
+            "failed": failed,
+            "elapsed_s": round(elapsed, 3),
+            "images_per_second": round(rate, 3),
+        }) + "\n"
+
+    return StreamingResponse(ndjson_generator(), media_type="application/x-ndjson")
+
 # Step 2: LLM parse + ChromaDB storage — called in parallel with the animation
 @app.post("/ocr/parse")
 async def ocr_parse_endpoint(request: ParseReceiptRequest):
     try:
-        parsed_data = ocr_service.parse_receipt(request.raw_text)
+        # Same OCR text parsed before → skip the LLM; add_receipt below
+        # then recognises the stored copy instead of writing a second one
+        text_key, parsed_data = dedup.get_parse(request.raw_text)
+        if parsed_data is None:
+            text_regions = request.ocr_regions.text_regions if request.ocr_regions else None
+            parsed_data = await ocr_service.parse_receipt(request.raw_text, text_regions)
 
         # Prepare structured document for ChromaDB
         merchant_name = parsed_data.merchant if parsed_data.merchant else "Unknown Business"
@@ -114,7 +247,10 @@ async def ocr_parse_endpoint(request: ParseReceiptRequest):
 
         # Store in ChromaDB with metadata
         if request.raw_text and request.raw_text.strip():
-            rag_service.add_receipt(
+            await rag_service.ready()
+            # Blocks on the write lock (a bulk import may hold it) and embeds: off the loop
+            await asyncio.to_thread(
+                rag_service.add_receipt,
                 text=structured_doc,
                 metadata={
                     "source": "receipt_ocr",
@@ -129,6 +265,10 @@ async def ocr_parse_endpoint(request: ParseReceiptRequest):
         else:
             logging.warning("Skipping RAG storage for receipt with empty text")
 
+        # parse_receipt returns an empty ReceiptData on LLM failure — don't pin that
+        if parsed_data.merchant or parsed_data.total or parsed_data.items:
+            dedup.put_parse(text_key, parsed_data)
+
         return JSONResponse(content={
             "status": "success",
             "data": parsed_data.model_dump(),
@@ -142,7 +282,7 @@ async def ocr_parse_endpoint(request: ParseReceiptRequest):
 async def receipt_chat(request: ReceiptChatRequest):
     async def event_generator():
         try:
-            async for token in ai.ask_stream(request.query):
+            async for token in ai.ask_stream(request.query, request.session_id):
                 # SSE format: each event is "data: <payload>\n\n"
                 yield f"data: {token}\n\n"
             # Signal the client that the stream is done
@@ -162,37 +302,42 @@ async def receipt_chat(request: ReceiptChatRequest):
     )
 
 # Store a receipt via the unified RAG service (consistent ID + metadata)
+def stored_receipt_document(receipt: StoreReceiptRequest) -> dict:
+    """Document text + metadata for a manually stored receipt."""
+    items_text = "\n".join(
+        [f"- {item.get('name', item.get('desc', 'Item'))}: "
+         f"${float(item.get('price', 0)):.2f}"
+         for item in receipt.items]
+    ) or "No items extracted"
+
+    receipt_text = (
+        f"Receipt from: {receipt.title}\n"
+        f"Date: {receipt.date}\n"
+        f"Total: ${receipt.total:.2f}\n\n"
+        f"Items:\n{items_text}"
+    )
+
+    return {
+        "text": receipt_text,
+        "metadata": {
+            "source": "manual_store",
+            "title": receipt.title,
+            "date": receipt.date,
+            "total": receipt.total,
+            "tax": 0.0,
+            "item_count": len(receipt.items),
+            "timestamp": datetime.now().isoformat(),
+        },
+    }
+
 @app.post("/receipts/store")
 async def store_receipt(receipt: StoreReceiptRequest):
     try:
         logging.info(f"Processing receipt store request for {receipt.title}")
 
-        items_text = "\n".join(
-            [f"- {item.get('name', item.get('desc', 'Item'))}: "
-             f"${float(item.get('price', 0)):.2f}"
-             for item in receipt.items]
-        ) or "No items extracted"
-
-        receipt_text = (
-            f"Receipt from: {receipt.title}\n"
-            f"Date: {receipt.date}\n"
-            f"Total: ${receipt.total:.2f}\n\n"
-            f"Items:\n{items_text}"
-        )
-
         # Use the single entry-point so ID, metadata, BM25 are all consistent
-        rag_service.add_receipt(
-            text=receipt_text,
-            metadata={
-                "source": "manual_store",
-                "title": receipt.title,
-                "date": receipt.date,
-                "total": receipt.total,
-                "tax": 0.0,
-                "item_count": len(receipt.items),
-                "timestamp": datetime.now().isoformat(),
-            },
-        )
+        await rag_service.ready()
+        await asyncio.to_thread(rag_service.add_receipt, **stored_receipt_document(receipt))
 
         logging.info(f"Successfully stored receipt for {receipt.title}")
         return {"status": "success", "message": "Receipt stored successfully"}
@@ -203,10 +348,36 @@ async def store_receipt(receipt: StoreReceiptRequest):
         logging.error(f"Error storing receipt: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Bulk import (e.g. a JSON/CSV export converted client-side) — one batched write
+@app.post("/receipts/store/batch")
+async def store_receipts_batch(request: StoreReceiptBatchRequest):
+    try:
+        logging.info(f"Processing batch store request for {len(request.receipts)} receipts")
+        started = time.monotonic()
+
+        documents = [stored_receipt_document(r) for r in request.receipts]
+        # Embedding thousands of documents is blocking work — keep it off the loop
+        ids = await asyncio.to_thread(rag_service.add_receipts, documents)
+
+        elapsed = time.monotonic() - started
+        logging.info(f"Stored {len(ids)} receipts in {elapsed:.2f}s")
+        return {
+            "status": "success",
+            "stored": len(ids),
+            "ids": ids,
+            "elapsed_s": round(elapsed, 3),
+        }
+    except ValidationError as e:
+        logging.error(f"Validation error while processing receipt batch: {str(e)}")
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        logging.error(f"Error storing receipt batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/ai/chat/clear")
-async def clear_chat_history():
+async def clear_chat_history(request: ClearChatRequest | None = None):
     try:
-        memory.clear()
+        await ai.clear_memory(request.session_id if request else DEFAULT_SESSION)
         return {"status": "success", "message": "Chat history cleared successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -215,6 +386,76 @@ async def clear_chat_history():
 async def health_check():
     return {"status": "healthy"}
 
+# Readiness (separate from liveness): 503 until every model is loaded and warm
+@app.get("/ready")
+async def readiness_check():
+    status = startup.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+# Runtime counters for the performance-sensitive components
+@app.get("/stats")
+async def service_stats():
+    return {
+        "rerank_batcher": rag_service.rerank_batcher.stats(),
+        "rerank_cache": rag_service.rerank_cache.stats(),
+        "retrieval": rag_service.retrieval_stats(),
+        "ocr_pool": ocr_pool.stats(),
+        "response_cache": (
+            ai.response_cache.stats() if ai.response_cache else {"enabled": False}
+        ),
+        "parse_tiers": ocr_service.parse_tiers,
+        "llm_parse": ocr_service.llm_stats(),
+        "parse_cache": (
+            ocr_service.parse_cache.stats() if ocr_service.parse_cache else {"enabled": False}
+        ),
+        "dedup": {
+            **dedup.stats(),
+            "receipts_skipped": rag_service.duplicates_skipped,
+        },
+        "memory": memory_store.stats(),
+    }
+
+# Values the services already count, read at scrape time
+def runtime_metrics():
+    dedup_stats = dedup.stats()
+    caches = {
+        "rerank": rag_service.rerank_cache.stats(),
+        "ocr_image": dedup_stats["image"],
+        "parse_text": dedup_stats["parse_text"],
+    }
+    if ocr_service.parse_cache:
+        caches["parse_sqlite"] = ocr_service.parse_cache.stats()
+    if ai.response_cache:
+        caches["response"] = ai.response_cache.stats()
+
+    yield ("spendly_cache_hits_total", "counter", "Cache lookups that hit.",
+           [({"cache": name}, c["hits"]) for name, c in caches.items()])
+    yield ("spendly_cache_misses_total", "counter", "Cache lookups that missed.",
+           [({"cache": name}, c["misses"]) for name, c in caches.items()])
+    yield ("spendly_cache_hit_ratio", "gauge", "Hits / lookups since start.",
+           [({"cache": name}, c["hit_rate"]) for name, c in caches.items()])
+    yield ("spendly_queue_depth", "gauge", "Work waiting or running in a bounded queue.", [
+        ({"queue": "rerank_batcher"}, rag_service.rerank_batcher.stats()["queue_depth"]),
+        ({"queue": "ocr_pool"}, ocr_pool.pending),
+    ])
+    yield ("spendly_receipt_parses_total", "counter", "Receipt parses by the tier that answered.",
+           [({"tier": tier}, n) for tier, n in ocr_service.parse_tiers.items()])
+    llm = ocr_service.llm_stats()
+    yield ("spendly_llm_parse_throttled_seconds_total", "counter",
+           "Time LLM parses waited on the client-side rate limiter.", [({}, llm["waited_s"])])
+    yield ("spendly_llm_parse_retries_total", "counter", "Retried LLM parse calls.", [({}, llm["retries"])])
+    yield ("spendly_receipts", "gauge", "Receipts in the analytics store.", [({}, len(rag_service.analytics))])
+    yield ("spendly_component_ready", "gauge", "1 once a background-loaded component is warm.",
+           [({"component": name}, int(c["state"] == "ready"))
+            for name, c in startup.status()["components"].items()])
+
+registry.add_collector(runtime_metrics)
+
+# Prometheus text exposition
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     error_details = []
@@ -230,12 +471,12 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
 @app.on_event("shutdown")
 async def shutdown_services():
     try:
-        # Close ChromaDB client
-        rag_service.chroma_client.close()
+        # Persist BM25, stop the retrieval executor
+        rag_service.close()
+        ocr_pool.close()
+        startup.shutdown()
+        if ocr_service.parse_cache:
+            ocr_service.parse_cache.close()
         logging.info("Services shut down successfully")
     except Exception as e:
         logging.error(f"Error during shutdown: {str(e)}")
-
-if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
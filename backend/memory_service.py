@@ -1,30 +1,409 @@
-from langchain.memory import ConversationBufferMemory
-from typing import Dict, List
-import json
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Awaitable, Callable, Dict, List
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# "trim": recent turns verbatim within a token budget, older turns dropped.
+# "summary": same window, older turns folded into a rolling summary (one
+# extra MEMORY_SUMMARY_MODEL call per compaction).  "buffer": keep every turn.
+MEMORY_MODE = os.getenv("MEMORY_MODE", "trim").lower()
+# Prompt tokens (estimated) spent on verbatim turns
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "2000"))
+# Verbatim turns (user + assistant message pairs) kept at most
+MEMORY_MAX_TURNS = int(os.getenv("MEMORY_MAX_TURNS", "8"))
+# Target length of the rolling summary
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "300"))
+
+# Where chat sessions live: "local" (this process) or "mongo" (shared by workers)
+MEMORY_STORE = os.getenv("MEMORY_STORE", "local").lower()
+# Sessions idle this long are forgotten
+MEMORY_SESSION_TTL_S = int(os.getenv("MEMORY_SESSION_TTL_S", "86400"))
+# In-process store: most sessions kept; the least recently used go first
+MEMORY_MAX_SESSIONS = int(os.getenv("MEMORY_MAX_SESSIONS", "1000"))
+# In-process store: total text held across sessions, evicted the same way; 0 = no size cap
+MEMORY_MAX_MB = float(os.getenv("MEMORY_MAX_MB", "64"))
+
+DEFAULT_SESSION = "default"
+
+# (current summary, transcript of the turns to fold in) → new summary
+Summarizer = Callable[[str, str], Awaitable[str]]
+
+
+# ── Conversation Memory ────────────────────────────────────────────
+#
+# The last few turns are kept verbatim as long as they fit
+# MEMORY_TOKEN_BUDGET.  By default turns that fall out of the window are
+# simply dropped.  In "summary" mode they are queued and folded into a
+# rolling summary instead, at the cost of one background LLM call per
+# compaction.  Each fold only sees the old summary plus the newly
+# evicted turns, so summarising never re-reads the whole conversation,
+# and building the prompt touches at most the window.
+#
+# Token counts are a chars/4 estimate, computed once per message.
+# Without a summarizer (or when it fails) evicted turns are folded in
+# extractively: the user's question, shortened.
+
+@dataclass
+class _Turn:
+    user: str
+    ai: str | None = None
+    tokens: int = 0
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English, plus per-message overhead
+    return len(text) // 4 + 4
+
 
 class MemoryService:
-    def __init__(self):
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True
-        )
-        
+    def __init__(self, mode: str = MEMORY_MODE, token_budget: int = MEMORY_TOKEN_BUDGET,
+                 max_turns: int = MEMORY_MAX_TURNS, summary_tokens: int = MEMORY_SUMMARY_TOKENS):
+        self.mode = mode
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.summary_tokens = summary_tokens
+
+        self._lock = Lock()
+        self._compacting = asyncio.Lock()
+        self._turns: deque[_Turn] = deque()
+        self._tokens = 0                   # sum of _turns[i].tokens
+        self._evicted: list[_Turn] = []    # waiting to be summarised
+        self.summary = ""
+        self.summarized_turns = 0
+        self._generation = 0               # bumped by clear()
+        self.version = ""                  # set by MongoMemoryStore on every save
+
+    @property
+    def bounded(self) -> bool:
+        return self.mode != "buffer"
+
     def add_user_message(self, message: str) -> None:
         """Add a user message to the conversation history"""
-        self.memory.chat_memory.add_user_message(message)
-        
+        with self._lock:
+            self._turns.append(_Turn(user=message, tokens=estimate_tokens(message)))
+            self._tokens += self._turns[-1].tokens
+
     def add_ai_message(self, message: str) -> None:
         """Add an AI message to the conversation history"""
-        self.memory.chat_memory.add_ai_message(message)
-        
+        with self._lock:
+            if not self._turns or self._turns[-1].ai is not None:
+                self._turns.append(_Turn(user=""))
+            turn = self._turns[-1]
+            turn.ai = message
+            added = estimate_tokens(message)
+            turn.tokens += added
+            self._tokens += added
+            self._trim()
+
+    def prompt_messages(self) -> List[Dict]:
+        """
+        Chat messages for the next request: the summary of older turns
+        (as a system message) followed by the recent turns verbatim.
+        """
+        with self._lock:
+            messages = []
+            if self.summary:
+                messages.append({
+                    "role": "system",
+                    "content": f"Summary of the earlier conversation:\n{self.summary}",
+                })
+            for turn in self._turns:
+                if turn.user:
+                    messages.append({"role": "user", "content": turn.user})
+                if turn.ai:
+                    messages.append({"role": "assistant", "content": turn.ai})
+            return messages
+
     def get_chat_history(self) -> List[Dict]:
-        """Get the current chat history"""
-        messages = self.memory.chat_memory.messages
-        return [{"role": msg.type, "content": msg.content} for msg in messages]
-        
+        """Get the recent (verbatim) chat history"""
+        return [m for m in self.prompt_messages() if m["role"] != "system"]
+
+    @property
+    def needs_compaction(self) -> bool:
+        return bool(self._evicted)
+
+    async def compact(self, summarize: Summarizer | None = None) -> None:
+        """Fold evicted turns into the rolling summary."""
+        async with self._compacting:
+            with self._lock:
+                pending = list(self._evicted)
+                summary = self.summary
+                generation = self._generation
+            if not pending:
+                return
+
+            updated = None
+            if summarize is not None:
+                try:
+                    updated = (await summarize(summary, self._transcript(pending))).strip()
+                except Exception as e:
+                    logger.warning(f"Conversation summary failed ({e}); folding turns extractively")
+            if not updated:
+                updated = self._fold_extractive(summary, pending)
+
+            with self._lock:
+                # clear() may have run while the summarizer was awaited
+                if generation != self._generation:
+                    return
+                del self._evicted[:len(pending)]
+                self.summary = updated
+                self.summarized_turns += len(pending)
+
     def clear(self) -> None:
         """Clear the conversation history"""
-        self.memory.clear()
+        with self._lock:
+            self._turns.clear()
+            self._tokens = 0
+            self._evicted = []
+            self.summary = ""
+            self.summarized_turns = 0
+            self._generation += 1
+
+    def to_dict(self) -> dict:
+        """Serialisable state (for a shared session store)."""
+        with self._lock:
+            return {
+                "turns": [[t.user, t.ai] for t in self._turns],
+                "evicted": [[t.user, t.ai] for t in self._evicted],
+                "summary": self.summary,
+                "summarized_turns": self.summarized_turns,
+                "version": self.version,
+            }
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "MemoryService":
+        memory = cls()
+        for user, ai in state.get("turns", []):
+            turn = _Turn(user=user, ai=ai, tokens=estimate_tokens(user) + estimate_tokens(ai or ""))
+            memory._turns.append(turn)
+            memory._tokens += turn.tokens
+        memory._evicted = [_Turn(user=user, ai=ai) for user, ai in state.get("evicted", [])]
+        memory.summary = state.get("summary", "")
+        memory.summarized_turns = state.get("summarized_turns", 0)
+        memory.version = state.get("version", "")
+        return memory
+
+    def size_bytes(self) -> int:
+        """Approximate memory held: the text of every stored turn and the summary."""
+        with self._lock:
+            turns = [*self._turns, *self._evicted]
+            return sum(len(t.user) + len(t.ai or "") for t in turns) + len(self.summary)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "turns": len(self._turns),
+                "tokens": self._tokens,
+                "token_budget": self.token_budget,
+                "summary_tokens": estimate_tokens(self.summary) if self.summary else 0,
+                "summarized_turns": self.summarized_turns,
+                "pending_turns": len(self._evicted),
+            }
+
+    # ── Internals ───────────────────────────────────────────────────
+
+    def _trim(self) -> None:
+        """Evict the oldest turns until the window fits; the newest one always stays."""
+        if not self.bounded:
+            return
+        while len(self._turns) > 1 and (
+            len(self._turns) > self.max_turns or self._tokens > self.token_budget
+        ):
+            turn = self._turns.popleft()
+            self._tokens -= turn.tokens
+            if self.mode == "summary":
+                self._evicted.append(turn)
+
+    @staticmethod
+    def _transcript(turns: list[_Turn]) -> str:
+        lines = []
+        for turn in turns:
+            if turn.user:
+                lines.append(f"User: {turn.user}")
+            if turn.ai:
+                lines.append(f"Assistant: {turn.ai}")
+        return "\n".join(lines)
+
+    def _fold_extractive(self, summary: str, turns: list[_Turn]) -> str:
+        lines = summary.splitlines() if summary else []
+        lines += [f"- User asked: {' '.join(t.user.split())[:160]}" for t in turns if t.user]
+        # Drop the oldest lines once over the summary budget
+        while len(lines) > 1 and estimate_tokens("\n".join(lines)) > self.summary_tokens:
+            lines.pop(0)
+        return "\n".join(lines)
+
+
+# ── Session Stores ─────────────────────────────────────────────────
+#
+# One MemoryService per chat session.  `load` returns the session's
+# memory (a fresh one for unknown IDs); callers mutate it and `save` it
+# back.  The local store hands out the live object, so `save` only
+# refreshes its idle clock; the Mongo store serialises the bounded
+# window + summary into one document per session, so every uvicorn
+# worker sees the same history.  Concurrent turns of one session on two
+# workers resolve last-write-wins.  Background summary updates use
+# `save_if_current` instead, so they never bring back a session that was
+# cleared (or overwrite a newer save) while the summary was being written.
+#
+# The local store is capped both by session count and by the text it
+# holds (MEMORY_MAX_MB): a bounded session stays small, but one in
+# "buffer" mode, or with very long messages, can be large.  A session's
+# size is re-measured whenever it is loaded or saved; the session being
+# used is never the one evicted.
+
+class LocalMemoryStore:
+    """In-process sessions: LRU-capped by count and size, idle ones dropped after the TTL."""
+
+    def __init__(self, max_sessions: int = MEMORY_MAX_SESSIONS, ttl_s: float = MEMORY_SESSION_TTL_S,
+                 max_mb: float = MEMORY_MAX_MB):
+        self.max_sessions = max_sessions
+        self.ttl_s = ttl_s
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        # session → (memory, last used, size in bytes when last measured)
+        self._sessions: OrderedDict[str, tuple[MemoryService, float, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = Lock()
+        self.expired = 0
+        self.evicted = 0
+
+    async def start(self) -> None:
+        pass
+
+    async def load(self, session_id: str) -> MemoryService:
+        with self._lock:
+            self._expire()
+            entry = self._sessions.get(session_id)
+            memory = entry[0] if entry else MemoryService()
+            self._touch(session_id, memory)
+            return memory
+
+    async def save(self, session_id: str, memory: MemoryService) -> None:
+        with self._lock:
+            self._touch(session_id, memory)
+
+    async def save_if_current(self, session_id: str, memory: MemoryService) -> bool:
+        """Save unless the session was cleared or replaced since `memory` was loaded."""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[0] is not memory:
+                return False
+            self._touch(session_id, memory)
+            return True
+
+    async def clear(self, session_id: str) -> None:
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry:
+                self._bytes -= entry[2]
+        if entry:
+            entry[0].clear()  # also voids a summary still being written
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "store": "local",
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "size_mb": round(self._bytes / (1024 * 1024), 3),
+                "max_mb": round(self.max_bytes / (1024 * 1024), 3),
+                "ttl_s": self.ttl_s,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
+
+    def _touch(self, session_id: str, memory: MemoryService) -> None:
+        old = self._sessions.get(session_id)
+        size = memory.size_bytes()
+        self._bytes += size - (old[2] if old else 0)
+        self._sessions[session_id] = (memory, time.monotonic(), size)
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > 1 and (
+            len(self._sessions) > self.max_sessions
+            or (self.max_bytes > 0 and self._bytes > self.max_bytes)
+        ):
+            _, (_, _, dropped) = self._sessions.popitem(last=False)
+            self._bytes -= dropped
+            self.evicted += 1
+
+    def _expire(self) -> None:
+        # Oldest first, so stop at the first session still in use
+        cutoff = time.monotonic() - self.ttl_s
+        while self._sessions:
+            _, (_, used, size) = next(iter(self._sessions.items()))
+            if used >= cutoff:
+                break
+            self._sessions.popitem(last=False)
+            self._bytes -= size
+            self.expired += 1
+
+
+class MongoMemoryStore:
+    """Sessions in a MongoDB collection, shared by every worker; a TTL index expires idle ones."""
+
+    def __init__(self, collection, ttl_s: float = MEMORY_SESSION_TTL_S):
+        self.collection = collection
+        self.ttl_s = ttl_s
+        self.loads = 0
+        self.saves = 0
+
+    async def start(self) -> None:
+        try:
+            await asyncio.to_thread(
+                self.collection.create_index, "updated_at", expireAfterSeconds=int(self.ttl_s),
+            )
+        except Exception as e:
+            # e.g. an existing index with another TTL; sessions still work
+            logger.warning(f"Could not create session TTL index ({e})")
+
+    async def load(self, session_id: str) -> MemoryService:
+        doc = await asyncio.to_thread(self.collection.find_one, {"_id": session_id})
+        self.loads += 1
+        return MemoryService.from_dict(doc["memory"]) if doc else MemoryService()
+
+    async def save(self, session_id: str, memory: MemoryService) -> None:
+        memory.version = uuid.uuid4().hex
+        await asyncio.to_thread(
+            self.collection.replace_one,
+            {"_id": session_id},
+            {"memory": memory.to_dict(), "updated_at": datetime.now(timezone.utc)},
+            upsert=True,
+        )
+        self.saves += 1
+
+    async def save_if_current(self, session_id: str, memory: MemoryService) -> bool:
+        """
+        Save unless the session was cleared or saved by another request
+        since `memory` was loaded (its stored version no longer matches).
+        """
+        expected, memory.version = memory.version, uuid.uuid4().hex
+        result = await asyncio.to_thread(
+            self.collection.replace_one,
+            {"_id": session_id, "memory.version": expected},
+            {"memory": memory.to_dict(), "updated_at": datetime.now(timezone.utc)},
+            upsert=False,
+        )
+        if not result.matched_count:
+            return False
+        self.saves += 1
+        return True
+
+    async def clear(self, session_id: str) -> None:
+        await asyncio.to_thread(self.collection.delete_one, {"_id": session_id})
 
-# Create a singleton instance
-memory = MemoryService()
\ No newline at end of file
+    def stats(self) -> dict:
+        return {
+            "store": "mongo",
+            "collection": self.collection.name,
+            "ttl_s": self.ttl_s,
+            "loads": self.loads,
+            "saves": self.saves,
+        }
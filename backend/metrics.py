@@ -0,0 +1,258 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from typing import Callable, Iterable
+import os
+import time
+
+# Record stage timings at all (the /metrics endpoint stays up either way)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Add a Server-Timing header with the per-request stage breakdown
+METRICS_SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "false").lower() in ("1", "true", "yes")
+
+
+# ── Metrics ────────────────────────────────────────────────────────
+#
+# Minimal Prometheus text-format metrics: counters and histograms with
+# fixed buckets, one lock each, so recording a sample is a bisect plus
+# a few additions.  Values that already live in the services (cache
+# hit counters, queue depths) are not duplicated; collectors read them
+# at scrape time.
+#
+# `timed(stage)` / `record(stage, seconds)` feed the shared stage
+# histogram and, inside a request wrapped by ServerTimingMiddleware,
+# that request's breakdown, which is sent back as a Server-Timing
+# header.  Headers go out before a streamed body, so for /ai/chat the
+# header only covers the work done before the first byte.
+
+# Seconds; from sub-millisecond BM25 lookups up to slow LLM calls
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+_request_timings: ContextVar[dict[str, float] | None] = ContextVar("request_timings", default=None)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = Lock()
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, total in self._values.items():
+                lines.append(f"{self.name}{_format_labels(self.labels, values)} {_format_value(total)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # label values → [per-bucket counts (+Inf last), sum, count]
+        self._series: dict[tuple[str, ...], list] = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(values, list(s[0]), s[1], s[2]) for values, s in self._series.items()]
+        for values, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = _format_labels(self.labels, values, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+# A collector returns (name, type, help, [(labels dict, value), ...]) tuples
+Collector = Callable[[], Iterable[tuple[str, str, str, list[tuple[dict, float]]]]]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[Counter | Histogram] = []
+        self._collectors: list[Collector] = []
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels: tuple[str, ...] = (),
+                  buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Collector) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            for name, kind, help, samples in collector():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    label_text = _format_labels(tuple(labels), tuple(labels.values()))
+                    lines.append(f"{name}{label_text} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    "spendly_stage_duration_seconds",
+    "Time spent in one pipeline stage (OCR, parsing, retrieval, LLM).",
+    labels=("stage",),
+)
+CHAT_TTFT_SECONDS = registry.histogram(
+    "spendly_chat_time_to_first_token_seconds",
+    "From the chat request reaching ask_stream to the first streamed token.",
+)
+CHAT_STREAM_SECONDS = registry.histogram(
+    "spendly_chat_stream_duration_seconds",
+    "Full ask_stream duration, including retrieval and the whole answer.",
+)
+HTTP_SECONDS = registry.histogram(
+    "spendly_http_request_duration_seconds",
+    "HTTP request duration by route (until the last body byte for streams).",
+    labels=("method", "route", "status"),
+)
+
+
+def record(stage: str, seconds: float) -> None:
+    """Add one stage sample (and charge it to the current request, if any)."""
+    if not METRICS_ENABLED:
+        return
+    STAGE_SECONDS.observe(seconds, stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def record_timings(timings: dict[str, float] | None) -> None:
+    """Record stage timings measured elsewhere (e.g. in an OCR worker process)."""
+    for stage, seconds in (timings or {}).items():
+        record(stage, seconds)
+
+
+@contextmanager
+def timed(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+
+@contextmanager
+def capture():
+    """Collect the stage timings recorded inside the block, as {stage: seconds}."""
+    timings: dict[str, float] = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+
+
+# ── Middleware ──────────────────────────────────────────────────────
+
+class ServerTimingMiddleware:
+    """
+    Pure ASGI middleware: per-route request latency for /metrics, plus a
+    Server-Timing header with this request's stage breakdown when
+    `server_timing` is on.
+    """
+
+    def __init__(self, app, server_timing: bool = METRICS_SERVER_TIMING):
+        self.app = app
+        self.server_timing = server_timing
+        self._routes: set[str] | None = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    total = time.perf_counter() - started
+                    entries = [f"{stage};dur={1000 * seconds:.2f}" for stage, seconds in timings.items()]
+                    entries.append(f"total;dur={1000 * total:.2f}")
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [
+                        (b"server-timing", ", ".join(entries).encode("latin-1")),
+                    ]
+            await send(message)
+
+        try:
+            with capture() as timings:
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_SECONDS.observe(
+                time.perf_counter() - started,
+                scope["method"], self._route(scope), str(status),
+            )
+
+    def _route(self, scope) -> str:
+        # Label by known route paths only, so random URLs can't blow up cardinality
+        if self._routes is None:
+            app = scope.get("app")
+            self._routes = {getattr(r, "path", "") for r in getattr(app, "routes", [])} if app else set()
+        path = scope.get("path", "")
+        return path if path in self._routes else "other"
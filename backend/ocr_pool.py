@@ -0,0 +1,263 @@
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+
+from ocr_service import OCRService, OCRResult
+from startup import STARTUP_WARMUP
+from metrics import record_timings
+
+logger = logging.getLogger(__name__)
+
+# Worker processes, each with its own PaddleOCR (0 = run in-process on one thread)
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "2"))
+# Admission limit: images running + waiting; beyond this requests get 503
+OCR_MAX_PENDING = int(os.getenv("OCR_MAX_PENDING", "8"))
+# Per-request deadline for one image, including queueing time
+OCR_TIMEOUT_S = float(os.getenv("OCR_TIMEOUT_S", "60"))
+# Images per batched predict() call for /ocr/scan/batch
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "8"))
+
+
+# ── OCR Worker Pool ────────────────────────────────────────────────
+#
+# PaddleOCR inference is CPU-bound and not thread-friendly, so running
+# it inside an `async def` serialises every upload on the event loop.
+# Instead each worker process loads its own PaddleOCR once (initializer)
+# and the API process only ships image bytes over and OCRResults back.
+#
+# Workers are started with "spawn" — forking a process that already
+# runs ONNX/torch thread pools is not safe.  A spawned child re-imports
+# the parent's __main__ module, so main.py has no `__main__` block that
+# starts a server: run it through the uvicorn CLI (`uvicorn main:app`,
+# as the Dockerfile does).
+#
+# Admission is bounded: when `max_pending` images are already running
+# or queued, `extract` raises `OCRPoolSaturated` immediately instead of
+# building an unbounded backlog.  A slot is only released when the
+# worker actually finishes, so timed-out jobs still count against it.
+# Batches take one slot per image and wait for room instead of failing.
+#
+# A worker that dies (OOM kill, native crash in PaddleOCR) breaks the
+# whole ProcessPoolExecutor: every later submit raises BrokenProcessPool.
+# The pool swaps in a fresh executor the first time it sees that and
+# retries the job once; a second failure goes back to the caller.
+
+class OCRPoolSaturated(Exception):
+    """Raised when the OCR pool cannot accept more work."""
+
+
+_worker_service: OCRService | None = None
+
+
+def _init_worker():
+    global _worker_service
+    _worker_service = OCRService(load_llm=False)
+    if STARTUP_WARMUP:
+        _worker_service.warmup()
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _extract(image_bytes: bytes) -> OCRResult:
+    # Re-wrap errors so arbitrary library exceptions survive pickling
+    try:
+        return _worker_service.extract_text_from_bytes(image_bytes)
+    except Exception as e:
+        raise RuntimeError(str(e)) from None
+
+
+def _extract_batch(images: list[bytes]) -> list[OCRResult | Exception]:
+    # Re-wrap errors so arbitrary library exceptions survive pickling
+    return [
+        r if isinstance(r, OCRResult) else RuntimeError(str(r))
+        for r in _worker_service.extract_batch(images)
+    ]
+
+
+class OCRPool:
+    def __init__(
+        self,
+        workers: int = OCR_WORKERS,
+        max_pending: int = OCR_MAX_PENDING,
+        timeout_s: float = OCR_TIMEOUT_S,
+        local_service: OCRService | None = None,
+    ):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout_s = timeout_s
+
+        if workers <= 0:
+            # In-process fallback: still off the event loop, one at a time
+            global _worker_service
+            _worker_service = local_service or OCRService(load_llm=False)
+        self._executor: Executor = self._new_executor()
+
+        self._lock = Lock()
+        self._warm: list[Future] = []
+        self._pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.restarts = 0
+        self._busy_total_s = 0.0
+
+    def _new_executor(self) -> Executor:
+        if self.workers > 0:
+            return ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+        return ThreadPoolExecutor(max_workers=1, thread_name_prefix="ocr")
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def start(self):
+        """Spawn every worker now so PaddleOCR loads before the first request."""
+        with self._lock:
+            if not self._warm:
+                self._warm = [self._executor.submit(_ping) for _ in range(max(self.workers, 1))]
+
+    def wait_ready(self) -> "OCRPool":
+        """Start the workers and block until they answer (loaded and warmed up)."""
+        self.start()
+        for future in self._warm:
+            future.result()
+        return self
+
+    async def extract(self, image_bytes: bytes) -> OCRResult:
+        """
+        OCR one image in the pool.
+        Raises OCRPoolSaturated when full and asyncio.TimeoutError past
+        the deadline.
+        """
+        for attempt in range(2):
+            executor = self._executor
+            try:
+                future = self._submit(_extract, image_bytes)
+            except OCRPoolSaturated:
+                with self._lock:
+                    self.rejected += 1
+                raise
+
+            try:
+                result = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout_s)
+                record_timings(result.timings)
+                return result
+            except BrokenProcessPool:
+                if attempt:
+                    raise
+                self._replace_broken(executor)
+            except asyncio.TimeoutError:
+                future.cancel()  # only succeeds if it never started
+                with self._lock:
+                    self.timeouts += 1
+                raise
+
+    async def extract_batch(self, images: list[bytes]) -> list[OCRResult | Exception]:
+        """
+        OCR a chunk of images in one worker call (see OCRService.extract_batch).
+        Waits for pool capacity instead of raising OCRPoolSaturated, up to
+        the per-image timeout.
+        """
+        weight = min(len(images), self.max_pending)
+        for attempt in range(2):
+            deadline = time.monotonic() + self.timeout_s
+            while True:
+                executor = self._executor
+                try:
+                    future = self._submit(_extract_batch, images, weight=weight)
+                    break
+                except OCRPoolSaturated:
+                    if time.monotonic() >= deadline:
+                        raise
+                    await asyncio.sleep(0.1)
+
+            try:
+                results = await asyncio.wait_for(
+                    asyncio.wrap_future(future), self.timeout_s * len(images)
+                )
+                for result in results:
+                    if isinstance(result, OCRResult):
+                        record_timings(result.timings)
+                return results
+            except BrokenProcessPool:
+                if attempt:
+                    raise
+                self._replace_broken(executor)
+            except asyncio.TimeoutError:
+                future.cancel()
+                with self._lock:
+                    self.timeouts += 1
+                raise
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "timeout_s": self.timeout_s,
+                "pending": self._pending,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "restarts": self.restarts,
+                "avg_latency_ms": round(1000 * self._busy_total_s / finished, 1) if finished else 0.0,
+            }
+
+    def _submit(self, fn, *args, weight: int = 1) -> Future:
+        with self._lock:
+            if self._pending + weight > self.max_pending:
+                raise OCRPoolSaturated(f"{self._pending} OCR jobs already pending")
+            self._pending += weight
+
+        submitted_at = time.monotonic()
+        try:
+            executor = self._executor
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                self._replace_broken(executor)
+                future = self._executor.submit(fn, *args)
+        except Exception:
+            self._release(None, submitted_at, weight)
+            raise
+        future.add_done_callback(lambda f: self._release(f, submitted_at, weight))
+        return future
+
+    def _replace_broken(self, executor: Executor):
+        """Swap in a fresh executor for `executor`, unless another caller already did."""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = self._new_executor()
+            self._warm = []
+            self.restarts += 1
+            restarts = self.restarts
+        executor.shutdown(wait=False, cancel_futures=True)
+        logger.warning(f"OCR worker pool broke (a worker process died); started a new one ({restarts} restarts)")
+        self.start()
+
+    def _release(self, future: Future | None, submitted_at: float, weight: int):
+        with self._lock:
+            self._pending -= weight
+            self._busy_total_s += time.monotonic() - submitted_at
+            if future is not None and not future.cancelled() and future.exception() is None:
+                self.completed += 1
+            else:
+                self.failed += 1
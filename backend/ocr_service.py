@@ -1,15 +1,46 @@
+import io
 import os
+import httpx
 import tempfile
+import numpy as np
 from paddleocr import PaddleOCR
 import instructor
-from openai import OpenAI
-from pydantic import BaseModel, Field, field_validator
+import openai
+from openai import AsyncOpenAI
+from pydantic import BaseModel, Field, ValidationError, field_validator
 from typing import List, Optional
 from dataclasses import dataclass, field as dc_field
-from PIL import Image
+from PIL import Image, ImageOps
+from dotenv import load_dotenv
+from parse_cache import ParseCache
+from rule_parser import parse_receipt_rules, RULE_PARSER_ENABLED, RULE_PARSER_MIN_CONFIDENCE
+from rate_limiter import RateLimiter
+from metrics import timed
+from tenacity import AsyncRetrying, retry_if_not_exception_type, stop_after_attempt
+import asyncio
+import hashlib
 import logging
+import random
 import re
 import json
+import time
+
+load_dotenv()
+
+# ── OCR preprocessing knobs ─ phone photos are often 12MP+, far more
+# resolution than PaddleOCR needs to read receipt text.
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "1600"))  # 0 = keep full resolution
+OCR_GRAYSCALE = os.getenv("OCR_GRAYSCALE", "true").lower() in ("1", "true", "yes")
+OCR_CROP_TO_CONTENT = os.getenv("OCR_CROP_TO_CONTENT", "false").lower() in ("1", "true", "yes")
+
+# ── LLM parse throughput ─ set RPM/TPM to the provider's quota (0 = no limit)
+LLM_PARSE_RPM = float(os.getenv("LLM_PARSE_RPM", "60"))
+LLM_PARSE_TPM = float(os.getenv("LLM_PARSE_TPM", "100000"))
+LLM_PARSE_CONCURRENCY = int(os.getenv("LLM_PARSE_CONCURRENCY", "4"))
+# Attempts per parse for 429 / 5xx / network errors (jittered exponential backoff)
+LLM_PARSE_MAX_ATTEMPTS = int(os.getenv("LLM_PARSE_MAX_ATTEMPTS", "4"))
+LLM_PARSE_BACKOFF_S = float(os.getenv("LLM_PARSE_BACKOFF_S", "0.5"))
+LLM_PARSE_BACKOFF_MAX_S = float(os.getenv("LLM_PARSE_BACKOFF_MAX_S", "20"))
 
 # Define the Pydantic models for the receipt with validation
 class ReceiptItem(BaseModel):
@@ -53,6 +84,30 @@ class ReceiptData(BaseModel):
                 return None
         return v
 
+# ── LLM parsing ─ the prompt version covers the prompt text and the
+# ReceiptData schema, so editing either invalidates cached parses.
+PARSE_MODEL = "gpt-4o-mini"
+# Instructor re-asks on schema validation errors, up to this many calls
+PARSE_VALIDATION_ATTEMPTS = 3
+# Rough completion size, for the up-front TPM reservation
+PARSE_COMPLETION_TOKENS = 500
+RECEIPT_PARSE_PROMPT = (
+    "You are a receipt parser. Extract structured data from the OCR text of a receipt.\n"
+    "Rules:\n"
+    "- merchant: The store/business name (first line is usually the store name).\n"
+    "- date: Convert to YYYY-MM-DD format.\n"
+    "- total: The final TOTAL amount paid (after tax), not the subtotal.\n"
+    "- tax: The tax amount. Use 0 if not listed.\n"
+    "- items: Each purchased item with description, quantity (default 1), and unit price.\n"
+    "- Do NOT include subtotal, total, or tax as items.\n"
+    "- Fix obvious OCR errors in item names (e.g., '0' that should be 'O', 'l' that should 'I').\n"
+    "- If a field cannot be determined, use null."
+)
+PARSE_PROMPT_VERSION = hashlib.sha1(
+    (RECEIPT_PARSE_PROMPT + json.dumps(ReceiptData.model_json_schema(), sort_keys=True)).encode("utf-8")
+).hexdigest()[:12]
+
+
 @dataclass
 class TextRegion:
     """A single detected text region with its bounding box."""
@@ -71,6 +126,26 @@ class TextRegion:
             "polygon": self.polygon,
         }
 
+@dataclass
+class ImageTransform:
+    """
+    How the image PaddleOCR saw relates to the uploaded one:
+    original = (processed + crop offset) / scale.
+    """
+    orig_width: int
+    orig_height: int
+    scale_x: float = 1.0
+    scale_y: float = 1.0
+    crop_x: int = 0
+    crop_y: int = 0
+
+    def to_original(self, x: float, y: float) -> List[int]:
+        ox = max((x + self.crop_x) / self.scale_x, 0)
+        oy = max((y + self.crop_y) / self.scale_y, 0)
+        if self.orig_width and self.orig_height:
+            ox, oy = min(ox, self.orig_width), min(oy, self.orig_height)
+        return [int(round(ox)), int(round(oy))]
+
 @dataclass
 class OCRResult:
     """Full OCR result with text, regions, and image metadata."""
@@ -78,6 +153,8 @@ class OCRResult:
     text_regions: List[TextRegion] = dc_field(default_factory=list)
     image_width: int = 0
     image_height: int = 0
+    # Stage → seconds, measured where OCR ran (often a worker process)
+    timings: dict = dc_field(default_factory=dict)
 
     def to_dict(self) -> dict:
         return {
@@ -89,25 +166,73 @@ class OCRResult:
 
 
 class OCRService:
-    def __init__(self):
-        # Initialize PaddleOCR following 3.x documentation
-        # https://paddlepaddle.github.io/PaddleOCR/main/en/version3.x/pipeline_usage/OCR.html
-        self.ocr = PaddleOCR(
-            use_doc_orientation_classify=False,
-            use_doc_unwarping=False,
-            use_textline_orientation=False,
-            lang='en'
-        )
-        
-        # Initialize OpenAI client with instructor
-        api_key = os.getenv("OPENAI_API_KEY")
-        base_url = None
-        
-        # Check if using GitHub Models
-        if api_key and api_key.startswith("github_pat_"):
-            base_url = "https://models.github.ai/inference"
-            
-        self.client = instructor.from_openai(OpenAI(api_key=api_key, base_url=base_url))
+    def __init__(self, load_ocr: bool = True, load_llm: bool = True):
+        """
+        `load_ocr=False` skips PaddleOCR (the API process when OCR runs in
+        the worker pool); `load_llm=False` skips the LLM client (inside
+        OCR worker processes).
+        """
+        self.ocr = None
+        self.client = None
+        self.parse_cache = None
+        self.rate_limiter = None
+        self.llm_retries = 0
+        # Which tier answered each parse_receipt call
+        self.parse_tiers = {"rules": 0, "cache": 0, "llm": 0, "failed": 0}
+
+        if load_ocr:
+            self.load_ocr_model()
+
+        if load_llm:
+            # Initialize OpenAI client with instructor
+            api_key = os.getenv("OPENAI_API_KEY")
+            base_url = None
+
+            # Check if using GitHub Models
+            if api_key and api_key.startswith("github_pat_"):
+                base_url = "https://models.github.ai/inference"
+
+            # Retries are ours (see _llm_parse), so the SDK's are disabled
+            self.client = instructor.from_openai(AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                max_retries=0,
+                http_client=openai.DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=LLM_PARSE_CONCURRENCY,
+                        max_keepalive_connections=LLM_PARSE_CONCURRENCY,
+                    ),
+                ),
+            ))
+            self.parse_cache = ParseCache()
+            self.rate_limiter = RateLimiter(rpm=LLM_PARSE_RPM, tpm=LLM_PARSE_TPM)
+            self._llm_slots = asyncio.Semaphore(LLM_PARSE_CONCURRENCY)
+
+        # Preprocessing applied before OCR (see _load_image)
+        self.max_side = OCR_MAX_SIDE
+        self.grayscale = OCR_GRAYSCALE
+        self.crop_to_content = OCR_CROP_TO_CONTENT
+        # Rule-based parse tier in front of the LLM (see parse_receipt)
+        self.use_rule_parser = RULE_PARSER_ENABLED
+
+    def load_ocr_model(self) -> "OCRService":
+        """Load PaddleOCR (when constructed with load_ocr=False, e.g. in the background)."""
+        if self.ocr is None:
+            # Initialize PaddleOCR following 3.x documentation
+            # https://paddlepaddle.github.io/PaddleOCR/main/en/version3.x/pipeline_usage/OCR.html
+            self.ocr = PaddleOCR(
+                use_doc_orientation_classify=False,
+                use_doc_unwarping=False,
+                use_textline_orientation=False,
+                lang='en'
+            )
+        return self
+
+    def warmup(self) -> None:
+        """One inference on a tiny synthetic image, so the first upload skips predictor setup."""
+        image = np.full((96, 320, 3), 255, dtype=np.uint8)
+        image[40:56, 24:296] = 0  # a dark bar for the text detector to look at
+        self.ocr.predict(image)
 
     def _detect_image_suffix(self, image_bytes: bytes) -> str:
         """Detect image format from magic bytes and return appropriate file suffix."""
@@ -133,76 +258,251 @@ class OCRService:
             return res_json['res']
         return res_json if isinstance(res_json, dict) else {}
 
+    def _load_image(self, image_bytes: bytes) -> Optional[tuple[np.ndarray, ImageTransform]]:
+        """
+        Decode bytes straight into a BGR uint8 array (PaddleOCR's cv2
+        convention) and run the preprocessing stage:
+          1. EXIF orientation
+          2. Downscale so the long side is at most `max_side` (JPEGs are
+             decoded at reduced size via `draft`, skipping most IDCT work)
+          3. Grayscale (replicated to 3 channels for PaddleOCR)
+          4. Optional crop to the bright receipt area
+        Returns the array plus the transform back to original
+        coordinates, or None if PIL cannot decode the format.
+        """
+        try:
+            with Image.open(io.BytesIO(image_bytes)) as img:
+                raw_w, raw_h = img.size
+                orientation = img.getexif().get(0x0112, 1)
+                orig_w, orig_h = (raw_h, raw_w) if orientation in (5, 6, 7, 8) else (raw_w, raw_h)
+
+                if self.max_side and max(raw_w, raw_h) > self.max_side:
+                    ratio = self.max_side / max(raw_w, raw_h)
+                    img.draft("RGB", (int(raw_w * ratio), int(raw_h * ratio)))
+
+                img = ImageOps.exif_transpose(img)
+                img = img.convert("L" if self.grayscale else "RGB")
+
+                if self.max_side and max(img.size) > self.max_side:
+                    ratio = self.max_side / max(img.size)
+                    img = img.resize(
+                        (max(1, round(img.width * ratio)), max(1, round(img.height * ratio))),
+                        Image.BILINEAR,
+                    )
+                pixels = np.asarray(img)
+        except Exception as e:
+            logging.info(f"In-memory decode failed ({e}); using temp file path")
+            return None
+
+        transform = ImageTransform(
+            orig_width=orig_w,
+            orig_height=orig_h,
+            scale_x=pixels.shape[1] / orig_w,
+            scale_y=pixels.shape[0] / orig_h,
+        )
+
+        if self.crop_to_content:
+            pixels, transform.crop_x, transform.crop_y = self._crop_to_content(pixels)
+
+        if pixels.ndim == 2:
+            pixels = np.repeat(pixels[:, :, None], 3, axis=2)
+        else:
+            pixels = pixels[:, :, ::-1]
+        return np.ascontiguousarray(pixels), transform
+
+    @staticmethod
+    def _crop_to_content(pixels: np.ndarray, margin: float = 0.02) -> tuple[np.ndarray, int, int]:
+        """
+        Crop to the bright (paper) region: keep rows/columns whose share of
+        pixels brighter than the image mean is at least half the best
+        row/column's.  Leaves the image alone when the result would be
+        implausibly small or barely smaller.
+        """
+        gray = pixels if pixels.ndim == 2 else pixels.mean(axis=2)
+        bright = gray > gray.mean()
+        row_frac, col_frac = bright.mean(axis=1), bright.mean(axis=0)
+        rows = np.flatnonzero(row_frac >= 0.5 * row_frac.max())
+        cols = np.flatnonzero(col_frac >= 0.5 * col_frac.max())
+        if not len(rows) or not len(cols):
+            return pixels, 0, 0
+
+        h, w = gray.shape
+        pad_y, pad_x = int(h * margin), int(w * margin)
+        y0, y1 = max(rows[0] - pad_y, 0), min(rows[-1] + pad_y + 1, h)
+        x0, x1 = max(cols[0] - pad_x, 0), min(cols[-1] + pad_x + 1, w)
+
+        area = (y1 - y0) * (x1 - x0) / (h * w)
+        if area < 0.1 or area > 0.9:
+            return pixels, 0, 0
+        return pixels[y0:y1, x0:x1], int(x0), int(y0)
+
+    def _build_result(self, result, transform: ImageTransform) -> OCRResult:
+        """
+        Flatten PaddleOCR predict() output into an OCRResult, mapping boxes
+        and polygons back into original-image coordinates.
+        """
+        all_text_lines = []
+        text_regions = []
+
+        for res in result:
+            data = self._get_result_data(res.json)
+
+            rec_texts = data.get('rec_texts', [])
+            rec_scores = data.get('rec_scores', [])
+            rec_boxes = data.get('rec_boxes', [])
+            rec_polys = data.get('rec_polys', [])
+
+            # Convert numpy arrays to plain lists if needed
+            if hasattr(rec_scores, 'tolist'):
+                rec_scores = rec_scores.tolist()
+            if hasattr(rec_boxes, 'tolist'):
+                rec_boxes = rec_boxes.tolist()
+            if hasattr(rec_polys, 'tolist'):
+                rec_polys = rec_polys.tolist()
+
+            for i, text in enumerate(rec_texts):
+                score = rec_scores[i] if i < len(rec_scores) else 0.0
+                box = rec_boxes[i] if i < len(rec_boxes) else []
+                poly = rec_polys[i] if i < len(rec_polys) else []
+
+                # Map back to the uploaded image and convert to plain ints
+                if box:
+                    box = transform.to_original(box[0], box[1]) + transform.to_original(box[2], box[3])
+                poly = [transform.to_original(pt[0], pt[1]) for pt in poly] if poly else []
+
+                all_text_lines.append(text)
+                text_regions.append(TextRegion(
+                    text=text,
+                    confidence=float(score),
+                    box=box,
+                    polygon=poly,
+                ))
+
+        raw_text = "\n".join(all_text_lines)
+        logging.info(f"Extracted {len(all_text_lines)} lines, {len(text_regions)} regions")
+
+        return OCRResult(
+            raw_text=raw_text,
+            text_regions=text_regions,
+            image_width=transform.orig_width,
+            image_height=transform.orig_height,
+        )
+
     def extract_text_from_bytes(self, image_bytes: bytes) -> OCRResult:
-        """Run OCR and return text + bounding boxes + image dimensions."""
+        """
+        Run OCR and return text + bounding boxes + image dimensions.
+        Images are decoded once into memory, preprocessed (see _load_image)
+        and handed to PaddleOCR as an array; only formats PIL can't decode
+        (e.g. PDF) go via a temp file.  Coordinates in the result always
+        refer to the uploaded image.
+        """
         if not image_bytes:
             logging.warning("Empty image bytes received")
             return OCRResult(raw_text="")
-        
-        # Detect actual image format for correct temp file extension
+        if self.ocr is None:
+            raise RuntimeError("PaddleOCR is not loaded in this process")
+
         suffix = self._detect_image_suffix(image_bytes)
         logging.info(f"Detected image format: {suffix} ({len(image_bytes)} bytes)")
-        
-        # Create a temp file to store the image
+
+        started = time.perf_counter()
+        loaded = None if suffix == ".pdf" else self._load_image(image_bytes)
+        decode_s = time.perf_counter() - started
+        if loaded is None:
+            return self._extract_via_temp_file(image_bytes, suffix)
+
+        image, transform = loaded
+        logging.info(
+            f"Processing image {transform.orig_width}x{transform.orig_height} in memory "
+            f"(OCR input {image.shape[1]}x{image.shape[0]})"
+        )
+
+        try:
+            # Use predict() method per PaddleOCR 3.x docs (accepts ndarray input)
+            started = time.perf_counter()
+            result = self.ocr.predict(image)
+            ocr_result = self._build_result(result, transform)
+            ocr_result.timings = {"ocr_decode": decode_s, "ocr_predict": time.perf_counter() - started}
+            return ocr_result
+        except Exception as e:
+            logging.error(f"OCR extraction failed: {e}", exc_info=True)
+            raise e
+
+    def extract_batch(self, images: List[bytes]) -> List[object]:
+        """
+        OCR many images with one batched predict() call.
+        Returns, in input order, an OCRResult or the Exception raised for
+        that image — one bad file never fails the others.
+        """
+        if self.ocr is None:
+            raise RuntimeError("PaddleOCR is not loaded in this process")
+
+        results: List[object] = [None] * len(images)
+        arrays, transforms, positions, decode_s = [], [], [], []
+        for i, image_bytes in enumerate(images):
+            try:
+                if not image_bytes:
+                    results[i] = OCRResult(raw_text="")
+                    continue
+                suffix = self._detect_image_suffix(image_bytes)
+                started = time.perf_counter()
+                loaded = None if suffix == ".pdf" else self._load_image(image_bytes)
+                if loaded is None:
+                    results[i] = self._extract_via_temp_file(image_bytes, suffix)
+                    continue
+            except Exception as e:
+                results[i] = e
+                continue
+            arrays.append(loaded[0])
+            transforms.append(loaded[1])
+            positions.append(i)
+            decode_s.append(time.perf_counter() - started)
+
+        if not arrays:
+            return results
+
+        try:
+            started = time.perf_counter()
+            outputs = list(self.ocr.predict(arrays))
+            if len(outputs) != len(arrays):
+                raise RuntimeError(f"predict returned {len(outputs)} results for {len(arrays)} images")
+            # One batched call: each image is charged an equal share
+            predict_s = (time.perf_counter() - started) / len(arrays)
+            for pos, output, transform, decode in zip(positions, outputs, transforms, decode_s):
+                results[pos] = self._build_result([output], transform)
+                results[pos].timings = {"ocr_decode": decode, "ocr_predict": predict_s}
+        except Exception as e:
+            logging.warning(f"Batched OCR failed ({e}); retrying images one by one")
+            for pos, array, transform in zip(positions, arrays, transforms):
+                try:
+                    results[pos] = self._build_result(self.ocr.predict(array), transform)
+                except Exception as err:
+                    results[pos] = err
+
+        return results
+
+    def _extract_via_temp_file(self, image_bytes: bytes, suffix: str) -> OCRResult:
+        """Fallback for inputs PaddleOCR must read from disk (PDF, exotic formats)."""
         fd, temp_file_path = tempfile.mkstemp(suffix=suffix)
         try:
             with os.fdopen(fd, 'wb') as temp_file:
                 temp_file.write(image_bytes)
-            
-            # Get image dimensions
-            with Image.open(temp_file_path) as img:
-                img_width, img_height = img.size
-            
+
+            # Get image dimensions (not available for e.g. PDF)
+            try:
+                with Image.open(temp_file_path) as img:
+                    img_width, img_height = img.size
+            except Exception:
+                img_width, img_height = 0, 0
+
             logging.info(f"Processing image {img_width}x{img_height} at {temp_file_path}")
-            
+
             # Use predict() method per PaddleOCR 3.x docs
+            started = time.perf_counter()
             result = self.ocr.predict(temp_file_path)
-            
-            all_text_lines = []
-            text_regions = []
-            
-            for res in result:
-                data = self._get_result_data(res.json)
-                
-                rec_texts = data.get('rec_texts', [])
-                rec_scores = data.get('rec_scores', [])
-                rec_boxes = data.get('rec_boxes', [])
-                rec_polys = data.get('rec_polys', [])
-                
-                # Convert numpy arrays to plain lists if needed
-                if hasattr(rec_scores, 'tolist'):
-                    rec_scores = rec_scores.tolist()
-                if hasattr(rec_boxes, 'tolist'):
-                    rec_boxes = rec_boxes.tolist()
-                if hasattr(rec_polys, 'tolist'):
-                    rec_polys = rec_polys.tolist()
-                
-                for i, text in enumerate(rec_texts):
-                    score = rec_scores[i] if i < len(rec_scores) else 0.0
-                    box = rec_boxes[i] if i < len(rec_boxes) else []
-                    poly = rec_polys[i] if i < len(rec_polys) else []
-                    
-                    # Convert box values to plain ints
-                    box = [int(v) for v in box] if box else []
-                    poly = [[int(v) for v in pt] for pt in poly] if poly else []
-                    
-                    all_text_lines.append(text)
-                    text_regions.append(TextRegion(
-                        text=text,
-                        confidence=float(score),
-                        box=box,
-                        polygon=poly,
-                    ))
-                
-            raw_text = "\n".join(all_text_lines)
-            logging.info(f"Extracted {len(all_text_lines)} lines, {len(text_regions)} regions")
-            
-            return OCRResult(
-                raw_text=raw_text,
-                text_regions=text_regions,
-                image_width=img_width,
-                image_height=img_height,
-            )
+            ocr_result = self._build_result(result, ImageTransform(img_width, img_height))
+            ocr_result.timings = {"ocr_predict": time.perf_counter() - started}
+            return ocr_result
 
         except Exception as e:
             logging.error(f"OCR extraction failed: {e}", exc_info=True)
@@ -215,37 +515,132 @@ class OCRService:
             except Exception as e:
                 logging.error(f"Failed to cleanup temp file: {e}")
 
-    def parse_receipt(self, raw_text: str) -> ReceiptData:
-        """Parse raw OCR text into structured receipt data using LLM."""
+    def parse_receipt_rules(self, raw_text: str, text_regions: list | None = None) -> ReceiptData | None:
+        """
+        Local rule-based parse (see rule_parser.py).  Returns None unless the
+        result is confident and its items add up to the total.
+        """
+        rules = parse_receipt_rules(raw_text, text_regions)
+        if not rules.consistent or rules.confidence < RULE_PARSER_MIN_CONFIDENCE:
+            logging.info(
+                f"Rule parser unsure (confidence={rules.confidence}, "
+                f"consistent={rules.consistent}); using LLM"
+            )
+            return None
+        try:
+            return ReceiptData(**rules.fields())
+        except ValidationError as e:
+            logging.info(f"Rule parser result failed validation; using LLM: {e}")
+            return None
+
+    async def parse_receipt(self, raw_text: str, text_regions: list | None = None) -> ReceiptData:
+        """
+        Parse raw OCR text into structured receipt data: rule parser when it
+        is confident, otherwise the LLM.  `text_regions` (the OCR boxes from
+        /ocr/scan) lets the rule parser use the layout.
+        """
         if not raw_text or len(raw_text.strip()) < 10:
             logging.warning(f"Raw text too short or empty ({len(raw_text) if raw_text else 0} chars), skipping LLM parsing")
             return ReceiptData()
 
-        system_prompt = (
-            "You are a receipt parser. Extract structured data from the OCR text of a receipt.\n"
-            "Rules:\n"
-            "- merchant: The store/business name (first line is usually the store name).\n"
-            "- date: Convert to YYYY-MM-DD format.\n"
-            "- total: The final TOTAL amount paid (after tax), not the subtotal.\n"
-            "- tax: The tax amount. Use 0 if not listed.\n"
-            "- items: Each purchased item with description, quantity (default 1), and unit price.\n"
-            "- Do NOT include subtotal, total, or tax as items.\n"
-            "- Fix obvious OCR errors in item names (e.g., '0' that should be 'O', 'l' that should 'I').\n"
-            "- If a field cannot be determined, use null."
-        )
+        if self.use_rule_parser:
+            with timed("rule_parse"):
+                receipt_data = self.parse_receipt_rules(raw_text, text_regions)
+            if receipt_data is not None:
+                self.parse_tiers["rules"] += 1
+                return receipt_data
+
+        cache_key = None
+        if self.parse_cache is not None:
+            cache_key = self.parse_cache.make_key(raw_text, PARSE_MODEL, PARSE_PROMPT_VERSION)
+            cached = await asyncio.to_thread(self.parse_cache.get, cache_key)
+            if cached is not None:
+                try:
+                    receipt_data = ReceiptData.model_validate_json(cached)
+                    self.parse_tiers["cache"] += 1
+                    return receipt_data
+                except ValueError as e:
+                    logging.warning(f"Discarding unreadable cached parse: {e}")
 
         try:
-            receipt_data = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                response_model=ReceiptData,
-                temperature=0,
-                max_retries=2,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": raw_text}
-                ]
-            )
+            with timed("llm_parse"):
+                receipt_data = await self._llm_parse(raw_text)
+            if cache_key is not None:
+                await asyncio.to_thread(self.parse_cache.put, cache_key, receipt_data.model_dump_json())
+            self.parse_tiers["llm"] += 1
             return receipt_data
         except Exception as e:
             logging.error(f"Error parsing receipt with LLM: {e}")
+            self.parse_tiers["failed"] += 1
             return ReceiptData()
+
+    async def _llm_parse(self, raw_text: str) -> ReceiptData:
+        """
+        One LLM parse under the rate limiter and concurrency cap.
+        Rate limits, 5xx and network errors are retried with jittered
+        exponential backoff; a 429's Retry-After pauses every caller.
+        """
+        estimate = (len(RECEIPT_PARSE_PROMPT) + len(raw_text)) // 4 + PARSE_COMPLETION_TOKENS
+
+        for attempt in range(1, LLM_PARSE_MAX_ATTEMPTS + 1):
+            try:
+                async with self._llm_slots:
+                    # Inside the slot, so a 429 pause also holds back queued parses
+                    with timed("llm_rate_wait"):
+                        await self.rate_limiter.acquire(estimate)
+                    receipt_data, completion = await self.client.chat.completions.create_with_completion(
+                        model=PARSE_MODEL,
+                        response_model=ReceiptData,
+                        temperature=0,
+                        # Re-ask only on validation errors; API errors come straight back here
+                        max_retries=AsyncRetrying(
+                            stop=stop_after_attempt(PARSE_VALIDATION_ATTEMPTS),
+                            retry=retry_if_not_exception_type(openai.APIError),
+                        ),
+                        messages=[
+                            {"role": "system", "content": RECEIPT_PARSE_PROMPT},
+                            {"role": "user", "content": raw_text}
+                        ]
+                    )
+            except _TRANSIENT_LLM_ERRORS as e:
+                if attempt == LLM_PARSE_MAX_ATTEMPTS:
+                    raise
+                # Full jitter, so a burst of failures doesn't retry in lockstep
+                delay = random.uniform(0, min(LLM_PARSE_BACKOFF_MAX_S, LLM_PARSE_BACKOFF_S * 2 ** attempt))
+                retry_after = _retry_after_s(e)
+                if retry_after:
+                    self.rate_limiter.pause(retry_after)
+                    delay = max(delay, retry_after)
+                self.llm_retries += 1
+                logging.warning(f"LLM parse attempt {attempt} failed ({type(e).__name__}); retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            usage = getattr(completion, "usage", None)
+            self.rate_limiter.settle(estimate, getattr(usage, "total_tokens", 0) or 0)
+            return receipt_data
+
+    def llm_stats(self) -> dict:
+        return {
+            **self.rate_limiter.stats(),
+            "concurrency": LLM_PARSE_CONCURRENCY,
+            "retries": self.llm_retries,
+        }
+
+
+_TRANSIENT_LLM_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+def _retry_after_s(error: Exception) -> float | None:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after", ""))
+    except ValueError:
+        return None
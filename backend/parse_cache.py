@@ -0,0 +1,122 @@
+from threading import Lock
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+
+from dedup import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Lives on the chroma-data volume so it survives container rebuilds
+PARSE_CACHE_PATH = os.getenv(
+    "PARSE_CACHE_PATH", os.path.join(os.getcwd(), "chroma_store", "parse_cache.sqlite3")
+)
+# Evict least-recently-used entries once the stored JSON exceeds this; 0 disables
+PARSE_CACHE_MAX_MB = float(os.getenv("PARSE_CACHE_MAX_MB", "64"))
+
+
+# ── Persistent Parse Cache ─────────────────────────────────────────
+#
+# LLM receipt parses keyed by (model, prompt version, normalised OCR
+# text) → validated ReceiptData JSON.  Stored in SQLite (WAL) so it is
+# shared by every uvicorn worker and survives restarts.
+#
+# Changing the prompt or the ReceiptData schema changes the prompt
+# version, so stale parses are simply never looked up again; they age
+# out through the size-based LRU eviction.
+#
+# Every call is blocking SQLite I/O (a hit also updates its access
+# time); async callers run get/put in a worker thread.  The connection
+# is shared across threads behind `_lock`.
+
+class ParseCache:
+    _EVICT_SLACK = 0.9  # evict down to 90% so we don't evict on every put
+
+    def __init__(self, path: str = PARSE_CACHE_PATH, max_mb: float = PARSE_CACHE_MAX_MB):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS parses ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS parses_accessed ON parses(accessed)")
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM parses").fetchone()[0]
+        logger.info(f"Parse cache at {path} ({self._size / 1e6:.1f} MB)")
+
+    @staticmethod
+    def make_key(raw_text: str, model: str, prompt_version: str) -> str:
+        payload = f"{model}\x00{prompt_version}\x00{normalize_text(raw_text)}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM parses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE parses SET accessed = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        if self.max_bytes <= 0:
+            return
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM parses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO parses (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            self._size += size - (old[0] if old else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM parses")
+            self._size = 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "size_mb": round(self._size / (1024 * 1024), 3),
+            "max_mb": round(self.max_bytes / (1024 * 1024), 3),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def _evict(self) -> None:
+        # Other workers write to the same file; re-sync before trimming
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM parses").fetchone()[0]
+        target = int(self.max_bytes * self._EVICT_SLACK)
+        freed, victims = 0, []
+        for key, size in self._conn.execute("SELECT key, size FROM parses ORDER BY accessed"):
+            if self._size - freed <= target:
+                break
+            victims.append((key,))
+            freed += size
+        self._conn.executemany("DELETE FROM parses WHERE key = ?", victims)
+        self._size -= freed
+        self.evictions += len(victims)
@@ -0,0 +1,285 @@
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+import calendar
+import re
+
+from analytics_store import merchant_key
+
+
+# ── Query Understanding ────────────────────────────────────────────
+#
+# Cheap, rule-based reading of a chat question: is it asking for an
+# aggregate ("how much did I spend…"), grouped how, and restricted to
+# which period, merchants and amounts.  Dates are handled as YYYYMMDD
+# integers so they compare directly against the analytics columns and
+# the `date_num` field in ChromaDB metadata.
+
+_MONTH_NAMES = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+_MONTH_NAMES.update({name.lower(): i for i, name in enumerate(calendar.month_abbr) if name})
+_MONTH_NAMES["sept"] = 9
+_MONTH_RE = "|".join(sorted(_MONTH_NAMES, key=len, reverse=True))
+
+_AGGREGATE_RE = re.compile(
+    r"\b(how much|spen[dt]|spending|expenses?|total|sum|average|avg|"
+    r"breakdown|per (month|merchant|store|category)|monthly|"
+    r"(spen[dt]|spending|paid)( the)? most|most (money|expensive)|"
+    r"(biggest|largest) (expenses?|spend\w*|categor(y|ies)|merchants?|stores?)|"
+    r"top \d*\s*(merchants?|stores?|categories)|"
+    r"how many (receipts|purchases|times))\b",
+    re.I,
+)
+# Asks about particular receipts or what was on them, so the documents
+# are needed even when the question also sounds like an aggregate
+_DOCUMENT_RE = re.compile(
+    r"\b(receipts?|items?|products?|bought|buy|purchased?|ordered|order|"
+    r"what did i (get|pay for)|show me|list)\b|"
+    r"\b(?:spen[dt]|spending|paid|pay)\s+(?:on|for)\s+(?!(?:the|this|that|last|past|previous|each|every|"
+    r"all|my|what|which|everything|average|groceries|grocery|dining|food|restaurants?|eating|transport|fuel|gas|"
+    r"health|pharmacy|shopping|utilities|bills?|entertainment|categor(?:y|ies))\b)[a-z]",
+    re.I,
+)
+_GROUP_BY_RES = (
+    ("merchant", re.compile(r"\b(by|per|each|which|top \d*\s*)\s*(merchants?|stores?|shops?|places?|vendors?)\b|\bwhere\b", re.I)),
+    ("month", re.compile(r"\b(by|per|each)\s+month\b|\bmonthly\b|\bmonth by month\b", re.I)),
+    ("category", re.compile(r"\b(by|per|each|which|top \d*\s*)\s*(categor(y|ies)|types?)\b|\bon what\b", re.I)),
+)
+
+_RELATIVE_RE = re.compile(r"\b(this|last|past|previous)\s+(week|month|year)\b", re.I)
+_LAST_N_RE = re.compile(r"\b(?:last|past|previous)\s+(\d{1,3})\s+(days?|weeks?|months?|years?)\b", re.I)
+_MONTH_YEAR_RE = re.compile(rf"\b({_MONTH_RE})\.?(?:\s+|,\s*)?((?:19|20)\d{{2}})?\b", re.I)
+_YEAR_RE = re.compile(r"\b(?:in|during|for|of)\s+((?:19|20)\d{2})\b", re.I)
+
+_AMOUNT = r"\$\s?(\d+(?:\.\d{1,2})?)|(\d+(?:\.\d{1,2})?)\s*(?:dollars|usd|\$)"
+_MIN_AMOUNT_RE = re.compile(rf"\b(?:over|above|more than|greater than|at least|exceeding)\s+(?:{_AMOUNT}|(\d+(?:\.\d{{1,2}})?)\b)", re.I)
+_MAX_AMOUNT_RE = re.compile(rf"\b(?:under|below|less than|at most|cheaper than)\s+(?:{_AMOUNT}|(\d+(?:\.\d{{1,2}})?)\b)", re.I)
+_BETWEEN_RE = re.compile(r"\bbetween\s+\$?\s?(\d+(?:\.\d{1,2})?)\s*(?:and|-|to)\s*\$?\s?(\d+(?:\.\d{1,2})?)", re.I)
+# Words too generic to identify a merchant on their own
+_GENERIC_WORDS = {
+    "the", "and", "inc", "llc", "ltd", "co", "store", "stores", "market", "shop",
+    "cafe", "restaurant", "wholesale", "supermarket", "pharmacy", "company", "unknown",
+}
+# Ordinary words that also start merchant names ("best month", "whole
+# trip", "on target"); never enough on their own to name a merchant
+_COMMON_WORDS = {
+    "all", "best", "big", "blue", "budget", "buy", "business", "city", "corner", "day", "dollar",
+    "family", "first", "food", "fresh", "general", "gold", "golden", "good", "great",
+    "green", "home", "house", "last", "little", "local", "lunch", "main", "month", "new", "night",
+    "office", "one", "park", "parking", "plus", "prime", "red", "royal", "save", "shell", "smart",
+    "smile", "star", "state", "street", "sun", "super", "target", "time", "top", "total", "town",
+    "trader", "trip", "water", "week", "west", "east", "north", "south", "whole", "world", "year",
+}
+_WORD_RE = re.compile(r"[A-Za-z0-9]+")
+
+
+@dataclass
+class QueryIntent:
+    """What a chat question asks for; dates are inclusive YYYYMMDD ints."""
+    aggregate: bool = False
+    start: int | None = None
+    end: int | None = None
+    period: str | None = None
+    group_by: str | None = None
+    merchants: list[str] = field(default_factory=list)        # merchant keys
+    merchant_names: list[str] = field(default_factory=list)   # as displayed
+    min_total: float | None = None
+    max_total: float | None = None
+    mentions_documents: bool = False   # receipts, items, or spending "on <something>"
+
+    @property
+    def summary_only(self) -> bool:
+        """
+        A pure aggregate ("how much did I spend last month", "spending by
+        category"): the spending summary answers it, no receipts needed.
+        """
+        return self.aggregate and bool(self.group_by or self.period) and not self.mentions_documents
+
+    @property
+    def has_filters(self) -> bool:
+        return bool(
+            self.start is not None or self.end is not None or self.merchants
+            or self.min_total is not None or self.max_total is not None
+        )
+
+    def scope(self) -> dict:
+        """Keyword arguments for the SpendingAnalytics queries."""
+        return {
+            "start": self.start,
+            "end": self.end,
+            "merchants": self.merchants or None,
+            "min_total": self.min_total,
+            "max_total": self.max_total,
+        }
+
+    def describe(self) -> str:
+        parts = []
+        if self.merchant_names:
+            parts.append("at " + ", ".join(self.merchant_names))
+        if self.min_total is not None:
+            parts.append(f"receipts of at least ${self.min_total:.2f}")
+        if self.max_total is not None:
+            parts.append(f"receipts of at most ${self.max_total:.2f}")
+        return "; ".join(parts)
+
+
+def date_num(d: date) -> int:
+    return d.year * 10000 + d.month * 100 + d.day
+
+
+def parse_query(query: str, today: date | None = None, merchants: list[str] = ()) -> QueryIntent:
+    """
+    `merchants` are the known merchant names; the ones the question
+    mentions become a merchant constraint.
+    """
+    today = today or date.today()
+    intent = QueryIntent(
+        aggregate=bool(_AGGREGATE_RE.search(query)),
+        mentions_documents=bool(_DOCUMENT_RE.search(query)),
+    )
+
+    for name, pattern in _GROUP_BY_RES:
+        if pattern.search(query):
+            intent.group_by = name
+            break
+
+    period = _parse_period(query, today)
+    if period is not None:
+        start, end, intent.period = period
+        intent.start, intent.end = date_num(start), date_num(end)
+
+    intent.min_total, intent.max_total = _parse_amounts(query)
+    for name in _match_merchants(query, merchants):
+        key = merchant_key(name)
+        if key not in intent.merchants:
+            intent.merchants.append(key)
+            intent.merchant_names.append(name)
+    return intent
+
+
+def _parse_amounts(query: str) -> tuple[float | None, float | None]:
+    match = _BETWEEN_RE.search(query)
+    if match:
+        low, high = sorted((float(match.group(1)), float(match.group(2))))
+        return low, high
+
+    def first_amount(m: re.Match | None) -> float | None:
+        if not m:
+            return None
+        return float(next(g for g in m.groups() if g is not None))
+
+    return first_amount(_MIN_AMOUNT_RE.search(query)), first_amount(_MAX_AMOUNT_RE.search(query))
+
+
+def _match_merchants(query: str, merchants: list[str]) -> list[str]:
+    """
+    Known merchants named in the question: the name as consecutive words,
+    with or without generic words like "market" (or its key written as one
+    word, "walmart" / "wal mart"), else its first word when that word is
+    distinctive.  Names made only of ordinary words ("Target", "Best Buy")
+    must be capitalised or follow "at"/"from".
+    """
+    raw = _WORD_RE.findall(query.replace("'", ""))
+    words = [w.lower() for w in raw]
+    found = []
+    for name in merchants:
+        key = merchant_key(name)
+        if len(key) < 3 or key.startswith("unknown"):
+            continue
+        name_words = [w.lower() for w in _WORD_RE.findall(name.replace("'", ""))]
+        distinctive = [w for w in name_words if len(w) >= 3 and w not in _GENERIC_WORDS]
+        start = _find_name(words, name_words, key)
+        if start is not None:
+            if any(w not in _COMMON_WORDS for w in distinctive) or _marked_as_name(raw, words, start):
+                found.append(name)
+        elif distinctive and distinctive[0] == name_words[0] and distinctive[0] not in _COMMON_WORDS \
+                and distinctive[0] in words:
+            found.append(name)
+    return found
+
+
+def _find_name(words: list[str], name_words: list[str], key: str) -> int | None:
+    """Index of the query word where the merchant name starts, or None."""
+    # "whole foods" names "Whole Foods Market" too
+    core = [w for w in name_words if w not in _GENERIC_WORDS]
+    sequences = [seq for seq in (name_words, core) if seq]
+    for i in range(len(words)):
+        if any(words[i:i + len(seq)] == seq for seq in sequences):
+            return i
+        # Same name written with different spacing ("walmart" for "Wal-Mart")
+        for span in (1, 2, 3):
+            if "".join(words[i:i + span]) == key:
+                return i
+    return None
+
+
+def _marked_as_name(raw: list[str], words: list[str], start: int) -> bool:
+    return raw[start][:1].isupper() or (start > 0 and words[start - 1] in ("at", "from"))
+
+
+def _parse_period(query: str, today: date) -> tuple[date, date, str] | None:
+    q = query.lower()
+
+    if re.search(r"\btoday\b", q):
+        return today, today, "today"
+    if re.search(r"\byesterday\b", q):
+        day = today - timedelta(days=1)
+        return day, day, "yesterday"
+
+    match = _LAST_N_RE.search(q)
+    if match:
+        n, unit = int(match.group(1)), match.group(2).rstrip("s")
+        if unit == "day":
+            start = today - timedelta(days=n - 1)
+        elif unit == "week":
+            start = today - timedelta(weeks=n) + timedelta(days=1)
+        elif unit == "month":
+            start = _add_months(today, -n) + timedelta(days=1)
+        else:
+            start = _add_months(today, -12 * n) + timedelta(days=1)
+        return start, today, match.group(0)
+
+    match = _RELATIVE_RE.search(q)
+    if match:
+        which, unit = match.group(1), match.group(2)
+        back = 0 if which == "this" else 1
+        if unit == "week":
+            monday = today - timedelta(days=today.weekday()) - timedelta(weeks=back)
+            return monday, min(monday + timedelta(days=6), today), match.group(0)
+        if unit == "month":
+            first = _add_months(today.replace(day=1), -back)
+            return first, _month_end(first), match.group(0)
+        year = today.year - back
+        return date(year, 1, 1), date(year, 12, 31), match.group(0)
+
+    match = _MONTH_YEAR_RE.search(q)
+    if match and not _is_false_month(q, match):
+        month = _MONTH_NAMES[match.group(1).lower()]
+        year = int(match.group(2)) if match.group(2) else (
+            today.year if month <= today.month else today.year - 1
+        )
+        first = date(year, month, 1)
+        return first, _month_end(first), f"{calendar.month_name[month]} {year}"
+
+    match = _YEAR_RE.search(q)
+    if match:
+        year = int(match.group(1))
+        return date(year, 1, 1), date(year, 12, 31), str(year)
+
+    return None
+
+
+def _is_false_month(query: str, match: re.Match) -> bool:
+    # "may" / "mar" are also ordinary words; need a year or a preposition
+    word = match.group(1).lower()
+    if word not in ("may", "mar", "jan", "jun", "oct", "dec", "sep") or match.group(2):
+        return False
+    return not re.search(rf"\b(in|during|for|of|since)\s+{word}\b", query)
+
+
+def _add_months(d: date, months: int) -> date:
+    index = d.year * 12 + (d.month - 1) + months
+    year, month = divmod(index, 12)
+    return date(year, month + 1, min(d.day, calendar.monthrange(year, month + 1)[1]))
+
+
+def _month_end(first: date) -> date:
+    return first.replace(day=calendar.monthrange(first.year, first.month)[1])
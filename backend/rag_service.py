@@ -1,15 +1,188 @@
 import chromadb
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
 from sentence_transformers import CrossEncoder
-from rank_bm25 import BM25Okapi
-from threading import Lock
+from sparse_index import SparseIndex
+from lru_cache import LRUCache
+from dedup import item_lines, receipt_key, text_key
+from analytics_store import SpendingAnalytics, categorize, merchant_key, parse_date_num
+from query_parser import QueryIntent, parse_query
+from fusion import RerankPolicy, merge_reranked, fused_fill
+from startup import startup
+from metrics import record, timed
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from threading import Lock, Thread
+from typing import Callable
 from datetime import datetime
+from dotenv import load_dotenv
+import asyncio
+import contextvars
+import hashlib
 import logging
 import os
+import queue
 import string
+import time
 import uuid
 
+load_dotenv()
 logger = logging.getLogger(__name__)
 
+# Write fresh BM25 and analytics snapshots (in the background) once this many docs were added/removed
+BM25_SNAPSHOT_EVERY = int(os.getenv("BM25_SNAPSHOT_EVERY", "500"))
+
+# Threads for blocking retrieval work (Chroma query, BM25, rerank)
+RAG_EXECUTOR_WORKERS = int(os.getenv("RAG_EXECUTOR_WORKERS", "4"))
+# Max retrieval pipelines in flight; extra chat requests wait their turn
+RAG_MAX_CONCURRENT_QUERIES = int(os.getenv("RAG_MAX_CONCURRENT_QUERIES", "8"))
+
+# Cross-encoder micro-batching: flush after this many pairs or this long
+RERANK_MAX_BATCH_PAIRS = int(os.getenv("RERANK_MAX_BATCH_PAIRS", "64"))
+RERANK_BATCH_WAIT_MS = float(os.getenv("RERANK_BATCH_WAIT_MS", "3"))
+# Cached (query, receipt) cross-encoder scores; 0 disables the cache
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
+
+# Documents per collection.add() call in add_receipts (capped by Chroma's max)
+CHROMA_WRITE_BATCH = int(os.getenv("CHROMA_WRITE_BATCH", "256"))
+# Skip storing a receipt whose merchant/date/total and items (or text) are already stored;
+# receipts whose parse failed are always stored
+RECEIPT_DEDUP = os.getenv("RECEIPT_DEDUP", "true").lower() in ("1", "true", "yes")
+# Current dedup_key formats; stored receipts with any other key are re-keyed at startup
+DEDUP_KEY_PREFIXES = ("receipt:", "text:", "none:")
+# dedup_key of receipts too generic to identify (failed parses); never matched
+NO_DEDUP_KEY = "none:"
+
+
+# ── Rerank Batcher ─────────────────────────────────────────────────
+#
+# Each chat query only has ~10 (query, doc) pairs, which is a poor batch
+# for the ONNX cross-encoder.  Queries submit their pairs to a queue; a
+# single worker thread drains it, waiting at most `max_wait_ms` after the
+# first job (or until `max_batch_pairs` is reached), runs ONE `predict`
+# over everything and slices the scores back out to each waiter.
+#
+# Under low load a query waits at most `max_wait_ms`; under high load
+# jobs pile up while the model is busy and the next batch is full.
+
+@dataclass
+class _RerankJob:
+    pairs: list[list[str]]
+    future: Future = field(default_factory=Future)
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class RerankBatcher:
+    def __init__(self, model: Callable[[], CrossEncoder], max_batch_pairs: int = 64, max_wait_ms: float = 3.0):
+        """`model` returns the cross-encoder; it runs on the worker thread, so it may block while the model loads."""
+        self.model = model
+        self.max_batch_pairs = max_batch_pairs
+        self.max_wait_ms = max_wait_ms
+
+        self._queue: queue.Queue[_RerankJob | None] = queue.Queue()
+        self._stats_lock = Lock()
+        self._batches = 0
+        self._jobs = 0
+        self._pairs = 0
+        self._largest_batch = 0
+        self._queue_delay_total_s = 0.0
+        self._queue_delay_max_s = 0.0
+        self._predict_total_s = 0.0
+
+        self._thread = Thread(target=self._worker, name="rerank-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, pairs: list[list[str]]) -> Future:
+        """Queue pairs for scoring; the future resolves to their scores."""
+        job = _RerankJob(pairs=pairs)
+        if not pairs:
+            job.future.set_result([])
+        else:
+            self._queue.put(job)
+        return job.future
+
+    async def predict(self, pairs: list[list[str]]) -> list[float]:
+        return await asyncio.wrap_future(self.submit(pairs))
+
+    def close(self):
+        self._queue.put(None)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "max_batch_pairs": self.max_batch_pairs,
+                "max_wait_ms": self.max_wait_ms,
+                "queue_depth": self._queue.qsize(),
+                "batches": self._batches,
+                "jobs": self._jobs,
+                "pairs": self._pairs,
+                "avg_batch_pairs": round(self._pairs / self._batches, 2) if self._batches else 0.0,
+                "avg_jobs_per_batch": round(self._jobs / self._batches, 2) if self._batches else 0.0,
+                "largest_batch_pairs": self._largest_batch,
+                "avg_queue_delay_ms": round(1000 * self._queue_delay_total_s / self._jobs, 3) if self._jobs else 0.0,
+                "max_queue_delay_ms": round(1000 * self._queue_delay_max_s, 3),
+                "avg_predict_ms": round(1000 * self._predict_total_s / self._batches, 3) if self._batches else 0.0,
+            }
+
+    def _worker(self):
+        carry: _RerankJob | None = None
+        while True:
+            job = carry if carry is not None else self._queue.get()
+            carry = None
+            if job is None:
+                return
+
+            batch = [job]
+            n_pairs = len(job.pairs)
+            deadline = time.monotonic() + self.max_wait_ms / 1000
+            closing = False
+            while n_pairs < self.max_batch_pairs:
+                timeout = deadline - time.monotonic()
+                try:
+                    nxt = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    closing = True
+                    break
+                if n_pairs + len(nxt.pairs) > self.max_batch_pairs:
+                    carry = nxt  # starts the next batch
+                    break
+                batch.append(nxt)
+                n_pairs += len(nxt.pairs)
+
+            self._run_batch(batch)
+            if closing:
+                return
+
+    def _run_batch(self, batch: list[_RerankJob]):
+        started = time.monotonic()
+        pairs = [pair for job in batch for pair in job.pairs]
+        try:
+            scores = self.model().predict(pairs, batch_size=max(len(pairs), 1))
+            record("rerank_predict", time.monotonic() - started)
+        except Exception as e:
+            logger.error(f"Rerank batch of {len(pairs)} pairs failed: {e}")
+            for job in batch:
+                job.future.set_exception(e)
+            return
+        elapsed = time.monotonic() - started
+
+        offset = 0
+        for job in batch:
+            job.future.set_result(scores[offset:offset + len(job.pairs)])
+            offset += len(job.pairs)
+
+        with self._stats_lock:
+            self._batches += 1
+            self._jobs += len(batch)
+            self._pairs += len(pairs)
+            self._largest_batch = max(self._largest_batch, len(pairs))
+            self._predict_total_s += elapsed
+            for job in batch:
+                delay = started - job.enqueued_at
+                self._queue_delay_total_s += delay
+                self._queue_delay_max_s = max(self._queue_delay_max_s, delay)
+
 
 # ── RAG Service (Singleton) ────────────────────────────────────────
 #
@@ -24,13 +197,40 @@ logger = logging.getLogger(__name__)
 # Reranking:
 #   We load a CrossEncoder (ms-marco-MiniLM-L-6-v2) with an ONNX
 #   backend for fast CPU inference.  Falls back to PyTorch if the
-#   optimum / onnxruntime stack is missing.
+#   optimum / onnxruntime stack is missing.  Dense and sparse hits are
+#   first fused (fusion.py) and only the head of that ranking, plus
+#   near-ties at its cut, is sent to the model.  Pairs from concurrent
+#   queries are scored together through a shared `RerankBatcher`.
+#   Scores are memoised in an LRU keyed by (normalised query, doc ID,
+#   doc content hash) so repeated questions only score new receipts.
+#
+# Sparse search:
+#   BM25 lives in an incremental `SparseIndex`.  It is built once from
+#   ChromaDB at startup and then updated in place on every add/delete,
+#   so storing a receipt costs O(doc length), not O(corpus size).
+#   The index is snapshotted to `chroma_store/bm25/` (memory-mapped on
+#   load); at startup we only re-tokenize receipts that Chroma has but
+#   the snapshot does not.  Documents are not mirrored in memory — sparse
+#   hits are hydrated from Chroma by ID.
+#
+# Concurrency:
+#   Every blocking step of `get_relevant_context` runs off the event
+#   loop — Chroma and BM25 on a bounded thread pool, the cross-encoder on
+#   the batcher thread — so health checks, uploads and other SSE streams
+#   keep flowing.  Dense and sparse retrieval run concurrently; a
+#   semaphore caps how many pipelines are in flight at once.
 
 class RAGService:
     _instance = None
     _lock = Lock()
     _is_initialized = False
 
+    # Bump whenever `_tokenize` changes so old snapshots are rebuilt
+    _TOKENIZER_TAG = "lower-strip-punct-v1"
+    # Bump whenever the derived metadata fields (filters, dedup key) change,
+    # so stored receipts are backfilled and the analytics snapshot rebuilt
+    _METADATA_TAG = "filters-dedup-v2"
+
     def __new__(cls):
         with cls._lock:
             if cls._instance is None:
@@ -41,8 +241,23 @@ class RAGService:
         with self._lock:
             if not self._is_initialized:
                 try:
+                    # Models and indexes load in the background (startup.py);
+                    # everything below that needs one waits for it.
+
                     # 1. Cross-Encoder Reranker ─ prefer ONNX, fallback PyTorch
-                    self.reranker = self._load_reranker()
+                    startup.add("reranker", self._load_reranker, warmup=self._warm_reranker)
+                    self.rerank_batcher = RerankBatcher(
+                        lambda: startup.result("reranker"),
+                        max_batch_pairs=RERANK_MAX_BATCH_PAIRS,
+                        max_wait_ms=RERANK_BATCH_WAIT_MS,
+                    )
+                    self.rerank_cache = LRUCache(RERANK_CACHE_SIZE)
+                    # Which fused candidates reach the cross-encoder
+                    self.rerank_policy = RerankPolicy()
+                    self._queries = 0
+                    self._rerank_skipped = 0
+                    self._candidates_seen = 0
+                    self._candidates_reranked = 0
 
                     # 2. ChromaDB ─ uses its built-in ONNX all-MiniLM-L6-v2
                     #    Do NOT pass a custom embedding_function; that would
@@ -53,11 +268,37 @@ class RAGService:
                     self.collection = self.chroma_client.get_or_create_collection(
                         name="receipts",
                     )
-
-                    # 3. Sparse Search (BM25) ─ kept in-memory
-                    self.bm25 = None
-                    self.doc_map: dict[int, dict] = {}
-                    self._refresh_bm25()
+                    # Same default ONNX model, for embedding ad-hoc text
+                    # (e.g. the semantic response cache) outside a query
+                    self.embedder = DefaultEmbeddingFunction()
+                    startup.add("embedder", self._load_embedder, warmup=self._warm_dense_search)
+                    # Bumped on every corpus change; lets caches detect staleness
+                    self.corpus_version = 0
+                    # Serialises corpus writes (adds, with the duplicate check
+                    # that guards them, and deletes)
+                    self._write_lock = Lock()
+                    self.duplicates_skipped = 0
+
+                    # 3. Sparse Search (BM25) ─ snapshot on disk, updated incrementally
+                    self.bm25 = SparseIndex()
+                    self.bm25_path = os.path.join(chroma_path, "bm25")
+                    self._bm25_lock = Lock()
+                    # Snapshots are written here, never in the request that triggers one
+                    self._snapshot_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bm25-snapshot")
+                    self._snapshot_pending: Future | None = None
+
+                    # 4. Column store over receipt metadata for exact spending aggregates
+                    self.analytics = SpendingAnalytics()
+                    self.analytics_path = os.path.join(chroma_path, "analytics")
+                    self._merchant_names: tuple[int, list[str]] = (-1, [])
+                    startup.add("index", self._load_indexes)
+
+                    # 5. Bounded executor for the blocking retrieval stages
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=RAG_EXECUTOR_WORKERS,
+                        thread_name_prefix="rag",
+                    )
+                    self._query_slots = asyncio.Semaphore(RAG_MAX_CONCURRENT_QUERIES)
 
                     self._is_initialized = True
                     logger.info("Hybrid RAG Service (Dense + Sparse + Rerank) initialized")
@@ -78,6 +319,33 @@ class RAGService:
             logger.warning(f"ONNX unavailable for reranker ({e}); falling back to PyTorch")
             return CrossEncoder(model_name)
 
+    @staticmethod
+    def _warm_reranker(model: CrossEncoder):
+        model.predict([["warmup query", "warmup receipt text"]] * 8)
+
+    def _load_embedder(self) -> DefaultEmbeddingFunction:
+        # The ONNX model is loaded (and downloaded, first time) on first call
+        self.embedder(["warmup"])
+        return self.embedder
+
+    def _warm_dense_search(self, _embedder):
+        # The collection holds its own embedder instance; one query loads it
+        if self.collection.count():
+            self.collection.query(query_texts=["warmup"], n_results=1)
+
+    def _load_indexes(self):
+        """BM25 and the analytics columns, caught up with ChromaDB."""
+        self._load_bm25()
+        self._load_analytics()
+
+    def _require_index(self):
+        """Block until the indexes are loaded (sync entry points)."""
+        startup.result("index")
+
+    async def ready(self):
+        """Wait until the indexes are loaded."""
+        await startup.wait("index")
+
     # ── Helpers ─────────────────────────────────────────────────────
 
     @staticmethod
@@ -93,147 +361,643 @@ class RAGService:
             str.maketrans("", "", string.punctuation)
         ).split()
 
+    @classmethod
+    def _rerank_key(cls, query: str, doc_id: str, doc: str) -> str:
+        """Cache key for one cross-encoder score."""
+        normalized = " ".join(cls._tokenize(query))
+        content = hashlib.sha1(doc.encode("utf-8")).hexdigest()
+        return hashlib.sha1(f"{normalized}\x00{doc_id}\x00{content}".encode("utf-8")).hexdigest()
+
+    async def _rerank(self, query: str, candidates: dict[str, dict]) -> list[float]:
+        """Cross-encoder scores for every candidate, reusing cached pairs."""
+        candidate_ids = list(candidates.keys())
+        keys = [self._rerank_key(query, cid, candidates[cid]["doc"]) for cid in candidate_ids]
+        scores = [self.rerank_cache.get(key) for key in keys]
+
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            pairs = [[query, candidates[candidate_ids[i]]["doc"]] for i in missing]
+            with timed("rerank"):  # queueing for the batcher + its predict
+                fresh = await self.rerank_batcher.predict(pairs)
+            for i, score in zip(missing, fresh):
+                scores[i] = float(score)
+                self.rerank_cache.put(keys[i], scores[i], tag=candidate_ids[i])
+
+        return scores
+
+    @timed("bm25_refresh")
     def _refresh_bm25(self):
         """Rebuild the in-memory BM25 index from all ChromaDB documents."""
         try:
-            all_docs = self.collection.get()
+            all_docs = self.collection.get(include=["documents"])
             documents = all_docs["documents"]
             ids = all_docs["ids"]
-            metadatas = all_docs["metadatas"]
-
-            if not documents:
-                self.bm25 = None
-                self.doc_map = {}
-                return
 
-            tokenized_corpus = [self._tokenize(doc) for doc in documents]
-            self.bm25 = BM25Okapi(tokenized_corpus)
+            self.bm25.clear()
+            for i, doc_id in enumerate(ids):
+                self.bm25.add(doc_id, self._tokenize(documents[i]))
 
-            self.doc_map = {
-                i: {"id": ids[i], "doc": documents[i], "meta": metadatas[i]}
-                for i in range(len(ids))
-            }
-            logger.info(f"BM25 index refreshed with {len(documents)} documents")
+            logger.info(f"BM25 index refreshed with {len(ids)} documents")
+            self.save_bm25_snapshot()
         except Exception as e:
             logger.error(f"Error refreshing BM25: {e}")
 
-    # ── Public API ──────────────────────────────────────────────────
+    def _load_bm25(self):
+        """
+        Load the BM25 snapshot and catch up with ChromaDB: index receipts
+        added since the snapshot and drop ones that no longer exist.
+        Falls back to a full rebuild if there is no usable snapshot.
+        """
+        if not self.bm25.load(self.bm25_path, tag=self._TOKENIZER_TAG):
+            self._refresh_bm25()
+            return
 
-    def add_receipt(self, text: str, metadata: dict) -> str:
+        try:
+            chroma_ids = set(self.collection.get(include=[])["ids"])
+            stale = [doc_id for doc_id in self.bm25.slot_of if doc_id not in chroma_ids]
+            missing = [doc_id for doc_id in chroma_ids if doc_id not in self.bm25]
+
+            for doc_id in stale:
+                self.bm25.remove(doc_id)
+            for start in range(0, len(missing), 1000):
+                batch = self.collection.get(ids=missing[start:start + 1000], include=["documents"])
+                for doc_id, doc in zip(batch["ids"], batch["documents"]):
+                    self.bm25.add(doc_id, self._tokenize(doc))
+
+            logger.info(
+                f"BM25 snapshot loaded ({len(self.bm25)} docs, "
+                f"+{len(missing)} new, -{len(stale)} stale)"
+            )
+            if missing or stale:
+                self.save_bm25_snapshot()
+        except Exception as e:
+            logger.error(f"Error catching up BM25 snapshot ({e}); rebuilding")
+            self._refresh_bm25()
+
+    def _load_analytics(self):
         """
-        Single entry-point for storing any receipt.
-        - Generates a collision-free ID
-        - Normalises metadata to ChromaDB-safe types
-        - Adds to ChromaDB (embedded by ChromaDB's built-in ONNX model)
-        - Refreshes the BM25 index
-        Returns the generated document ID.
+        Load the analytics snapshot and catch up with ChromaDB, like
+        `_load_bm25`.  Without a snapshot written under the current
+        _METADATA_TAG, rebuild from (and backfill) the stored metadata.
         """
-        doc_id = self._make_id()
+        started = time.perf_counter()
+        if self.analytics.load(self.analytics_path, tag=self._METADATA_TAG):
+            try:
+                chroma_ids = set(self.collection.get(include=[])["ids"])
+                stale = [doc_id for doc_id in self.analytics.filter_ids() if doc_id not in chroma_ids]
+                missing = [doc_id for doc_id in chroma_ids if doc_id not in self.analytics]
+
+                for doc_id in stale:
+                    self.analytics.remove(doc_id)
+                for start in range(0, len(missing), 1000):
+                    batch = self.collection.get(ids=missing[start:start + 1000], include=["metadatas"])
+                    self.analytics.add_many(list(zip(batch["ids"], batch["metadatas"])))
+
+                logger.info(
+                    f"Analytics snapshot loaded ({len(self.analytics)} receipts, +{len(missing)} new, "
+                    f"-{len(stale)} stale, {time.perf_counter() - started:.2f}s)"
+                )
+                if missing or stale:
+                    self.save_analytics_snapshot()
+                return
+            except Exception as e:
+                logger.error(f"Error catching up analytics snapshot ({e}); rebuilding")
+                self.analytics.clear()
+
+        self._rebuild_analytics()
+        self.save_analytics_snapshot()
+        logger.info(f"Analytics store loaded ({len(self.analytics)} receipts, "
+                    f"{time.perf_counter() - started:.2f}s)")
+
+    def _rebuild_analytics(self, page_size: int = 5000):
+        """
+        Fill the analytics columns from the metadata already in ChromaDB.
+        Receipts stored before the filter fields (or the current dedup
+        key) existed get them written back, so metadata `where` filters
+        and duplicate checks see every receipt.
+        """
+        offset = 0
+        backfill: list[tuple[str, dict]] = []
+        while True:
+            page = self.collection.get(include=["metadatas"], limit=page_size, offset=offset)
+            if not page["ids"]:
+                break
+            self.analytics.add_many(list(zip(page["ids"], page["metadatas"])))
+            for doc_id, meta in zip(page["ids"], page["metadatas"]):
+                if ("date_num" not in meta or "merchant_key" not in meta or "category" not in meta
+                        or not str(meta.get("dedup_key", "")).startswith(DEDUP_KEY_PREFIXES)):
+                    backfill.append((doc_id, {
+                        **meta,
+                        "date_num": parse_date_num(str(meta.get("date", ""))),
+                        "merchant_key": merchant_key(str(meta.get("title", ""))),
+                        "category": meta.get("category") or categorize(str(meta.get("title", ""))),
+                    }))
+            offset += len(page["ids"])
+
+        for start in range(0, len(backfill), CHROMA_WRITE_BATCH):
+            chunk = backfill[start:start + CHROMA_WRITE_BATCH]
+            # The dedup key hashes the item lines, so it needs the documents
+            docs = self.collection.get(ids=[c[0] for c in chunk], include=["documents"])
+            texts = dict(zip(docs["ids"], docs["documents"]))
+            for doc_id, meta in chunk:
+                meta["dedup_key"] = self._dedup_key(texts.get(doc_id) or "", {
+                    "title": str(meta.get("title", "Unknown")),
+                    "date": str(meta.get("date", "Unknown")),
+                    "total": float(meta.get("total", 0.0)),
+                })
+            self.collection.update(ids=[c[0] for c in chunk], metadatas=[c[1] for c in chunk])
+        if backfill:
+            logger.info(f"Backfilled filter and dedup metadata on {len(backfill)} receipts")
+
+    def _maybe_snapshot(self):
+        """Queue a background snapshot once enough changes piled up."""
+        if self.bm25.delta_size < BM25_SNAPSHOT_EVERY:
+            return
+        pending = self._snapshot_pending
+        if pending is not None and not pending.done():
+            return
+        try:
+            self._snapshot_pending = self._snapshot_executor.submit(self.save_snapshots)
+        except RuntimeError:
+            pass  # shutting down; close() writes the final snapshot
+
+    async def _run(self, func, *args):
+        """Run a blocking call on the retrieval executor."""
+        loop = asyncio.get_running_loop()
+        # Carry the request context over, so stage timings reach its Server-Timing
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, context.run, func, *args)
+
+    @timed("chroma_query")
+    def _dense_search(self, query: str, fetch_k: int, where: dict | None = None) -> dict[str, dict]:
+        """ChromaDB similarity search → {doc_id: {doc, meta, distance}} in rank order."""
+        # query_texts lets ChromaDB embed with its own ONNX model
+        results = self.collection.query(
+            query_texts=[query],
+            n_results=fetch_k,
+            where=where,
+        )
+        return {
+            doc_id: {
+                "doc": results["documents"][0][i],
+                "meta": results["metadatas"][0][i],
+                "distance": results["distances"][0][i],
+            }
+            for i, doc_id in enumerate(results["ids"][0])
+        }
+
+    @timed("bm25_score")
+    def _sparse_search(self, query: str, fetch_k: int,
+                       allowed_ids: list[str] | None = None) -> list[tuple[str, float]]:
+        """BM25 top-k (optionally within a candidate set) → (doc_id, score) in rank order."""
+        if not len(self.bm25):
+            return []
+        return self.bm25.top_k(self._tokenize(query), fetch_k, allowed_ids)
+
+    def query_intent(self, query: str) -> QueryIntent:
+        """Read date / merchant / amount constraints out of a question."""
+        version, names = self._merchant_names
+        if version != self.corpus_version:
+            names = self.analytics.merchants()
+            self._merchant_names = (self.corpus_version, names)
+        return parse_query(query, merchants=names)
+
+    @staticmethod
+    def _where(intent: QueryIntent) -> dict | None:
+        """QueryIntent constraints as a ChromaDB metadata filter."""
+        clauses: list[dict] = []
+        if intent.start is not None:
+            clauses.append({"date_num": {"$gte": intent.start}})
+        if intent.end is not None:
+            clauses.append({"date_num": {"$lte": intent.end}})
+        if intent.merchants:
+            clauses.append({"merchant_key": {"$in": intent.merchants}})
+        if intent.min_total is not None:
+            clauses.append({"total": {"$gte": intent.min_total}})
+        if intent.max_total is not None:
+            clauses.append({"total": {"$lte": intent.max_total}})
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+    def _hydrate(self, ids: list[str]) -> dict[str, dict]:
+        """Fetch documents + metadata for the given IDs from ChromaDB."""
+        if not ids:
+            return {}
+        result = self.collection.get(ids=ids, include=["documents", "metadatas"])
+        return {
+            doc_id: {"doc": result["documents"][i], "meta": result["metadatas"][i]}
+            for i, doc_id in enumerate(result["ids"])
+        }
+
+    # ── Public API ──────────────────────────────────────────────────
 
-        # Normalise metadata ─ ChromaDB only accepts str | int | float | bool
-        clean_meta = {
+    @staticmethod
+    def _clean_metadata(metadata: dict, text: str = "") -> dict:
+        """Normalise metadata ─ ChromaDB only accepts str | int | float | bool"""
+        title = str(metadata.get("title", "Unknown"))
+        date = str(metadata.get("date", "Unknown"))
+        return {
             "source":     str(metadata.get("source", "receipt_ocr")),
-            "title":      str(metadata.get("title", "Unknown")),
-            "date":       str(metadata.get("date", "Unknown")),
+            "title":      title,
+            "date":       date,
             "total":      float(metadata.get("total", 0.0)),
             "tax":        float(metadata.get("tax", 0.0)),
             "item_count": int(metadata.get("item_count", 0)),
+            "category":   str(metadata.get("category") or categorize(title, text)),
             "timestamp":  str(metadata.get("timestamp", datetime.now().isoformat())),
+            # Filterable forms: sortable YYYYMMDD (0 = unknown), normalised merchant
+            "date_num":     parse_date_num(date),
+            "merchant_key": merchant_key(title),
         }
 
-        self.collection.add(
-            documents=[text],
-            metadatas=[clean_meta],
-            ids=[doc_id],
-        )
+    @staticmethod
+    def _dedup_key(text: str, clean_meta: dict) -> str:
+        """
+        merchant/date/total/items key; the document text when merchant or
+        total are unknown but items were read; otherwise NO_DEDUP_KEY, since
+        every failed parse renders to the same placeholder document.
+        """
+        items = item_lines(text)
+        key = receipt_key(clean_meta["title"], clean_meta["date"], clean_meta["total"], items)
+        if key:
+            return key
+        return f"text:{text_key(text)}" if items else NO_DEDUP_KEY
+
+    def _find_duplicates(self, keys: list[str]) -> dict[str, str]:
+        """Map each already-stored dedup_key to the ID holding it."""
+        found: dict[str, str] = {}
+        unique = [key for key in dict.fromkeys(keys) if key != NO_DEDUP_KEY]
+        for start in range(0, len(unique), CHROMA_WRITE_BATCH):
+            res = self.collection.get(
+                where={"dedup_key": {"$in": unique[start:start + CHROMA_WRITE_BATCH]}},
+                include=["metadatas"],
+            )
+            for doc_id, meta in zip(res["ids"], res["metadatas"]):
+                found.setdefault(meta["dedup_key"], doc_id)
+        return found
 
-        self._refresh_bm25()
+    def add_receipt(self, text: str, metadata: dict) -> str:
+        """
+        Single entry-point for storing any receipt.
+        - Generates a collision-free ID
+        - Normalises metadata to ChromaDB-safe types
+        - Returns the existing ID instead if the receipt is already stored
+        - Adds to ChromaDB (embedded by ChromaDB's built-in ONNX model)
+        - Appends the document to the BM25 index
+        Returns the document ID.
+        """
+        doc_id = self._make_id()
+        clean_meta = self._clean_metadata(metadata, text)
+        clean_meta["dedup_key"] = self._dedup_key(text, clean_meta)
+
+        self._require_index()
+        with self._write_lock:
+            if RECEIPT_DEDUP:
+                existing = self._find_duplicates([clean_meta["dedup_key"]])
+                if existing:
+                    self.duplicates_skipped += 1
+                    existing_id = existing[clean_meta["dedup_key"]]
+                    logger.info(f"Receipt '{clean_meta['title']}' duplicates {existing_id}; not stored")
+                    return existing_id
+
+            with timed("chroma_add"):
+                self.collection.add(
+                    documents=[text],
+                    metadatas=[clean_meta],
+                    ids=[doc_id],
+                )
+
+            self.bm25.add(doc_id, self._tokenize(text))
+            self.analytics.add(doc_id, clean_meta)
+            self.corpus_version += 1
+        self._maybe_snapshot()
         logger.info(f"Stored receipt {doc_id} ('{clean_meta['title']}')")
         return doc_id
 
-    async def get_relevant_context(self, query: str, top_k: int = 5) -> str:
+    def add_receipts(self, receipts: list[dict]) -> list[str]:
         """
-        Hybrid retrieval pipeline:
-          1. Dense search  (ChromaDB cosine similarity via built-in ONNX embedder)
-          2. Sparse search (BM25 keyword matching)
-          3. Merge & deduplicate candidates
-          4. Rerank with Cross-Encoder
-          5. Format top-k for the LLM context window
+        Bulk version of add_receipt for imports.
+        `receipts` is a list of {"text": str, "metadata": dict}.
+        Metadata is validated up front, ChromaDB gets one add() per chunk
+        (so its embedder runs batched) and BM25 is updated once per chunk.
+        Duplicates — of stored receipts or earlier rows — are not written.
+        Returns one ID per input row (the existing ID for duplicates).
         """
-        doc_count = self.collection.count()
-        if doc_count == 0:
-            return ""
-
-        fetch_k = min(top_k * 2, doc_count)
-
-        # ── 1. Dense retrieval ──────────────────────────────────────
-        # query_texts lets ChromaDB embed with its own ONNX model
-        dense_results = self.collection.query(
-            query_texts=[query],
-            n_results=fetch_k,
+        if not receipts:
+            return []
+
+        # Normalise everything first so a bad row fails before any write
+        texts = [str(r["text"]) for r in receipts]
+        metas = [self._clean_metadata(r.get("metadata") or {}, text) for r, text in zip(receipts, texts)]
+        for text, meta in zip(texts, metas):
+            meta["dedup_key"] = self._dedup_key(text, meta)
+        ids = [self._make_id() for _ in receipts]
+
+        self._require_index()
+        chunk = max(1, min(CHROMA_WRITE_BATCH, self.chroma_client.get_max_batch_size()))
+        started = time.perf_counter()
+        owner: dict[str, str] = {}  # dedup_key → ID, across the chunks of this import
+        stored = 0
+        try:
+            for start in range(0, len(ids), chunk):
+                end = start + chunk
+                # Locked per chunk, so single adds and deletes are not held up
+                # behind a long import
+                with self._write_lock:
+                    stored += self._add_chunk_locked(texts[start:end], metas[start:end], ids, start, owner)
+        finally:
+            if stored:
+                self._maybe_snapshot()
+
+        logger.info(
+            f"Stored {stored} receipts in {time.perf_counter() - started:.2f}s "
+            f"(chunks of {chunk})"
         )
+        return ids
 
-        # ── 2. Sparse retrieval (BM25) ─────────────────────────────
-        sparse_results: list[dict] = []
-        if self.bm25 and self.doc_map:
-            tokenized_query = self._tokenize(query)
-            bm25_scores = self.bm25.get_scores(tokenized_query)
-            top_indices = sorted(
-                range(len(bm25_scores)),
-                key=lambda i: bm25_scores[i],
-                reverse=True,
-            )[:fetch_k]
-            sparse_results = [
-                self.doc_map[i] for i in top_indices if i in self.doc_map
-            ]
+    def _add_chunk_locked(self, texts: list[str], metas: list[dict], ids: list[str],
+                          offset: int, owner: dict[str, str]) -> int:
+        """
+        Write one chunk of add_receipts (rows `offset`.. of `ids`) under
+        the write lock.  Duplicates get the existing ID in `ids`.
+        Returns the number of receipts stored.
+        """
+        fresh = list(range(len(texts)))
+        if RECEIPT_DEDUP:
+            # First occurrence of each key wins; later ones point at it
+            owner.update(self._find_duplicates([m["dedup_key"] for m in metas if m["dedup_key"] not in owner]))
+            fresh = []
+            for i, meta in enumerate(metas):
+                key = meta["dedup_key"]
+                if key in owner:
+                    ids[offset + i] = owner[key]
+                else:
+                    if key != NO_DEDUP_KEY:
+                        owner[key] = ids[offset + i]
+                    fresh.append(i)
+            skipped = len(metas) - len(fresh)
+            if skipped:
+                self.duplicates_skipped += skipped
+                logger.info(f"Skipping {skipped} duplicate receipts in batch")
+        if not fresh:
+            return 0
+
+        new_ids = [ids[offset + i] for i in fresh]
+        texts = [texts[i] for i in fresh]
+        metas = [metas[i] for i in fresh]
+        with timed("chroma_add"):
+            self.collection.add(documents=texts, metadatas=metas, ids=new_ids)
+        # Index the chunk as soon as Chroma has it, so a failure part-way
+        # leaves both stores holding the same receipts
+        self.bm25.add_many([(doc_id, self._tokenize(text)) for doc_id, text in zip(new_ids, texts)])
+        self.analytics.add_many(list(zip(new_ids, metas)))
+        self.corpus_version += 1
+        return len(new_ids)
+
+    def delete_receipt(self, doc_id: str) -> bool:
+        """
+        Remove a receipt from ChromaDB and the BM25 index.
+        Returns False if the ID was not known.
+        """
+        self._require_index()
+        with self._write_lock:
+            if doc_id not in self.bm25:
+                return False
+
+            existing = self.collection.get(ids=[doc_id], include=["documents"])
+            tokens = self._tokenize(existing["documents"][0]) if existing["documents"] else None
+
+            self.collection.delete(ids=[doc_id])
+            self.bm25.remove(doc_id, tokens)
+            self.analytics.remove(doc_id)
+            self.rerank_cache.invalidate_tag(doc_id)
+            self.corpus_version += 1
+        self._maybe_snapshot()
+        logger.info(f"Deleted receipt {doc_id}")
+        return True
+
+    def close(self):
+        """Persist the BM25 snapshot and stop the workers (ChromaDB writes through; nothing to close)."""
+        self._snapshot_executor.shutdown(wait=True, cancel_futures=True)
+        if startup.is_ready("index"):  # never overwrite the snapshots with half-loaded indexes
+            self.save_snapshots()
+        self.rerank_batcher.close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def save_snapshots(self):
+        """Persist the BM25 index and the analytics columns."""
+        self.save_bm25_snapshot()
+        self.save_analytics_snapshot()
+
+    def save_analytics_snapshot(self):
+        """Persist the analytics columns next to the BM25 snapshot."""
+        try:
+            self.analytics.save(self.analytics_path, tag=self._METADATA_TAG)
+        except Exception as e:
+            logger.error(f"Error saving analytics snapshot: {e}")
 
-        # ── 3. Merge candidates (deduplicate by doc ID) ────────────
-        candidates: dict[str, dict] = {}
+    def save_bm25_snapshot(self):
+        """
+        Persist the BM25 index next to the ChromaDB store.  Only the merge
+        holds the index lock; the disk write runs unlocked.
+        """
+        with self._bm25_lock:
+            try:
+                self.bm25.save(self.bm25_path, tag=self._TOKENIZER_TAG)
+            except Exception as e:
+                logger.error(f"Error saving BM25 snapshot: {e}")
+
+    async def embed_query(self, text: str) -> list[float]:
+        """Embed text with ChromaDB's default model, off the event loop."""
+        await startup.wait("embedder")
+        embeddings = await self._run(self.embedder, [text])
+        return list(embeddings[0])
 
-        for i, doc_id in enumerate(dense_results["ids"][0]):
-            candidates[doc_id] = {
-                "doc": dense_results["documents"][0][i],
-                "meta": dense_results["metadatas"][0][i],
-            }
+    async def get_relevant_context(self, query: str, top_k: int = 5) -> str:
+        """Retrieve the best receipts for a query, formatted for the LLM."""
+        return self.format_context(await self.retrieve(query, top_k))
 
-        for item in sparse_results:
-            if item["id"] not in candidates:
-                candidates[item["id"]] = {
-                    "doc": item["doc"],
-                    "meta": item["meta"],
+    async def retrieve(self, query: str, top_k: int = 5, intent: QueryIntent | None = None) -> list[dict]:
+        """
+        Hybrid retrieval pipeline:
+          0. Query constraints (date / merchant / amount) → candidate set
+          1. Dense search  (ChromaDB similarity via built-in ONNX embedder)
+          2. Sparse search (BM25 over the inverted index, top-k only)
+          3. Fuse both rankings (RRF by default)
+          4. Rerank the fused head with the Cross-Encoder (or skip it
+             when dense and sparse agree)
+          5. Keep the top-k hits as {id, score, reranked, doc, meta}
+        `intent` is the already-parsed question, if the caller has it.
+        """
+        await self.ready()
+        with timed("retrieve"):
+            async with self._query_slots:
+                dense, sparse = await self._search(query, top_k, intent)
+                if not dense and not sparse:
+                    return []
+
+                # ── 3. Fuse (deduplicates by doc ID) ───────────────────────
+                dense_ids = list(dense)
+                sparse_ids = [doc_id for doc_id, _ in sparse]
+                # Chroma distances: smaller is closer, so negate for fusion
+                fused = self.rerank_policy.fuse(
+                    [(doc_id, -hit["distance"]) for doc_id, hit in dense.items()], sparse,
+                )
+
+                # ── 4. Rerank only where the fused order is in doubt ───────
+                rerank_ids = self.rerank_policy.select(fused, dense_ids, sparse_ids, top_k)
+                # Unscored candidates only make the cut if both retrievers found them
+                corroborated = set(dense_ids) & set(sparse_ids)
+                # Sparse hits only carry IDs; fetch the ones that may be returned
+                fill = fused_fill(fused, set(rerank_ids), top_k, corroborated)
+                needed = rerank_ids + [doc_id for doc_id, _ in fill]
+                candidates = {doc_id: dense[doc_id] for doc_id in needed if doc_id in dense}
+                sparse_only = [doc_id for doc_id in needed if doc_id not in dense]
+                if sparse_only:
+                    candidates.update(await self._run(self._hydrate, sparse_only))
+
+                to_rerank = {doc_id: candidates[doc_id] for doc_id in rerank_ids if doc_id in candidates}
+                scores = await self._rerank(query, to_rerank) if to_rerank else []
+
+            self._queries += 1
+            self._candidates_seen += len(fused)
+            self._candidates_reranked += len(to_rerank)
+            if not rerank_ids:
+                self._rerank_skipped += 1
+
+            # ── 5. Keep the top-k ──────────────────────────────────────
+            # -5 is very lenient; cross-encoder logits range ~[-11, +11]
+            ranked = merge_reranked(fused, dict(zip(to_rerank, scores)), top_k, -5, corroborated)
+            fused_scores = dict(fused)
+            return [
+                {
+                    "id": doc_id,
+                    # Cross-encoder logit; None when the candidate was not reranked
+                    "score": float(score) if reranked else None,
+                    "fused": fused_scores[doc_id],
+                    "reranked": reranked,
+                    "doc": candidates[doc_id]["doc"],
+                    "meta": candidates[doc_id]["meta"],
                 }
+                for doc_id, score, reranked in ranked
+                if doc_id in candidates
+            ]
 
-        if not candidates:
-            return ""
+    async def _search(self, query: str, top_k: int,
+                      intent: QueryIntent | None = None) -> tuple[dict[str, dict], list[tuple[str, float]]]:
+        """Steps 0-2 of `retrieve`: the dense hits and the sparse (doc_id, score) ranking."""
+        doc_count = await self._run(self.collection.count)
+        if doc_count == 0:
+            return {}, []
+
+        # ── 0. Pre-filter: search only receipts the question allows ─
+        where, allowed_ids = None, None
+        if intent is None:
+            intent = await self._run(self.query_intent, query)
+        if intent.has_filters:
+            allowed_ids = await self._run(lambda: self.analytics.filter_ids(**intent.scope()))
+            if allowed_ids:
+                where = self._where(intent)
+                doc_count = len(allowed_ids)
+            else:
+                # Likely a misread constraint; better unfiltered than empty
+                logger.info(f"No receipts match {intent.scope()}; searching unfiltered")
+                allowed_ids = None
 
-        # ── 4. Rerank with Cross-Encoder ────────────────────────────
-        candidate_ids = list(candidates.keys())
-        pairs = [[query, candidates[cid]["doc"]] for cid in candidate_ids]
+        fetch_k = min(top_k * 2, doc_count)
+
+        # ── 1 + 2. Dense and sparse retrieval, concurrently ────────
+        return await asyncio.gather(
+            self._run(self._dense_search, query, fetch_k, where),
+            self._run(self._sparse_search, query, fetch_k, allowed_ids),
+        )
 
-        scores = self.reranker.predict(pairs)
+    def retrieval_stats(self) -> dict:
+        """How much of the fused candidate list reached the cross-encoder."""
+        policy = self.rerank_policy
+        return {
+            "fusion": policy.method,
+            "rerank_top_n": policy.top_n,
+            "rerank_margin": policy.margin,
+            "rerank_skip_agreement": policy.skip_agreement,
+            "queries": self._queries,
+            "rerank_skipped": self._rerank_skipped,
+            "avg_candidates": round(self._candidates_seen / self._queries, 2) if self._queries else 0.0,
+            "avg_reranked": round(self._candidates_reranked / self._queries, 2) if self._queries else 0.0,
+        }
 
-        scored = sorted(
-            zip(candidate_ids, scores),
-            key=lambda x: x[1],
-            reverse=True,
+    def spending_context(self, query: str, intent: QueryIntent | None = None) -> str | None:
+        """
+        Exact spending figures for aggregate questions ("how much did I
+        spend last month", "spending by category"), computed over every
+        receipt in the analytics store.  None for other questions.
+        Blocking (index wait, NumPy under a lock): call it off the event loop.
+        """
+        self._require_index()
+        intent = intent or self.query_intent(query)
+        if not intent.aggregate or not len(self.analytics):
+            return None
+
+        start, end = intent.start, intent.end
+        scope = intent.scope()
+        summary = self.analytics.summary(**scope)
+        period = (
+            f"{intent.period} ({self._format_range(start, end)})" if intent.period
+            else "all time"
         )
+        if intent.describe():
+            period += f"; {intent.describe()}"
+
+        def fmt_groups(groups: list[dict]) -> str:
+            return "; ".join(f"{g['key']} ${g['total']:.2f} ({g['count']})" for g in groups) or "none"
+
+        lines = [
+            f"Period: {period}",
+            f"Receipts: {summary['count']} | Total spent: ${summary['total']:.2f} | "
+            f"Tax: ${summary['tax']:.2f} | Average receipt: ${summary['average']:.2f} | "
+            f"Largest receipt: ${summary['max']:.2f}",
+        ]
+        if summary["count"]:
+            lines.append(f"By category: {fmt_groups(self.analytics.group_by('category', **scope))}")
+            merchant_limit = 15 if intent.group_by == "merchant" else 5
+            lines.append(
+                f"Top merchants: "
+                f"{fmt_groups(self.analytics.group_by('merchant', limit=merchant_limit, **scope))}"
+            )
+            months = self.analytics.group_by("month", **scope)
+            if intent.group_by == "month" or 1 < len(months) <= 24:
+                lines.append(f"By month: {fmt_groups(months[-24:])}")
+            largest = self.analytics.largest(limit=5, **scope)
+            lines.append("Largest receipts: " + "; ".join(
+                f"{r['date'] or 'undated'} {r['merchant']} ${r['total']:.2f}" for r in largest
+            ))
+        if start is not None and summary["undated"]:
+            lines.append(f"Receipts without a readable date (not counted above): {summary['undated']}")
+        return "\n".join(lines)
 
-        # ── 5. Format final context ────────────────────────────────
-        final_context: list[str] = []
-        for doc_id, score in scored[:top_k]:
-            if score < -5:  # very lenient; cross-encoder logits range ~[-11, +11]
-                continue
+    @staticmethod
+    def _format_range(start: int | None, end: int | None) -> str:
+        def fmt(num: int | None) -> str:
+            return f"{num // 10000:04d}-{num // 100 % 100:02d}-{num % 100:02d}" if num else "…"
+        return f"{fmt(start)} to {fmt(end)}"
 
-            meta = candidates[doc_id]["meta"]
+    @staticmethod
+    def format_context(hits: list[dict]) -> str:
+        """Render retrieval hits as the receipt block of the system prompt."""
+        final_context: list[str] = []
+        for hit in hits:
+            meta = hit["meta"]
+            # Only cross-encoder scores are shown; fused scores are on another scale
+            relevance = f" | Relevance: {hit['score']:.2f}" if hit.get("score") is not None else ""
             final_context.append(
-                f"[Receipt ID: {doc_id}]\n"
+                f"[Receipt ID: {hit['id']}]\n"
                 f"Merchant: {meta.get('title', 'Unknown')} | "
                 f"Date: {meta.get('date', 'N/A')} | "
                 f"Total: ${float(meta.get('total', 0)):.2f} | "
                 f"Tax: ${float(meta.get('tax', 0)):.2f} | "
-                f"Items: {meta.get('item_count', 0)} | "
-                f"Relevance: {float(score):.2f}\n"
-                f"Content:\n{candidates[doc_id]['doc']}"
+                f"Items: {meta.get('item_count', 0)}{relevance}\n"
+                f"Content:\n{hit['doc']}"
             )
 
         return "\n\n---\n\n".join(final_context)
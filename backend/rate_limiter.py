@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+
+# ── Provider Rate Limiter ──────────────────────────────────────────
+#
+# Client-side mirror of the LLM provider's quotas: one token bucket for
+# requests per minute and one for tokens per minute.  A call waits until
+# both buckets can pay for it, so a burst of uploads is spread out
+# instead of turning into a wall of 429s.
+#
+# Waiters are served FIFO (one asyncio.Lock), token cost is estimated up
+# front and corrected with the real usage afterwards (`settle`), and a
+# 429 with Retry-After pauses every caller (`pause`), not just the one
+# that hit it.
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` can be taken (0 if it can be taken now)."""
+        self._refill()
+        amount = min(amount, self.capacity)  # oversized calls still get through eventually
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        # May go negative after an underestimate; refills pay it back
+        self.level = max(-self.capacity, self.level - amount)
+
+
+class RateLimiter:
+    def __init__(self, rpm: float = 0, tpm: float = 0):
+        """`rpm` / `tpm` of 0 disable that limit."""
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = TokenBucket(rpm) if rpm > 0 else None
+        self._tokens = TokenBucket(tpm) if tpm > 0 else None
+        self._lock = asyncio.Lock()
+        self._paused_until = 0.0
+
+        self.acquired = 0
+        self.throttled = 0
+        self.pauses = 0
+        self.waited_s = 0.0
+
+    async def acquire(self, tokens: int = 0) -> None:
+        """Wait until one request costing ~`tokens` fits both budgets."""
+        async with self._lock:
+            started = time.monotonic()
+            slept = False
+            while True:
+                wait = self._paused_until - time.monotonic()
+                if self._requests:
+                    wait = max(wait, self._requests.wait_time(1))
+                if self._tokens and tokens:
+                    wait = max(wait, self._tokens.wait_time(tokens))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+                slept = True
+
+            if self._requests:
+                self._requests.take(1)
+            if self._tokens and tokens:
+                self._tokens.take(tokens)
+
+            self.acquired += 1
+            # Only count waits on a budget, not a slow turn of the lock
+            if slept:
+                self.throttled += 1
+                self.waited_s += time.monotonic() - started
+
+    def settle(self, estimated: int, actual: int) -> None:
+        """Charge (or refund) the difference between estimated and real usage."""
+        if self._tokens and actual:
+            self._tokens.take(actual - estimated)
+
+    def pause(self, seconds: float) -> None:
+        """Hold every caller back, e.g. after a 429 with Retry-After."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self.pauses += 1
+
+    def stats(self) -> dict:
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "acquired": self.acquired,
+            "throttled": self.throttled,
+            "pauses": self.pauses,
+            "waited_s": round(self.waited_s, 3),
+        }
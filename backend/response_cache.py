@@ -0,0 +1,140 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+import hashlib
+import itertools
+import re
+
+import numpy as np
+
+
+# ── Semantic Response Cache ────────────────────────────────────────
+#
+# Opt-in cache of finished chat answers.  A lookup hits when
+#   1. the retrieved context and the conversation so far are the same
+#      (fingerprint of receipt IDs and prior chat messages), so a
+#      follow-up like "and last month?" is never answered from another
+#      session or an earlier point of this one,
+#   2. the query embedding is at least `threshold` cosine-similar to a
+#      cached query, and
+#   3. the corpus has not changed since the answer was generated.
+#
+# Any corpus change (new or deleted receipt) drops every entry, since
+# totals and "latest receipt" style answers may no longer hold.
+
+@dataclass
+class CachedAnswer:
+    query: str
+    embedding: np.ndarray
+    fingerprint: str
+    answer: str
+    latency_s: float
+
+
+class SemanticResponseCache:
+    def __init__(self, max_entries: int = 512, threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.threshold = threshold
+
+        self._entries: OrderedDict[int, CachedAnswer] = OrderedDict()
+        self._by_fingerprint: dict[str, list[int]] = {}
+        self._ids = itertools.count()
+        self._corpus_version: int | None = None
+        self._lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.saved_latency_s = 0.0
+
+    @staticmethod
+    def fingerprint(doc_ids: list[str], history: list[dict] = ()) -> str:
+        """Fingerprint of the retrieved receipts (in any order) and the chat history (in order)."""
+        digest = hashlib.sha1("\x00".join(sorted(doc_ids)).encode("utf-8"))
+        for message in history:
+            digest.update(f"\x01{message['role']}\x02{message['content']}".encode("utf-8"))
+        return digest.hexdigest()
+
+    @staticmethod
+    def chunks(answer: str) -> list[str]:
+        """Split a cached answer into word-sized pieces for SSE replay."""
+        return re.findall(r"\s*\S+\s*", answer) or [answer]
+
+    def lookup(self, embedding: list[float], fingerprint: str, corpus_version: int) -> CachedAnswer | None:
+        query_vec = self._normalize(embedding)
+        with self._lock:
+            self._check_version(corpus_version)
+
+            best, best_sim = None, self.threshold
+            for entry_id in self._by_fingerprint.get(fingerprint, ()):
+                entry = self._entries[entry_id]
+                sim = float(np.dot(entry.embedding, query_vec))
+                if sim >= best_sim:
+                    best, best_sim = entry_id, sim
+
+            if best is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(best)
+            self.hits += 1
+            entry = self._entries[best]
+            self.saved_latency_s += entry.latency_s
+            return entry
+
+    def store(self, query: str, embedding: list[float], fingerprint: str,
+              corpus_version: int, answer: str, latency_s: float) -> None:
+        if self.max_entries <= 0 or not answer:
+            return
+        with self._lock:
+            self._check_version(corpus_version)
+
+            entry_id = next(self._ids)
+            self._entries[entry_id] = CachedAnswer(
+                query=query,
+                embedding=self._normalize(embedding),
+                fingerprint=fingerprint,
+                answer=answer,
+                latency_s=latency_s,
+            )
+            self._by_fingerprint.setdefault(fingerprint, []).append(entry_id)
+
+            while len(self._entries) > self.max_entries:
+                old_id, old = self._entries.popitem(last=False)
+                bucket = self._by_fingerprint[old.fingerprint]
+                bucket.remove(old_id)
+                if not bucket:
+                    del self._by_fingerprint[old.fingerprint]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_fingerprint.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": True,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+            "saved_latency_s": round(self.saved_latency_s, 3),
+        }
+
+    def _check_version(self, corpus_version: int) -> None:
+        if corpus_version != self._corpus_version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._by_fingerprint.clear()
+            self._corpus_version = corpus_version
+
+    @staticmethod
+    def _normalize(embedding: list[float]) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
@@ -0,0 +1,307 @@
+from dataclasses import dataclass, field
+from datetime import date as _date
+import os
+import re
+import statistics
+
+# Try the rule parser before the LLM in OCRService.parse_receipt
+RULE_PARSER_ENABLED = os.getenv("RULE_PARSER_ENABLED", "true").lower() in ("1", "true", "yes")
+# Below this confidence (or when items don't add up) the LLM parses instead
+RULE_PARSER_MIN_CONFIDENCE = float(os.getenv("RULE_PARSER_MIN_CONFIDENCE", "0.85"))
+
+# ── Rule-Based Receipt Parser ──────────────────────────────────────
+#
+# Deterministic first tier in front of the LLM parser.  Most receipts
+# share one layout: merchant on top, a date somewhere, one item per line
+# with its price right-aligned, then SUBTOTAL / TAX / TOTAL lines.
+#
+# With OCR boxes available, regions are grouped into visual lines by
+# their vertical centre and prices are only trusted when they sit in
+# the right-aligned price column.  Without boxes, the raw text lines
+# are used and the trailing amount on each line is taken as its price.
+#
+# The result carries a confidence score and a consistency flag (items
+# add up to the subtotal/total); callers fall back to the LLM when
+# either is weak.
+
+_PRICE_RE = re.compile(r"(-?)\$?\s?(\d{1,5}(?:,\d{3})*[.,]\d{2})\s*(-?)\s*[A-Z*]?$")
+_TAX_RE = re.compile(r"\b(tax|vat|gst|hst|pst)\b", re.I)
+_INCL_RE = re.compile(r"\bincl", re.I)
+_SUBTOTAL_RE = re.compile(r"\bsub\s*-?\s*total\b", re.I)
+_TOTAL_RE = re.compile(r"\b(total|amount\s+due|balance\s+due)\b", re.I)
+_DUE_RE = re.compile(r"\bdue\b", re.I)
+_SKIP_RE = re.compile(
+    r"\b(cash|change|tender\w*|visa|mastercard|amex|debit|credit|card|payment|paid|"
+    r"discount|savings?|saved|points|balance|auth\w*|approv\w*|tip|items?\s+sold|"
+    r"total\s+items|refund|coupon)\b",
+    re.I,
+)
+_QTY_AT_RE = re.compile(r"(\d+(?:\.\d+)?)\s*(?:@|x|X)\s*\$?(\d+[.,]\d{2})")
+_QTY_PREFIX_RE = re.compile(r"^(\d{1,3})\s*[xX@]\s+")
+_PHONE_RE = re.compile(r"\(?\d{3}\)?[\s.-]\d{3}[\s.-]\d{4}")
+_WELCOME_RE = re.compile(r"^(welcome\s+to|thank\s+you\s+for\s+shopping\s+at)\s+", re.I)
+
+_MONTHS = {m: i + 1 for i, m in enumerate(
+    ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"))}
+_DATE_PATTERNS = (
+    (re.compile(r"\b(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})\b"), "ymd"),
+    (re.compile(r"\b(\d{1,2})[-/.](\d{1,2})[-/.](\d{4}|\d{2})\b"), "mdy"),
+    (re.compile(r"\b(\d{1,2})\s+([A-Za-z]{3})[a-z]*\.?,?\s+(\d{4})\b"), "d_mon_y"),
+    (re.compile(r"\b([A-Za-z]{3})[a-z]*\.?\s+(\d{1,2}),?\s+(\d{4})\b"), "mon_d_y"),
+)
+
+# Money comparisons: one cent per side plus rounding slack
+_MONEY_TOL = 0.02
+
+
+@dataclass
+class _Token:
+    text: str
+    x0: float = 0.0
+    y0: float = 0.0
+    x1: float = 0.0
+    y1: float = 0.0
+
+    @property
+    def yc(self) -> float:
+        return (self.y0 + self.y1) / 2
+
+    @property
+    def height(self) -> float:
+        return self.y1 - self.y0
+
+
+@dataclass
+class _Line:
+    label: str
+    price: float | None = None
+
+
+@dataclass
+class RuleParse:
+    """Fields extracted by the rule parser plus how far to trust them."""
+    merchant: str | None = None
+    date: str | None = None
+    total: float | None = None
+    tax: float | None = None
+    subtotal: float | None = None
+    items: list[dict] = field(default_factory=list)
+    confidence: float = 0.0
+    consistent: bool = False
+
+    def fields(self) -> dict:
+        """Keyword arguments for ReceiptData."""
+        return {
+            "merchant": self.merchant,
+            "date": self.date,
+            "total": self.total,
+            "tax": self.tax,
+            "items": self.items,
+        }
+
+
+def parse_receipt_rules(raw_text: str, text_regions: list | None = None) -> RuleParse:
+    """
+    Parse receipt text (and optionally its OCR regions — TextRegion objects
+    or their dicts) into receipt fields with a confidence score.
+    """
+    tokens = [_region_token(r) for r in text_regions or ()]
+    tokens = [t for t in tokens if t.text.strip()]
+    if tokens and all(t.x1 > t.x0 for t in tokens):
+        lines = _lines_from_boxes(tokens)
+    else:
+        lines = [_split_price(line.strip()) for line in (raw_text or "").splitlines() if line.strip()]
+
+    result = RuleParse()
+    if not lines:
+        return result
+
+    result.merchant = _find_merchant(lines)
+    result.date = _find_date([line.label for line in lines] + (raw_text or "").splitlines())
+
+    totals, taxes, total_tax = [], [], None
+    items_end = None
+    for i, line in enumerate(lines):
+        if line.price is None:
+            continue
+        label = line.label
+        if _TAX_RE.search(label) and not _INCL_RE.search(label):
+            if _TOTAL_RE.search(label):
+                total_tax = line.price
+            else:
+                taxes.append(line.price)
+        elif _SUBTOTAL_RE.search(label):
+            result.subtotal = line.price
+        elif _TOTAL_RE.search(label) and (_DUE_RE.search(label) or not _SKIP_RE.search(label)):
+            totals.append(line.price)
+        else:
+            continue
+        if items_end is None:
+            items_end = i
+
+    if totals:
+        result.total = max(totals)
+    if total_tax is not None:
+        result.tax = total_tax
+    elif taxes:
+        result.tax = round(sum(taxes), 2)
+
+    for line in lines[:items_end]:
+        item = _parse_item(line)
+        if item is not None:
+            result.items.append(item)
+
+    result.consistent = _is_consistent(result)
+    result.confidence = round(
+        0.15 * (result.merchant is not None)
+        + 0.15 * (result.date is not None)
+        + 0.30 * (result.total is not None)
+        + 0.15 * bool(result.items)
+        + 0.25 * result.consistent,
+        2,
+    )
+    return result
+
+
+# ── Layout ──────────────────────────────────────────────────────────
+
+def _region_token(region) -> _Token:
+    if isinstance(region, dict):
+        text, box = region.get("text", ""), region.get("box") or []
+    else:
+        text, box = region.text, region.box or []
+    if len(box) == 4:
+        return _Token(text, *map(float, box))
+    return _Token(text)
+
+
+def _lines_from_boxes(tokens: list[_Token]) -> list[_Line]:
+    """Group regions into rows by vertical centre, then read prices off the right column."""
+    line_height = statistics.median(t.height for t in tokens) or 1.0
+
+    rows: list[list[_Token]] = []
+    row_yc = 0.0
+    for token in sorted(tokens, key=lambda t: t.yc):
+        if rows and abs(token.yc - row_yc) <= 0.5 * line_height:
+            rows[-1].append(token)
+            row_yc += (token.yc - row_yc) / len(rows[-1])
+        else:
+            rows.append([token])
+            row_yc = token.yc
+    for row in rows:
+        row.sort(key=lambda t: t.x0)
+
+    # Price column: right edges of the amounts that end a row
+    priced = [row[-1].x1 for row in rows if _PRICE_RE.search(row[-1].text.strip())]
+    column_x = statistics.median(priced) if priced else None
+    page_width = max(t.x1 for t in tokens) - min(t.x0 for t in tokens)
+    tolerance = max(0.06 * page_width, 2 * line_height)
+
+    lines = []
+    for row in rows:
+        text = " ".join(t.text.strip() for t in row)
+        in_column = column_x is not None and abs(row[-1].x1 - column_x) <= tolerance
+        lines.append(_split_price(text) if in_column else _Line(text))
+    return lines
+
+
+def _split_price(text: str) -> _Line:
+    match = _PRICE_RE.search(text)
+    if not match:
+        return _Line(text)
+    digits = match.group(2)
+    # "1,234.56" vs. "12,34" (decimal comma)
+    amount = float(digits.replace(",", "")) if "." in digits else float(digits.replace(",", "."))
+    if match.group(1) or match.group(3):
+        amount = -amount
+    return _Line(text[:match.start()].strip(), round(amount, 2))
+
+
+# ── Fields ──────────────────────────────────────────────────────────
+
+def _find_merchant(lines: list[_Line]) -> str | None:
+    for line in lines[:4]:
+        label = _WELCOME_RE.sub("", line.label).strip(" -*#:")
+        letters = sum(c.isalpha() for c in label)
+        if letters < 3 or letters < 0.5 * len(label.replace(" ", "")):
+            continue
+        if _PHONE_RE.search(label) or _find_date([label]):
+            continue
+        return label
+    return None
+
+
+def parse_date(text: str) -> str | None:
+    """First recognisable date in `text` as YYYY-MM-DD, or None."""
+    return _find_date([text or ""])
+
+
+def _find_date(texts: list[str]) -> str | None:
+    for text in texts:
+        for pattern, order in _DATE_PATTERNS:
+            for match in pattern.finditer(text):
+                parsed = _to_date(match.groups(), order)
+                if parsed:
+                    return parsed
+    return None
+
+
+def _to_date(groups: tuple, order: str) -> str | None:
+    try:
+        if order == "ymd":
+            y, m, d = (int(g) for g in groups)
+        elif order == "mdy":
+            a, b, y = (int(g) for g in groups)
+            # US month-first unless the first part cannot be a month
+            m, d = (b, a) if a > 12 else (a, b)
+            if y < 100:
+                y += 2000
+        elif order == "d_mon_y":
+            d, m, y = int(groups[0]), _MONTHS[groups[1].lower()], int(groups[2])
+        else:
+            m, d, y = _MONTHS[groups[0].lower()], int(groups[1]), int(groups[2])
+        if not 1990 <= y <= 2100:
+            return None
+        return _date(y, m, d).isoformat()
+    except (KeyError, ValueError):
+        return None
+
+
+def _parse_item(line: _Line) -> dict | None:
+    if line.price is None or line.price <= 0:
+        return None
+    label = line.label
+    if _SKIP_RE.search(label) or _TOTAL_RE.search(label) or _TAX_RE.search(label):
+        return None
+
+    qty, unit = 1.0, None
+    at = _QTY_AT_RE.search(label)
+    if at:
+        qty, unit = float(at.group(1)), float(at.group(2).replace(",", "."))
+        label = (label[:at.start()] + label[at.end():]).strip()
+    else:
+        prefix = _QTY_PREFIX_RE.match(label)
+        if prefix:
+            qty = float(prefix.group(1))
+            label = label[prefix.end():]
+
+    desc = label.strip(" -*#:")
+    if sum(c.isalpha() for c in desc) < 2 or qty <= 0:
+        return None
+    price = unit if unit is not None else line.price / qty
+    return {"desc": desc, "qty": qty, "price": round(price, 2)}
+
+
+def _is_consistent(result: RuleParse) -> bool:
+    """Items add up to the subtotal (or total minus tax), and subtotal + tax = total."""
+    if result.total is None or not result.items:
+        return False
+    items_sum = sum(item["qty"] * item["price"] for item in result.items)
+    tax = result.tax or 0.0
+    tolerance = _MONEY_TOL * max(1, len(result.items) ** 0.5)
+
+    if result.subtotal is not None:
+        if abs(result.subtotal + tax - result.total) > _MONEY_TOL:
+            return False
+        return abs(items_sum - result.subtotal) <= tolerance
+    return abs(items_sum + tax - result.total) <= tolerance
@@ -0,0 +1,543 @@
+from threading import RLock
+import json
+import logging
+import math
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+# ── Incremental Sparse Index (BM25 Okapi) ──────────────────────────
+#
+# Drop-in replacement for `rank_bm25.BM25Okapi` that can be mutated
+# in place.  Instead of re-tokenizing the whole corpus on every insert
+# we keep an inverted index (term → postings) plus per-slot document
+# lengths, and derive the corpus statistics (N, avgdl, idf) from those
+# at query time.
+#
+# Scores follow the exact Okapi formula used by rank_bm25, including
+# its quirk of replacing negative idf values with
+# `epsilon * average_idf`, so swapping the two never changes rankings.
+#
+# Retrieval:
+#   `top_k` only touches the posting lists of the query terms.  Per-term
+#   postings are read as NumPy arrays, contributions are summed with
+#   `np.bincount` and the head is picked with `argpartition`, so a query
+#   costs O(matching postings) rather than O(corpus size).
+#
+# Storage (two tiers):
+#   base  ─ an immutable CSR segment (vocab, offsets, slots, tfs).  It is
+#           either loaded from a snapshot with `mmap_mode="r"` or produced
+#           in memory by a merge.
+#   delta ─ `postings`: term → {slot: tf} for documents added since the
+#           base was built.
+#   Deleting a document only clears its `alive` bit (plus a per-term
+#   dead counter for base documents); `merge` folds delta + tombstones
+#   into a fresh base.
+#
+# Snapshots:
+#   `save(path)` writes the merged base into a new generation directory
+#   and atomically swaps a `CURRENT` pointer file, so readers never see
+#   a half-written snapshot.  `load(path)` maps the arrays back in
+#   without touching the posting data.
+
+FORMAT_VERSION = 1
+
+
+class _Segment:
+    """Immutable CSR postings: term i owns slots[offsets[i]:offsets[i+1]]."""
+
+    def __init__(self, vocab: list[str], offsets: np.ndarray, slots: np.ndarray, tfs: np.ndarray):
+        self.vocab = vocab
+        self.term_ids = {term: i for i, term in enumerate(vocab)}
+        self.offsets = offsets
+        self.slots = slots
+        self.tfs = tfs
+
+    def postings(self, term: str) -> tuple[np.ndarray, np.ndarray] | None:
+        i = self.term_ids.get(term)
+        if i is None:
+            return None
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.slots[start:end], self.tfs[start:end]
+
+    def doc_freqs(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def terms_of_slot(self, slot: int) -> np.ndarray:
+        """Term indices whose posting list contains `slot` (full scan)."""
+        positions = np.flatnonzero(self.slots == slot)
+        return np.searchsorted(self.offsets, positions, side="right") - 1
+
+
+class SparseIndex:
+    _GROW_FACTOR = 2
+    _MIN_CAPACITY = 64
+    _COMPACT_MIN_DEAD = 256
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+
+        self._lock = RLock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._base: _Segment | None = None
+        self._base_slots = 0
+        self._base_dead_df = np.zeros(0, dtype=np.int64)
+        self._base_dead = 0
+
+        self.postings: dict[str, dict[int, int]] = {}
+        self.slot_of: dict[str, int] = {}
+        self.ids: list[str | None] = []
+        self._doc_len = np.zeros(self._MIN_CAPACITY, dtype=np.int64)
+        self._alive = np.zeros(self._MIN_CAPACITY, dtype=bool)
+        self.total_len = 0
+
+        # Cached corpus statistics, invalidated on every mutation
+        self._average_idf: float | None = None
+        # term → (slots, tf) arrays of the delta tier, invalidated per term
+        self._term_arrays: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+
+    # ── Introspection ───────────────────────────────────────────────
+
+    def __len__(self) -> int:
+        return len(self.slot_of)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.slot_of
+
+    @property
+    def corpus_size(self) -> int:
+        return len(self.slot_of)
+
+    @property
+    def avgdl(self) -> float:
+        return self.total_len / self.corpus_size if self.corpus_size else 0.0
+
+    @property
+    def delta_size(self) -> int:
+        """Documents (and tombstones) not yet folded into the base tier."""
+        return (len(self.ids) - self._base_slots) + self._base_dead
+
+    # ── Mutation ────────────────────────────────────────────────────
+
+    def add(self, doc_id: str, tokens: list[str]) -> None:
+        """Index one document.  Re-adding an existing ID replaces it."""
+        with self._lock:
+            if doc_id in self.slot_of:
+                self.remove(doc_id)
+
+            slot = len(self.ids)
+            self._ensure_capacity(slot + 1)
+            self.ids.append(doc_id)
+            self.slot_of[doc_id] = slot
+            self._doc_len[slot] = len(tokens)
+            self._alive[slot] = True
+            self.total_len += len(tokens)
+
+            for term, tf in self._term_frequencies(tokens).items():
+                self.postings.setdefault(term, {})[slot] = tf
+                self._term_arrays.pop(term, None)
+
+            self._average_idf = None
+
+    def add_many(self, docs: list[tuple[str, list[str]]]) -> None:
+        """Index a batch of (doc_id, tokens) under one lock acquisition."""
+        with self._lock:
+            self._ensure_capacity(len(self.ids) + len(docs))
+            for doc_id, tokens in docs:
+                self.add(doc_id, tokens)
+
+    def remove(self, doc_id: str, tokens: list[str] | None = None) -> bool:
+        """
+        Drop one document from the index.
+        Pass the document's tokens when available; otherwise the posting
+        lists are scanned.  Returns False if the ID is unknown.
+        """
+        with self._lock:
+            slot = self.slot_of.pop(doc_id, None)
+            if slot is None:
+                return False
+
+            if slot < self._base_slots:
+                self._remove_base_postings(slot, tokens)
+            else:
+                terms = self._term_frequencies(tokens) if tokens is not None else list(self.postings)
+                for term in terms:
+                    plist = self.postings.get(term)
+                    if plist is None or plist.pop(slot, None) is None:
+                        continue
+                    self._term_arrays.pop(term, None)
+                    if not plist:
+                        del self.postings[term]
+
+            self.total_len -= int(self._doc_len[slot])
+            self._doc_len[slot] = 0
+            self._alive[slot] = False
+            self.ids[slot] = None
+            self._average_idf = None
+
+            dead = len(self.ids) - len(self.slot_of)
+            if dead >= self._COMPACT_MIN_DEAD and dead * 2 > len(self.ids):
+                self.merge()
+            return True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reset()
+
+    def merge(self) -> None:
+        """Fold the delta tier and tombstones into a fresh, dense base."""
+        with self._lock:
+            segment, ids, doc_len = self._build_segment()
+            self._install(segment, ids, doc_len)
+
+    # ── Scoring ─────────────────────────────────────────────────────
+
+    def doc_freq(self, term: str) -> int:
+        df = len(self.postings.get(term, ()))
+        if self._base is not None:
+            i = self._base.term_ids.get(term)
+            if i is not None:
+                df += int(self._base.offsets[i + 1] - self._base.offsets[i] - self._base_dead_df[i])
+        return df
+
+    def idf(self, term: str) -> float:
+        """Okapi idf for one term (0 for out-of-vocabulary terms)."""
+        df = self.doc_freq(term)
+        if not df:
+            return 0.0
+        n = self.corpus_size
+        value = math.log(n - df + 0.5) - math.log(df + 0.5)
+        if value < 0:
+            value = self.epsilon * self._get_average_idf()
+        return value
+
+    def get_scores(self, tokens: list[str]) -> np.ndarray:
+        """
+        BM25 score for every slot (same values as `BM25Okapi.get_scores`
+        over the live documents).  Dead slots score -inf.
+        """
+        with self._lock:
+            n_slots = len(self.ids)
+            scores = np.zeros(n_slots, dtype=np.float64)
+            if self.corpus_size == 0 or self.avgdl == 0:
+                scores[~self._alive[:n_slots]] = -np.inf
+                return scores
+
+            for term in tokens:
+                idf = self.idf(term)
+                if not idf:
+                    continue
+                for slots, tf in self._iter_term_arrays(term):
+                    scores[slots] += idf * self._tf_weight(slots, tf)
+
+            scores[~self._alive[:n_slots]] = -np.inf
+            return scores
+
+    def top_k(self, tokens: list[str], k: int,
+              allowed_ids: list[str] | None = None) -> list[tuple[str, float]]:
+        """
+        Best `k` documents for a query as (doc_id, score), highest first.
+        Only documents containing at least one query term are considered;
+        `allowed_ids` further restricts them to a pre-filtered candidate set.
+        """
+        with self._lock:
+            if k <= 0 or self.corpus_size == 0 or self.avgdl == 0:
+                return []
+
+            allowed = None
+            if allowed_ids is not None:
+                # Slot bitmap, built under the lock since merges renumber slots
+                allowed = np.zeros(len(self.ids), dtype=bool)
+                slots = [self.slot_of[doc_id] for doc_id in allowed_ids if doc_id in self.slot_of]
+                if not slots:
+                    return []
+                allowed[slots] = True
+
+            slot_parts: list[np.ndarray] = []
+            score_parts: list[np.ndarray] = []
+            for term in tokens:
+                idf = self.idf(term)
+                for slots, tf in self._iter_term_arrays(term):
+                    if allowed is not None:
+                        keep = allowed[slots]
+                        slots, tf = slots[keep], tf[keep]
+                    slot_parts.append(slots)
+                    score_parts.append(idf * self._tf_weight(slots, tf))
+
+            if not slot_parts or not any(len(part) for part in slot_parts):
+                return []
+
+            candidates, inverse = np.unique(np.concatenate(slot_parts), return_inverse=True)
+            scores = np.bincount(
+                inverse, weights=np.concatenate(score_parts), minlength=len(candidates)
+            )
+
+            if len(candidates) > k:
+                head = np.argpartition(-scores, k - 1)[:k]
+            else:
+                head = np.arange(len(candidates))
+            head = head[np.argsort(-scores[head], kind="stable")]
+
+            return [(self.ids[candidates[i]], float(scores[i])) for i in head]
+
+    # ── Persistence ─────────────────────────────────────────────────
+
+    def save(self, path: str, tag: str = "") -> None:
+        """
+        Merge and write a snapshot under `path`.
+        `tag` is stored verbatim and must match on `load` (e.g. tokenizer
+        version), so incompatible snapshots are rejected.
+        """
+        with self._lock:
+            self.merge()
+            segment, ids, doc_len = self._base, list(self.ids), self._doc_len[:len(self.ids)].copy()
+
+        # The base tier is immutable, so the disk write happens unlocked
+        os.makedirs(path, exist_ok=True)
+        generation = f"gen-{int(time.time())}-{uuid.uuid4().hex[:8]}"
+        gen_path = os.path.join(path, generation)
+        os.makedirs(gen_path)
+
+        with open(os.path.join(gen_path, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(segment.vocab, f)
+        with open(os.path.join(gen_path, "ids.json"), "w", encoding="utf-8") as f:
+            json.dump(ids, f)
+        np.save(os.path.join(gen_path, "offsets.npy"), segment.offsets)
+        np.save(os.path.join(gen_path, "slots.npy"), segment.slots)
+        np.save(os.path.join(gen_path, "tfs.npy"), segment.tfs)
+        np.save(os.path.join(gen_path, "doc_len.npy"), doc_len)
+
+        manifest = {
+            "format_version": FORMAT_VERSION,
+            "tag": tag,
+            "generation": generation,
+            "k1": self.k1,
+            "b": self.b,
+            "epsilon": self.epsilon,
+            "doc_count": len(ids),
+            "created_at": time.time(),
+        }
+        tmp_path = os.path.join(path, f"CURRENT.{uuid.uuid4().hex[:8]}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(path, "CURRENT"))
+
+        self._prune_generations(path, keep=generation)
+        logger.info(f"Sparse index snapshot written ({len(ids)} docs, {generation})")
+
+    def load(self, path: str, tag: str = "") -> bool:
+        """
+        Replace the index contents with the snapshot under `path`.
+        Posting arrays are memory-mapped, not read.  Returns False (and
+        leaves the index untouched) if there is no compatible snapshot.
+        """
+        try:
+            with open(os.path.join(path, "CURRENT"), encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        expected = {
+            "format_version": FORMAT_VERSION,
+            "tag": tag,
+            "k1": self.k1,
+            "b": self.b,
+            "epsilon": self.epsilon,
+        }
+        if any(manifest.get(key) != value for key, value in expected.items()):
+            logger.info("Sparse index snapshot is incompatible; ignoring it")
+            return False
+
+        gen_path = os.path.join(path, manifest["generation"])
+        try:
+            with open(os.path.join(gen_path, "vocab.json"), encoding="utf-8") as f:
+                vocab = json.load(f)
+            with open(os.path.join(gen_path, "ids.json"), encoding="utf-8") as f:
+                ids = json.load(f)
+            segment = _Segment(
+                vocab,
+                np.load(os.path.join(gen_path, "offsets.npy"), mmap_mode="r"),
+                np.load(os.path.join(gen_path, "slots.npy"), mmap_mode="r"),
+                np.load(os.path.join(gen_path, "tfs.npy"), mmap_mode="r"),
+            )
+            doc_len = np.load(os.path.join(gen_path, "doc_len.npy"))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to read sparse index snapshot: {e}")
+            return False
+
+        with self._lock:
+            self._install(segment, ids, doc_len)
+        return True
+
+    # ── Internals ───────────────────────────────────────────────────
+
+    @staticmethod
+    def _term_frequencies(tokens: list[str]) -> dict[str, int]:
+        freqs: dict[str, int] = {}
+        for token in tokens:
+            freqs[token] = freqs.get(token, 0) + 1
+        return freqs
+
+    def _tf_weight(self, slots: np.ndarray, tf: np.ndarray) -> np.ndarray:
+        norm = self.k1 * (1 - self.b + self.b * self._doc_len[slots] / self.avgdl)
+        return tf * (self.k1 + 1) / (tf + norm)
+
+    def _iter_term_arrays(self, term: str):
+        """Yield the live (slots, tf) arrays of a term from both tiers."""
+        if self._base is not None:
+            base = self._base.postings(term)
+            if base is not None and len(base[0]):
+                slots = np.asarray(base[0], dtype=np.int64)
+                tf = np.asarray(base[1], dtype=np.float64)
+                if self._base_dead:
+                    keep = self._alive[slots]
+                    slots, tf = slots[keep], tf[keep]
+                if len(slots):
+                    yield slots, tf
+
+        arrays = self._term_arrays.get(term)
+        if arrays is None:
+            plist = self.postings.get(term)
+            if not plist:
+                return
+            arrays = (
+                np.fromiter(plist.keys(), dtype=np.int64, count=len(plist)),
+                np.fromiter(plist.values(), dtype=np.float64, count=len(plist)),
+            )
+            self._term_arrays[term] = arrays
+        yield arrays
+
+    def _remove_base_postings(self, slot: int, tokens: list[str] | None) -> None:
+        if tokens is not None:
+            term_ids = [
+                self._base.term_ids[term]
+                for term in self._term_frequencies(tokens)
+                if term in self._base.term_ids
+            ]
+        else:
+            term_ids = self._base.terms_of_slot(slot)
+        self._base_dead_df[term_ids] += 1
+        self._base_dead += 1
+
+    def _get_average_idf(self) -> float:
+        if self._average_idf is None:
+            df_parts = []
+            extra: list[int] = []
+            if self._base is not None:
+                base_df = self._base.doc_freqs() - self._base_dead_df
+                for term, plist in self.postings.items():
+                    i = self._base.term_ids.get(term)
+                    if i is None:
+                        extra.append(len(plist))
+                    else:
+                        base_df[i] += len(plist)
+                df_parts.append(base_df)
+            else:
+                extra = [len(p) for p in self.postings.values()]
+            df_parts.append(np.asarray(extra, dtype=np.int64))
+
+            df = np.concatenate(df_parts).astype(np.float64)
+            df = df[df > 0]
+            if not len(df):
+                self._average_idf = 0.0
+            else:
+                n = self.corpus_size
+                idf = np.log(n - df + 0.5) - np.log(df + 0.5)
+                self._average_idf = float(idf.sum() / len(idf))
+        return self._average_idf
+
+    def _ensure_capacity(self, size: int) -> None:
+        capacity = len(self._doc_len)
+        if size <= capacity:
+            return
+        new_capacity = max(size, capacity * self._GROW_FACTOR)
+        self._doc_len = np.resize(self._doc_len, new_capacity)
+        self._alive = np.resize(self._alive, new_capacity)
+        self._doc_len[capacity:] = 0
+        self._alive[capacity:] = False
+
+    def _build_segment(self) -> tuple[_Segment, list[str], np.ndarray]:
+        """Merge both tiers into CSR arrays over densely renumbered slots."""
+        n_slots = len(self.ids)
+        live = np.flatnonzero(self._alive[:n_slots])
+        remap = np.full(max(n_slots, 1), -1, dtype=np.int64)
+        remap[live] = np.arange(len(live))
+
+        vocab: list[str] = []
+        term_ids: dict[str, int] = {}
+        term_parts, slot_parts, tf_parts = [], [], []
+
+        if self._base is not None:
+            vocab = list(self._base.vocab)
+            term_ids = dict(self._base.term_ids)
+            term_parts.append(np.repeat(np.arange(len(vocab)), self._base.doc_freqs()))
+            slot_parts.append(np.asarray(self._base.slots, dtype=np.int64))
+            tf_parts.append(np.asarray(self._base.tfs, dtype=np.int64))
+
+        for term, plist in self.postings.items():
+            i = term_ids.get(term)
+            if i is None:
+                i = term_ids[term] = len(vocab)
+                vocab.append(term)
+            term_parts.append(np.full(len(plist), i, dtype=np.int64))
+            slot_parts.append(np.fromiter(plist.keys(), dtype=np.int64, count=len(plist)))
+            tf_parts.append(np.fromiter(plist.values(), dtype=np.int64, count=len(plist)))
+
+        if term_parts:
+            terms = np.concatenate(term_parts)
+            slots = remap[np.concatenate(slot_parts)]
+            tfs = np.concatenate(tf_parts)
+        else:
+            terms = slots = tfs = np.zeros(0, dtype=np.int64)
+
+        keep = slots >= 0
+        terms, slots, tfs = terms[keep], slots[keep], tfs[keep]
+        order = np.lexsort((slots, terms))
+        terms, slots, tfs = terms[order], slots[order], tfs[order]
+
+        counts = np.bincount(terms, minlength=len(vocab))
+        used = counts > 0
+        vocab = [vocab[i] for i in np.flatnonzero(used)]
+        offsets = np.concatenate(([0], np.cumsum(counts[used]))).astype(np.int64)
+
+        segment = _Segment(vocab, offsets, slots.astype(np.int32), tfs.astype(np.int32))
+        ids = [self.ids[i] for i in live]
+        return segment, ids, self._doc_len[live].copy()
+
+    def _install(self, segment: _Segment, ids: list[str], doc_len: np.ndarray) -> None:
+        """Make `segment` the base tier and empty the delta tier."""
+        self._reset()
+        self._base = segment
+        self._base_slots = len(ids)
+        self._base_dead_df = np.zeros(len(segment.vocab), dtype=np.int64)
+
+        self.ids = list(ids)
+        self.slot_of = {doc_id: slot for slot, doc_id in enumerate(ids)}
+        self._ensure_capacity(len(ids))
+        self._doc_len[:len(ids)] = doc_len
+        self._alive[:len(ids)] = True
+        self.total_len = int(np.sum(doc_len))
+
+    @staticmethod
+    def _prune_generations(path: str, keep: str, min_age_s: float = 60.0) -> None:
+        """Delete old snapshot generations (skipping recent ones another writer may own)."""
+        now = time.time()
+        for name in os.listdir(path):
+            gen_path = os.path.join(path, name)
+            if name == keep or not name.startswith("gen-") or not os.path.isdir(gen_path):
+                continue
+            try:
+                if now - os.path.getmtime(gen_path) >= min_age_s:
+                    shutil.rmtree(gen_path)
+            except OSError as e:
+                logger.warning(f"Could not prune snapshot {name}: {e}")
@@ -0,0 +1,140 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Any, Callable
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Run a warmup inference after loading each model
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() in ("1", "true", "yes")
+
+
+# ── Startup Loader ─────────────────────────────────────────────────
+#
+# Heavy components (cross-encoder, Chroma's ONNX embedder, PaddleOCR,
+# the BM25 / analytics indexes) register a loader here instead of being
+# built at import.  `start()` — called from the app's startup hook —
+# runs every loader on its own thread, so the models load concurrently
+# and the server answers /health (liveness) straight away.  Each loader
+# is followed by a warmup inference so the first real request doesn't
+# pay for ONNX session setup, graph compilation or allocator growth.
+#
+# Code that needs a component waits for it (`wait` from async code,
+# `result` from threads); waiting also starts loading if nothing did,
+# so scripts that never call `start()` still work.  /ready reports each
+# component's state and timings.
+
+@dataclass
+class Component:
+    name: str
+    load: Callable[[], Any]
+    warmup: Callable[[Any], Any] | None = None
+    state: str = "pending"          # pending → loading → warming → ready | failed
+    load_s: float | None = None
+    warmup_s: float | None = None
+    error: str | None = None
+    future: Future = field(default_factory=Future)
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "load_s": round(self.load_s, 3) if self.load_s is not None else None,
+            "warmup_s": round(self.warmup_s, 3) if self.warmup_s is not None else None,
+            "error": self.error,
+        }
+
+
+class Startup:
+    def __init__(self, warmup: bool = STARTUP_WARMUP):
+        self.warmup = warmup
+        self._components: dict[str, Component] = {}
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = Lock()
+        self._started_at: float | None = None
+
+    def add(self, name: str, load: Callable[[], Any], warmup: Callable[[Any], Any] | None = None) -> None:
+        """Register a component; loads right away if startup already began."""
+        with self._lock:
+            if name in self._components:
+                raise ValueError(f"Component already registered: {name}")
+            component = self._components[name] = Component(name, load, warmup)
+            if self._executor is not None:
+                self._launch(component)
+
+    def start(self) -> None:
+        """Load every registered component concurrently (idempotent)."""
+        with self._lock:
+            if self._executor is not None:
+                return
+            self._started_at = time.perf_counter()
+            self._executor = ThreadPoolExecutor(thread_name_prefix="startup")
+            for component in self._components.values():
+                self._launch(component)
+
+    def result(self, name: str, timeout: float | None = None) -> Any:
+        """Block until `name` is loaded; raises if its loader failed."""
+        self.start()
+        return self._components[name].future.result(timeout)
+
+    async def wait(self, name: str) -> Any:
+        self.start()
+        return await asyncio.wrap_future(self._components[name].future)
+
+    def is_ready(self, name: str) -> bool:
+        component = self._components.get(name)
+        return component is not None and component.state == "ready"
+
+    @property
+    def ready(self) -> bool:
+        return all(c.state == "ready" for c in self._components.values())
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "components": {name: c.status() for name, c in self._components.items()},
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _launch(self, component: Component) -> None:
+        self._executor.submit(self._run, component)
+
+    def _run(self, component: Component) -> None:
+        try:
+            component.state = "loading"
+            started = time.perf_counter()
+            value = component.load()
+            component.load_s = time.perf_counter() - started
+
+            if self.warmup and component.warmup is not None:
+                component.state = "warming"
+                started = time.perf_counter()
+                try:
+                    component.warmup(value)
+                except Exception as e:
+                    # A failed warmup only costs the first request some latency
+                    logger.warning(f"Warmup of {component.name} failed: {e}")
+                component.warmup_s = time.perf_counter() - started
+
+            component.state = "ready"
+            component.future.set_result(value)
+            logger.info(
+                f"{component.name} ready: load {component.load_s:.2f}s"
+                + (f", warmup {component.warmup_s:.2f}s" if component.warmup_s is not None else "")
+                + f" ({time.perf_counter() - self._started_at:.2f}s after startup)"
+            )
+        except Exception as e:
+            component.state = "failed"
+            component.error = str(e)
+            component.future.set_exception(e)
+            logger.error(f"Loading {component.name} failed: {e}")
+
+
+# Shared by every service in the process
+startup = Startup()
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+# The backend modules import each other by their flat names (as under uvicorn from backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def rag(tmp_path_factory):
+    """
+    The RAGService singleton over a temporary store, with the benchmark's
+    offline stand-ins for the embedder and cross-encoder.  Shared by the
+    whole session: tests use their own merchants so they don't collide.
+    """
+    pytest.importorskip("chromadb")
+    from benchmarks.rag import open_service, wait_ready
+
+    cwd = os.getcwd()
+    try:
+        service, _ = open_service(str(tmp_path_factory.mktemp("rag")), stub_models=True)
+    finally:
+        os.chdir(cwd)  # the store paths are already absolute
+    wait_ready()
+    yield service
+    service.close()
@@ -0,0 +1,91 @@
+from analytics_store import SpendingAnalytics, categorize
+
+
+def _store() -> SpendingAnalytics:
+    store = SpendingAnalytics()
+    store.add_many([
+        ("r1", {"title": "Walmart", "date": "2024-01-05", "total": 40.0, "tax": 2.0, "item_count": 4}),
+        ("r2", {"title": "Starbucks", "date": "2024-01-20", "total": 6.5, "tax": 0.5, "item_count": 1}),
+        ("r3", {"title": "WALMART", "date": "2024-02-02", "total": 25.0, "tax": 1.0, "item_count": 3}),
+        ("r4", {"title": "Shell", "date": "Unknown", "total": 50.0, "tax": 0.0, "item_count": 1}),
+    ])
+    return store
+
+
+def test_summary_over_everything_and_a_date_range():
+    store = _store()
+    everything = store.summary()
+    assert everything["count"] == 4 and everything["total"] == 121.5 and everything["undated"] == 1
+    january = store.summary(start=20240101, end=20240131)
+    assert january["count"] == 2 and january["total"] == 46.5
+    assert (january["first_date"], january["last_date"]) == ("2024-01-05", "2024-01-20")
+
+
+def test_filters_combine():
+    store = _store()
+    assert sorted(store.filter_ids(merchants=["walmart"])) == ["r1", "r3"]
+    assert store.filter_ids(merchants=["walmart"], min_total=30) == ["r1"]
+    assert sorted(store.filter_ids(max_total=30)) == ["r2", "r3"]
+    assert store.filter_ids(merchants=["nowhere"]) == []
+
+
+def test_group_by_merchant_category_and_month():
+    store = _store()
+    assert store.group_by("merchant") == [
+        {"key": "Walmart", "count": 2, "total": 65.0},
+        {"key": "Shell", "count": 1, "total": 50.0},
+        {"key": "Starbucks", "count": 1, "total": 6.5},
+    ]
+    assert [g["key"] for g in store.group_by("category")] == ["Groceries", "Transport & Fuel", "Dining"]
+    assert store.group_by("month") == [
+        {"key": "Undated", "count": 1, "total": 50.0},
+        {"key": "2024-01", "count": 2, "total": 46.5},
+        {"key": "2024-02", "count": 1, "total": 25.0},
+    ]
+
+
+def test_remove_and_replace():
+    store = _store()
+    assert store.remove("r4") and not store.remove("r4")
+    store.add("r2", {"title": "Starbucks", "date": "2024-01-20", "total": 8.0})
+    assert len(store) == 3
+    assert store.summary()["total"] == 73.0
+    assert store.largest(1) == [{"id": "r1", "merchant": "Walmart", "date": "2024-01-05", "total": 40.0}]
+
+
+def test_snapshot_round_trip(tmp_path):
+    store = _store()
+    store.remove("r2")
+    store.save(str(tmp_path), tag="v1")
+
+    loaded = SpendingAnalytics()
+    assert loaded.load(str(tmp_path), tag="v1")
+    assert sorted(loaded.filter_ids()) == ["r1", "r3", "r4"]
+    assert loaded.summary() == store.summary()
+    assert loaded.group_by("merchant") == store.group_by("merchant")
+    assert loaded.merchants() == store.merchants()
+    # New rows after a load reuse the saved merchant codes
+    loaded.add("r5", {"title": "walmart", "date": "2024-03-01", "total": 5.0})
+    assert loaded.filter_ids(merchants=["walmart"]) == ["r1", "r3", "r5"]
+
+
+def test_snapshot_with_another_tag_is_ignored(tmp_path):
+    _store().save(str(tmp_path), tag="v1")
+    store = SpendingAnalytics()
+    assert not store.load(str(tmp_path), tag="v2")
+    assert not store.load(str(tmp_path / "missing"), tag="v1")
+    assert len(store) == 0
+
+
+def test_empty_snapshot(tmp_path):
+    SpendingAnalytics().save(str(tmp_path))
+    store = SpendingAnalytics()
+    assert store.load(str(tmp_path))
+    assert len(store) == 0 and store.summary()["count"] == 0
+    assert store.filter_ids() == []
+
+
+def test_categorize():
+    assert categorize("Trader Joe's") == "Groceries"
+    assert categorize("Unknown Business", "Unleaded fuel 12.3 gal") == "Transport & Fuel"
+    assert categorize("Acme") == "Other"
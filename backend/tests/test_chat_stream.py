@@ -0,0 +1,184 @@
+import asyncio
+import json
+
+import pytest
+
+from llm_service import ReceiptAssistant
+from memory_service import LocalMemoryStore
+from response_cache import SemanticResponseCache
+
+TOKENS = 200
+
+
+class _StubRAG:
+    """Just enough of RAGService for ask_stream: no receipts, no spending summary."""
+    corpus_version = 0
+
+    async def ready(self):
+        pass
+
+    def query_intent(self, query):
+        return None
+
+    def spending_context(self, query, intent=None):
+        return None
+
+    async def retrieve(self, query, top_k=5, intent=None):
+        return []
+
+    async def embed_query(self, text):
+        return [1.0, float(len(text))]
+
+    @staticmethod
+    def format_context(hits):
+        return ""
+
+
+class _StubUpstream:
+    """
+    Chat-completions endpoint that streams TOKENS SSE chunks, slowly,
+    and records whether the client hung up before the last one.
+    """
+
+    def __init__(self, delay: float = 0.02):
+        self.delay = delay
+        self.requests = 0
+        self.sent = 0
+        self.closed_early = asyncio.Event()
+        self.finished = asyncio.Event()
+
+    async def start(self) -> str:
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}/v1"
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.requests += 1
+        headers = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").lower()
+        length = int(headers.split("content-length:")[1].split("\r\n")[0])
+        await reader.readexactly(length)
+
+        writer.write(b"HTTP/1.1 200 OK\r\ncontent-type: text/event-stream\r\nconnection: close\r\n\r\n")
+        try:
+            for i in range(TOKENS):
+                chunk = {
+                    "id": "stub", "object": "chat.completion.chunk", "created": 0, "model": "stub",
+                    "choices": [{"index": 0, "delta": {"content": f"t{i} "}, "finish_reason": None}],
+                }
+                writer.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                await writer.drain()
+                self.sent += 1
+                if not self.delay:
+                    continue
+                # A closed client shows up as EOF on the request side
+                try:
+                    if await asyncio.wait_for(reader.read(1), self.delay) == b"":
+                        self.closed_early.set()
+                        return
+                except asyncio.TimeoutError:
+                    pass
+            writer.write(b"data: [DONE]\n\n")
+            await writer.drain()
+            self.finished.set()
+        except (ConnectionError, OSError):
+            self.closed_early.set()
+        finally:
+            writer.close()
+
+
+@pytest.fixture(autouse=True)
+def _token(monkeypatch):
+    monkeypatch.setenv("GITHUB_TOKEN", "test")
+
+
+def _assistant(base_url: str) -> ReceiptAssistant:
+    assistant = ReceiptAssistant(_StubRAG(), LocalMemoryStore())
+    assistant.client = assistant.client.with_options(base_url=base_url)
+    assistant.response_cache = None
+    return assistant
+
+
+def test_disconnect_closes_upstream_stream():
+    async def run():
+        upstream = _StubUpstream()
+        assistant = _assistant(await upstream.start())
+        received = []
+
+        async def consume():
+            # Stands in for the SSE response, which Starlette cancels on disconnect
+            async for token in assistant.ask_stream("what did I buy?", session_id="s1"):
+                received.append(token)
+
+        task = asyncio.create_task(consume())
+        while len(received) < 3:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+        await asyncio.wait_for(upstream.closed_early.wait(), 5)
+        assert not upstream.finished.is_set()
+        assert upstream.sent < TOKENS
+
+        # The aborted exchange is not kept: no question without an answer
+        memory = await assistant.memory_store.load("s1")
+        assert memory.prompt_messages() == []
+        await upstream.stop()
+
+    asyncio.run(run())
+
+
+def test_generator_close_closes_upstream_stream():
+    async def run():
+        upstream = _StubUpstream()
+        assistant = _assistant(await upstream.start())
+
+        stream = assistant.ask_stream("what did I buy?", session_id="s2")
+        assert (await stream.__anext__()).startswith("t0")
+        await stream.aclose()
+
+        await asyncio.wait_for(upstream.closed_early.wait(), 5)
+        assert not upstream.finished.is_set()
+        await upstream.stop()
+
+    asyncio.run(run())
+
+
+def test_complete_stream_is_saved_to_memory():
+    async def run():
+        upstream = _StubUpstream(delay=0)
+        assistant = _assistant(await upstream.start())
+
+        answer = "".join([token async for token in assistant.ask_stream("hi", session_id="s3")])
+        assert answer == "".join(f"t{i} " for i in range(TOKENS))
+        assert upstream.finished.is_set()
+
+        memory = await assistant.memory_store.load("s3")
+        assert memory.prompt_messages() == [
+            {"role": "user", "content": "hi"},
+            {"role": "assistant", "content": answer},
+        ]
+        await upstream.stop()
+
+    asyncio.run(run())
+
+
+def test_repeated_question_is_answered_from_the_cache():
+    async def run():
+        upstream = _StubUpstream(delay=0)
+        assistant = _assistant(await upstream.start())
+        assistant.response_cache = SemanticResponseCache(threshold=0.999)
+
+        first = "".join([t async for t in assistant.ask_stream("what did I buy?", session_id="a")])
+        again = "".join([t async for t in assistant.ask_stream("what did I buy?", session_id="b")])
+        assert again == first and upstream.requests == 1
+
+        # Same words as a follow-up in session "a": the history differs, so no replay
+        [t async for t in assistant.ask_stream("what did I buy?", session_id="a")]
+        assert upstream.requests == 2
+        await upstream.stop()
+
+    asyncio.run(run())
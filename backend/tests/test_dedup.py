@@ -0,0 +1,23 @@
+from dedup import item_lines, receipt_key, text_key
+
+
+def test_receipt_key_ignores_case_spacing_and_item_order():
+    a = receipt_key("Whole Foods", "2024-01-05", 12.5, item_lines("- Milk: $2.00\n- Bread: $3.00"))
+    b = receipt_key("whole  foods!", "2024-01-05 ", 12.50, item_lines("-  bread: $3.00\n- MILK: $2.00"))
+    assert a is not None and a == b
+
+
+def test_receipt_key_separates_different_items():
+    milk = receipt_key("Whole Foods", "2024-01-05", 12.5, item_lines("- Milk: $2.00"))
+    eggs = receipt_key("Whole Foods", "2024-01-05", 12.5, item_lines("- Eggs: $2.00"))
+    assert milk != eggs
+
+
+def test_receipt_key_refuses_placeholder_fields():
+    assert receipt_key("Unknown Business", "Unknown", 0.0, []) is None
+    assert receipt_key("Target", "2024-01-05", 0.0, []) is None
+    assert receipt_key("", "2024-01-05", 5.0, []) is None
+
+
+def test_text_key_normalises_whitespace_and_case():
+    assert text_key("Receipt  from:\nTARGET") == text_key("receipt from: target")
@@ -0,0 +1,88 @@
+import pytest
+
+from fusion import RerankPolicy, agreement, fused_fill, merge_reranked, reciprocal_rank, weighted
+
+
+def test_reciprocal_rank_sums_over_rankings():
+    scores = reciprocal_rank([["a", "b", "c"], ["b", "d"]], k=60)
+    assert scores["b"] == pytest.approx(1 / 62 + 1 / 61)
+    assert scores["a"] == pytest.approx(1 / 61)
+    assert scores["d"] == pytest.approx(1 / 62)
+    assert max(scores, key=scores.get) == "b"
+
+
+def test_weighted_normalises_each_list():
+    dense = [("a", -0.1), ("b", -0.5), ("c", -0.9)]
+    sparse = [("c", 12.0), ("d", 2.0)]
+    scores = weighted(dense, sparse, dense_weight=0.5)
+    assert scores["a"] == pytest.approx(0.5)
+    assert scores["b"] == pytest.approx(0.25)
+    assert scores["c"] == pytest.approx(0.5)  # worst dense, best sparse
+    assert scores["d"] == pytest.approx(0.0)
+    # A one-element list normalises to 1 rather than dividing by zero
+    assert weighted([("a", 3.0)], [])["a"] == pytest.approx(0.5)
+
+
+def test_agreement():
+    assert agreement(["a", "b", "c"], ["c", "b", "x"], 3) == pytest.approx(2 / 3)
+    assert agreement(["a", "b"], [], 5) == 0.0
+    # k is capped by the shorter list
+    assert agreement(["a", "b", "c"], ["a"], 5) == 1.0
+
+
+def test_fuse_orders_best_first():
+    policy = RerankPolicy(method="rrf", rrf_k=60)
+    fused = policy.fuse([("a", 0.9), ("b", 0.8)], [("b", 5.0), ("c", 1.0)])
+    assert [doc_id for doc_id, _ in fused] == ["b", "a", "c"]
+
+
+def _fused(n: int) -> list[tuple[str, float]]:
+    return [(f"d{i}", 1.0 - i / 100) for i in range(n)]
+
+
+def test_select_head_only():
+    policy = RerankPolicy(top_n=3, margin=0.0, skip_agreement=0.0)
+    assert policy.select(_fused(10), [], [], 5) == ["d0", "d1", "d2"]
+
+
+def test_select_everything_when_top_n_is_zero_or_covers_all():
+    assert len(RerankPolicy(top_n=0).select(_fused(10), [], [], 5)) == 10
+    assert len(RerankPolicy(top_n=12, margin=0.0).select(_fused(10), [], [], 5)) == 10
+
+
+def test_select_extends_head_within_margin():
+    fused = [("a", 1.0), ("b", 0.9), ("c", 0.89), ("d", 0.5), ("e", 0.0)]
+    # Spread 1.0; margin 0.05 → candidates scoring >= 0.9 - 0.05 join the head
+    assert RerankPolicy(top_n=2, margin=0.05).select(fused, [], [], 5) == ["a", "b", "c"]
+    assert RerankPolicy(top_n=2, margin=0.0).select(fused, [], [], 5) == ["a", "b"]
+
+
+def test_select_skips_when_retrievers_agree():
+    policy = RerankPolicy(top_n=3, skip_agreement=0.8)
+    ids = ["a", "b", "c", "d", "e"]
+    assert policy.select(_fused(10), ids, list(reversed(ids)), 5) == []
+    assert policy.select(_fused(10), ids, ["a", "x", "y", "z", "w"], 5) == ["d0", "d1", "d2"]
+
+
+def test_merge_orders_reranked_first_and_drops_low_scores():
+    fused = [("a", 0.05), ("b", 0.04), ("c", 0.03), ("d", 0.02)]
+    ranked = merge_reranked(fused, {"a": -1.0, "b": 3.0, "c": -9.0}, top_k=3, min_score=-5,
+                            corroborated={"a", "b", "c", "d"})
+    assert ranked == [("b", 3.0, True), ("a", -1.0, True), ("d", 0.02, False)]
+
+
+def test_fill_only_uses_corroborated_candidates():
+    fused = [("a", 0.05), ("b", 0.04), ("c", 0.03), ("d", 0.02)]
+    # Nothing reranked (the skip path): only hits both retrievers found qualify
+    ranked = merge_reranked(fused, {}, top_k=3, min_score=-5, corroborated={"b", "d"})
+    assert ranked == [("b", 0.04, False), ("d", 0.02, False)]
+    assert fused_fill(fused, {"b"}, 2, {"b", "c", "d"}) == [("c", 0.03), ("d", 0.02)]
+    assert fused_fill(fused, set(), 0, {"a"}) == []
+
+
+def test_merge_caps_at_top_k():
+    fused = _fused(10)
+    scores = {doc_id: float(i) for i, (doc_id, _) in enumerate(fused)}
+    ranked = merge_reranked(fused, scores, top_k=4, min_score=-5, corroborated=set(scores))
+    assert [doc_id for doc_id, _, _ in ranked] == ["d9", "d8", "d7", "d6"]
+    assert all(reranked for _, _, reranked in ranked)
@@ -0,0 +1,149 @@
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+
+import ocr_service
+from ocr_service import OCRService, ReceiptData
+from rate_limiter import RateLimiter
+
+
+def _error(cls, status: int, headers: dict | None = None):
+    response = httpx.Response(status, headers=headers, request=httpx.Request("POST", "http://llm.test"))
+    return cls(f"HTTP {status}", response=response, body=None)
+
+
+class _Completions:
+    """Fails with the queued errors first, then returns a parse."""
+
+    def __init__(self, *errors: Exception):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def create_with_completion(self, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        usage = type("Usage", (), {"total_tokens": 100})()
+        return ReceiptData(merchant="Costco", total=12.5), type("Completion", (), {"usage": usage})()
+
+
+def _service(completions: _Completions, limiter: RateLimiter | None = None) -> OCRService:
+    service = OCRService(load_ocr=False, load_llm=False)
+    service.client = type("Client", (), {})()
+    service.client.chat = type("Chat", (), {})()
+    service.client.chat.completions = completions
+    service.rate_limiter = limiter or RateLimiter()
+    service._llm_slots = asyncio.Semaphore(2)
+    return service
+
+
+@pytest.fixture(autouse=True)
+def _fast_backoff(monkeypatch):
+    monkeypatch.setattr(ocr_service, "LLM_PARSE_BACKOFF_S", 0.001)
+    monkeypatch.setattr(ocr_service, "LLM_PARSE_MAX_ATTEMPTS", 4)
+
+
+# ── Rate limiter ────────────────────────────────────────────────────
+
+def test_tokens_per_minute_throttles_past_the_burst():
+    async def run():
+        limiter = RateLimiter(tpm=600)  # 10 tokens/s, bucket of 600
+        await limiter.acquire(600)
+        started = time.monotonic()
+        await limiter.acquire(3)
+        return time.monotonic() - started, limiter.stats()
+
+    waited, stats = asyncio.run(run())
+    assert 0.2 <= waited < 1.0
+    assert stats["acquired"] == 2 and stats["throttled"] == 1
+
+
+def test_requests_per_minute_throttles_past_the_burst():
+    async def run():
+        limiter = RateLimiter(rpm=240)  # 4 requests/s, bucket of 240
+        for _ in range(240):
+            await limiter.acquire()
+        started = time.monotonic()
+        await limiter.acquire()
+        return time.monotonic() - started
+
+    assert 0.15 <= asyncio.run(run()) < 1.0
+
+
+def test_pause_holds_back_every_caller():
+    async def run():
+        limiter = RateLimiter()
+        limiter.pause(0.2)
+        started = time.monotonic()
+        await asyncio.gather(limiter.acquire(), limiter.acquire())
+        return time.monotonic() - started, limiter.stats()
+
+    waited, stats = asyncio.run(run())
+    assert waited >= 0.19
+    assert stats["pauses"] == 1 and stats["acquired"] == 2
+
+
+def test_settle_charges_the_underestimate():
+    limiter = RateLimiter(tpm=600)
+    asyncio.run(limiter.acquire(100))
+    limiter.settle(100, 400)
+    assert limiter._tokens.level == pytest.approx(200, abs=1)
+    # Nothing to correct when the provider reports no usage
+    limiter.settle(100, 0)
+    assert limiter._tokens.level == pytest.approx(200, abs=1)
+
+
+def test_disabled_limits_never_wait():
+    async def run():
+        limiter = RateLimiter(rpm=0, tpm=0)
+        for _ in range(1000):
+            await limiter.acquire(10_000)
+        return limiter.stats()
+
+    assert asyncio.run(run())["throttled"] == 0
+
+
+# ── Retries ─────────────────────────────────────────────────────────
+
+def test_transient_errors_are_retried():
+    completions = _Completions(
+        _error(openai.InternalServerError, 500),
+        openai.APIConnectionError(request=httpx.Request("POST", "http://llm.test")),
+    )
+    service = _service(completions)
+    receipt = asyncio.run(service._llm_parse("COSTCO\nTOTAL 12.50"))
+    assert receipt.merchant == "Costco"
+    assert completions.calls == 3
+    assert service.llm_retries == 2
+
+
+def test_retry_after_pauses_the_limiter():
+    completions = _Completions(_error(openai.RateLimitError, 429, {"retry-after": "0.2"}))
+    limiter = RateLimiter()
+    service = _service(completions, limiter)
+
+    started = time.monotonic()
+    asyncio.run(service._llm_parse("COSTCO\nTOTAL 12.50"))
+    assert time.monotonic() - started >= 0.19
+    assert limiter.stats()["pauses"] == 1
+    assert completions.calls == 2
+
+
+def test_gives_up_after_max_attempts():
+    completions = _Completions(*[_error(openai.InternalServerError, 503) for _ in range(10)])
+    service = _service(completions)
+    with pytest.raises(openai.InternalServerError):
+        asyncio.run(service._llm_parse("COSTCO\nTOTAL 12.50"))
+    assert completions.calls == 4
+
+
+def test_client_errors_are_not_retried():
+    completions = _Completions(_error(openai.BadRequestError, 400))
+    service = _service(completions)
+    with pytest.raises(openai.BadRequestError):
+        asyncio.run(service._llm_parse("COSTCO\nTOTAL 12.50"))
+    assert completions.calls == 1
+    assert service.llm_retries == 0
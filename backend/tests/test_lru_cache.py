@@ -0,0 +1,51 @@
+from lru_cache import LRUCache
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "b" is now the oldest
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidate_tag_drops_only_that_documents_entries():
+    cache = LRUCache(10)
+    cache.put("q1:doc1", 0.9, tag="doc1")
+    cache.put("q2:doc1", 0.4, tag="doc1")
+    cache.put("q1:doc2", 0.7, tag="doc2")
+    cache.put("untagged", 1.0)
+    assert cache.invalidate_tag("doc1") == 2
+    assert cache.get("q1:doc1") is None and cache.get("q2:doc1") is None
+    assert cache.get("q1:doc2") == 0.7 and cache.get("untagged") == 1.0
+    assert cache.invalidate_tag("doc1") == 0
+
+
+def test_evicted_and_retagged_entries_leave_no_stale_tags():
+    cache = LRUCache(1)
+    cache.put("k1", 1, tag="doc1")
+    cache.put("k2", 2, tag="doc2")  # evicts k1
+    assert cache.invalidate_tag("doc1") == 0
+
+    cache.put("k2", 3, tag="doc3")  # same key, new tag
+    assert cache.invalidate_tag("doc2") == 0
+    assert cache.get("k2") == 3
+    assert cache.invalidate_tag("doc3") == 1
+    assert len(cache) == 0 and not cache._tags and not cache._key_tag
+
+
+def test_pop_untags():
+    cache = LRUCache(4)
+    cache.put("k", 1, tag="doc")
+    assert cache.pop("k") == 1
+    assert cache.invalidate_tag("doc") == 0
+
+
+def test_zero_size_cache_stores_nothing():
+    cache = LRUCache(0)
+    cache.put("k", 1, tag="doc")
+    assert cache.get("k") is None and len(cache) == 0
+    assert cache.stats()["misses"] == 1
@@ -0,0 +1,255 @@
+import asyncio
+from types import SimpleNamespace
+
+from llm_service import ReceiptAssistant
+from memory_service import LocalMemoryStore, MemoryService, MongoMemoryStore, estimate_tokens
+
+
+def _chat(memory: MemoryService, turns: int, size: int = 40):
+    for i in range(turns):
+        memory.add_user_message(f"question {i} " + "q" * size)
+        memory.add_ai_message(f"answer {i} " + "a" * size)
+
+
+def _users(memory: MemoryService) -> list[str]:
+    return [m["content"].split(" ")[1] for m in memory.get_chat_history() if m["role"] == "user"]
+
+
+def test_window_is_capped_by_turns():
+    memory = MemoryService(mode="summary", token_budget=10_000, max_turns=3)
+    _chat(memory, 5)
+    assert _users(memory) == ["2", "3", "4"]
+    assert memory.needs_compaction
+
+
+def test_window_is_capped_by_tokens():
+    per_turn = estimate_tokens("question 0 " + "q" * 40) + estimate_tokens("answer 0 " + "a" * 40)
+    memory = MemoryService(mode="summary", token_budget=2 * per_turn + 1, max_turns=100)
+    _chat(memory, 6)
+    assert _users(memory) == ["4", "5"]
+    assert memory.stats()["tokens"] <= memory.token_budget
+
+
+def test_newest_turn_stays_even_over_budget():
+    memory = MemoryService(mode="summary", token_budget=10, max_turns=5)
+    _chat(memory, 3, size=400)
+    assert _users(memory) == ["2"]
+
+
+def test_trim_mode_drops_old_turns_without_a_summary():
+    memory = MemoryService(mode="trim", token_budget=10_000, max_turns=2)
+    _chat(memory, 5)
+    assert _users(memory) == ["3", "4"]
+    # Nothing queued, so no summary call is ever made
+    assert not memory.needs_compaction
+    assert memory.prompt_messages()[0]["role"] == "user"
+
+
+def test_buffer_mode_keeps_everything():
+    memory = MemoryService(mode="buffer", token_budget=10, max_turns=2)
+    _chat(memory, 6)
+    assert len(_users(memory)) == 6
+    assert not memory.needs_compaction
+
+
+def test_compaction_folds_evicted_turns_into_the_summary():
+    memory = MemoryService(mode="summary", token_budget=10_000, max_turns=2)
+    _chat(memory, 4)
+    seen = []
+
+    async def summarize(summary: str, transcript: str) -> str:
+        seen.append(transcript)
+        return "user asked about 0 and 1"
+
+    asyncio.run(memory.compact(summarize))
+    assert "question 0" in seen[0] and "question 1" in seen[0] and "question 2" not in seen[0]
+    assert not memory.needs_compaction
+    assert memory.summarized_turns == 2
+    messages = memory.prompt_messages()
+    assert messages[0] == {"role": "system", "content": "Summary of the earlier conversation:\nuser asked about 0 and 1"}
+    assert _users(memory) == ["2", "3"]
+
+
+def test_failed_summary_falls_back_to_extractive():
+    memory = MemoryService(mode="summary", token_budget=10_000, max_turns=1, summary_tokens=50)
+    _chat(memory, 3)
+
+    async def summarize(summary: str, transcript: str) -> str:
+        raise RuntimeError("provider down")
+
+    asyncio.run(memory.compact(summarize))
+    lines = memory.summary.splitlines()
+    assert [line[:24] for line in lines] == ["- User asked: question 0", "- User asked: question 1"]
+    assert estimate_tokens(memory.summary) <= 50
+
+
+def test_clear_voids_a_running_summary():
+    memory = MemoryService(mode="summary", token_budget=10_000, max_turns=1)
+    _chat(memory, 3)
+
+    async def run():
+        release = asyncio.Event()
+
+        async def summarize(summary: str, transcript: str) -> str:
+            await release.wait()
+            return "stale"
+
+        task = asyncio.create_task(memory.compact(summarize))
+        await asyncio.sleep(0)
+        memory.clear()
+        release.set()
+        await task
+
+    asyncio.run(run())
+    assert memory.summary == ""
+    assert memory.prompt_messages() == []
+
+
+def test_round_trip_through_dict():
+    memory = MemoryService(mode="summary", token_budget=10_000, max_turns=2)
+    _chat(memory, 3)
+    memory.summary = "earlier"
+    restored = MemoryService.from_dict(memory.to_dict())
+    assert restored.prompt_messages() == memory.prompt_messages()
+    assert restored.needs_compaction
+
+
+def test_local_store_caps_sessions_by_count():
+    async def run():
+        store = LocalMemoryStore(max_sessions=2, ttl_s=3600, max_mb=0)
+        for session in ("a", "b", "c"):
+            memory = await store.load(session)
+            _chat(memory, 1)
+            await store.save(session, memory)
+        return store.stats(), (await store.load("a")).prompt_messages()
+
+    stats, evicted = asyncio.run(run())
+    assert stats["evicted"] >= 1
+    assert evicted == []  # "a" was the least recently used
+
+
+def test_local_store_caps_sessions_by_size():
+    async def run():
+        store = LocalMemoryStore(max_sessions=100, ttl_s=3600, max_mb=10_000 / (1024 * 1024))
+        for session in ("a", "b", "c", "d"):
+            memory = await store.load(session)
+            _chat(memory, 1, size=2_000)  # ~4 kB per session
+            await store.save(session, memory)
+        return store.stats()
+
+    stats = asyncio.run(run())
+    assert stats["sessions"] == 2
+    assert stats["size_mb"] <= stats["max_mb"]
+    assert stats["evicted"] == 2
+
+
+def test_local_store_keeps_the_session_in_use():
+    async def run():
+        store = LocalMemoryStore(max_sessions=100, ttl_s=3600, max_mb=1_000 / (1024 * 1024))
+        memory = await store.load("big")
+        _chat(memory, 1, size=5_000)
+        await store.save("big", memory)
+        return store.stats()
+
+    assert asyncio.run(run())["sessions"] == 1
+
+
+def test_local_store_expires_idle_sessions():
+    async def run():
+        store = LocalMemoryStore(max_sessions=100, ttl_s=0.05, max_mb=0)
+        memory = await store.load("a")
+        _chat(memory, 1)
+        await store.save("a", memory)
+        await asyncio.sleep(0.1)
+        await store.load("b")
+        return store.stats()
+
+    stats = asyncio.run(run())
+    assert stats["expired"] == 1 and stats["sessions"] == 1
+
+
+class _Collection:
+    """The two pymongo calls MongoMemoryStore makes, over a dict."""
+
+    def __init__(self):
+        self.docs = {}
+
+    def find_one(self, query):
+        return self.docs.get(query["_id"])
+
+    def replace_one(self, query, doc, upsert=False):
+        current = self.docs.get(query["_id"])
+        matched = current is not None and all(
+            current["memory"].get(key.split(".", 1)[1]) == value
+            for key, value in query.items() if key.startswith("memory.")
+        )
+        if matched or (current is None and upsert):
+            self.docs[query["_id"]] = doc
+        return SimpleNamespace(matched_count=int(matched))
+
+    def delete_one(self, query):
+        self.docs.pop(query["_id"], None)
+
+
+def _summary_cleared_midway(store) -> list[dict]:
+    """Run a background summary update that a clear and a new turn overtake."""
+    async def run():
+        memory = await store.load("s")
+        memory.mode, memory.max_turns = "summary", 1
+        _chat(memory, 3)
+        await store.save("s", memory)
+
+        release = asyncio.Event()
+
+        async def summarize(summary: str, transcript: str) -> str:
+            await release.wait()
+            return "stale"
+
+        assistant = ReceiptAssistant.__new__(ReceiptAssistant)
+        assistant.memory_store = store
+        assistant._summarize = summarize
+        task = asyncio.create_task(assistant._compact_memory("s", memory))
+        await asyncio.sleep(0)
+
+        await store.clear("s")
+        fresh = await store.load("s")
+        fresh.add_user_message("after clear")
+        fresh.add_ai_message("ok")
+        await store.save("s", fresh)
+
+        release.set()
+        await task
+        return (await store.load("s")).prompt_messages()
+
+    return asyncio.run(run())
+
+
+def test_cleared_session_is_not_brought_back_by_a_summary_local():
+    assert _summary_cleared_midway(LocalMemoryStore()) == [
+        {"role": "user", "content": "after clear"},
+        {"role": "assistant", "content": "ok"},
+    ]
+
+
+def test_cleared_session_is_not_brought_back_by_a_summary_mongo():
+    assert _summary_cleared_midway(MongoMemoryStore(_Collection())) == [
+        {"role": "user", "content": "after clear"},
+        {"role": "assistant", "content": "ok"},
+    ]
+
+
+def test_summary_update_saves_an_unchanged_session_mongo():
+    async def run():
+        store = MongoMemoryStore(_Collection())
+        memory = await store.load("s")
+        memory.mode, memory.max_turns = "summary", 1
+        _chat(memory, 3)
+        await store.save("s", memory)
+
+        async def summarize(summary: str, transcript: str) -> str:
+            return "earlier questions"
+
+        await memory.compact(summarize)
+        return await store.save_if_current("s", memory), (await store.load("s")).summary
+
+    assert asyncio.run(run()) == (True, "earlier questions")
@@ -0,0 +1,132 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+pytest.importorskip("paddleocr")
+
+from ocr_pool import OCRPool, OCRPoolSaturated  # noqa: E402
+from ocr_service import OCRResult  # noqa: E402
+
+
+class _StubOCR:
+    """In-process stand-in for PaddleOCR; blocks until `release` is set."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.release.set()
+
+    def extract_text_from_bytes(self, image_bytes: bytes) -> OCRResult:
+        self.release.wait(5)
+        return OCRResult(raw_text=image_bytes.decode())
+
+    def extract_batch(self, images: list[bytes]) -> list[OCRResult]:
+        return [self.extract_text_from_bytes(image) for image in images]
+
+
+class _BrokenExecutor:
+    """An executor whose worker died: jobs fail, or submit itself does."""
+
+    def __init__(self, on_submit: bool):
+        self.on_submit = on_submit
+        self.shut_down = False
+
+    def submit(self, fn, *args):
+        if self.on_submit:
+            raise BrokenProcessPool("worker died")
+        future = Future()
+        future.set_exception(BrokenProcessPool("worker died"))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.shut_down = True
+
+
+def _pool(**kwargs) -> tuple[OCRPool, _StubOCR]:
+    service = _StubOCR()
+    return OCRPool(workers=0, local_service=service, **kwargs), service
+
+
+def test_full_pool_rejects_instead_of_queueing():
+    async def run():
+        pool, service = _pool(max_pending=2, timeout_s=5)
+        service.release.clear()
+        running = [asyncio.create_task(pool.extract(b"a")), asyncio.create_task(pool.extract(b"b"))]
+        await asyncio.sleep(0.05)
+        with pytest.raises(OCRPoolSaturated):
+            await pool.extract(b"c")
+        service.release.set()
+        results = await asyncio.gather(*running)
+        pool.close()
+        return pool.stats(), [r.raw_text for r in results]
+
+    stats, texts = asyncio.run(run())
+    assert texts == ["a", "b"]
+    assert stats["rejected"] == 1 and stats["completed"] == 2 and stats["pending"] == 0
+
+
+def test_timed_out_job_keeps_its_slot_until_it_finishes():
+    async def run():
+        pool, service = _pool(max_pending=1, timeout_s=0.05)
+        service.release.clear()
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.extract(b"slow")
+        still_pending = pool.pending
+        service.release.set()
+        while pool.pending:
+            await asyncio.sleep(0.01)
+        pool.close()
+        return still_pending, pool.stats()
+
+    still_pending, stats = asyncio.run(run())
+    assert still_pending == 1
+    assert stats["timeouts"] == 1
+
+
+def test_batch_waits_for_room():
+    async def run():
+        pool, service = _pool(max_pending=2, timeout_s=5)
+        service.release.clear()
+        single = asyncio.create_task(pool.extract(b"a"))
+        batch = asyncio.create_task(pool.extract_batch([b"b", b"c"]))
+        await asyncio.sleep(0.2)
+        service.release.set()
+        results = await batch
+        await single
+        pool.close()
+        return [r.raw_text for r in results]
+
+    assert asyncio.run(run()) == ["b", "c"]
+
+
+@pytest.mark.parametrize("on_submit", [True, False])
+def test_broken_pool_is_replaced_once(on_submit, monkeypatch):
+    async def run():
+        pool, _ = _pool(timeout_s=5)
+        pool.close()
+        broken = _BrokenExecutor(on_submit)
+        pool._executor = broken
+        monkeypatch.setattr(pool, "_new_executor", lambda: ThreadPoolExecutor(max_workers=1))
+        result = await pool.extract(b"again")
+        pool.close()
+        return pool, broken, result
+
+    pool, broken, result = asyncio.run(run())
+    assert result.raw_text == "again"
+    assert broken.shut_down and pool.stats()["restarts"] == 1
+
+
+def test_pool_that_breaks_again_gives_up(monkeypatch):
+    async def run():
+        pool, _ = _pool(timeout_s=5)
+        pool.close()
+        pool._executor = _BrokenExecutor(on_submit=False)
+        monkeypatch.setattr(pool, "_new_executor", lambda: _BrokenExecutor(on_submit=False))
+        with pytest.raises(BrokenProcessPool):
+            await pool.extract(b"poison")
+        return pool.stats()
+
+    stats = asyncio.run(run())
+    assert stats["restarts"] == 1 and stats["pending"] == 0
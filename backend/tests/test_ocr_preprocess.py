@@ -0,0 +1,78 @@
+import io
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+pytest.importorskip("paddleocr")
+
+from PIL import Image  # noqa: E402
+
+from ocr_service import ImageTransform, OCRService  # noqa: E402
+
+
+def _service(max_side: int = 1000, crop: bool = True) -> OCRService:
+    service = OCRService(load_ocr=False, load_llm=False)
+    service.max_side, service.grayscale, service.crop_to_content = max_side, True, crop
+    return service
+
+
+def _photo(exif_orientation: int | None = None) -> bytes:
+    """2000x1000 dark table with a white receipt at x 500-1500, y 200-800 and a black mark at (1000, 500)."""
+    pixels = np.full((1000, 2000), 30, dtype=np.uint8)
+    pixels[200:800, 500:1500] = 240
+    pixels[490:510, 990:1010] = 0
+    image = Image.fromarray(pixels)
+    out = io.BytesIO()
+    if exif_orientation:
+        exif = Image.Exif()
+        exif[0x0112] = exif_orientation
+        image.save(out, format="JPEG", exif=exif)
+    else:
+        image.save(out, format="PNG")
+    return out.getvalue()
+
+
+def _mark(pixels: np.ndarray) -> tuple[float, float]:
+    ys, xs = np.nonzero(pixels[:, :, 0] < 100)
+    return float(xs.mean()), float(ys.mean())
+
+
+def test_downscaled_and_cropped_points_map_back():
+    pixels, transform = _service()._load_image(_photo())
+    # Downscaled to 1000 wide, then cropped to roughly the receipt
+    assert max(pixels.shape[:2]) < 1000
+    assert transform.crop_x > 0 and transform.crop_y > 0
+    x, y = transform.to_original(*_mark(pixels))
+    assert abs(x - 1000) <= 2 and abs(y - 500) <= 2
+    assert (transform.orig_width, transform.orig_height) == (2000, 1000)
+
+
+def test_exif_rotation_is_part_of_the_original_frame():
+    # Orientation 6: stored landscape, shown rotated 90° clockwise (portrait)
+    pixels, transform = _service(crop=False)._load_image(_photo(exif_orientation=6))
+    assert (transform.orig_width, transform.orig_height) == (1000, 2000)
+    x, y = transform.to_original(*_mark(pixels))
+    assert abs(x - 500) <= 3 and abs(y - 1000) <= 3
+
+
+def test_points_are_clamped_to_the_image():
+    transform = ImageTransform(orig_width=100, orig_height=50, scale_x=0.5, scale_y=0.5, crop_x=5, crop_y=5)
+    assert transform.to_original(-20, -20) == [0, 0]
+    assert transform.to_original(500, 500) == [100, 50]
+    assert transform.to_original(10, 5) == [30, 20]
+
+
+def test_result_boxes_and_polygons_are_in_original_coordinates():
+    transform = ImageTransform(orig_width=2000, orig_height=1000, scale_x=0.5, scale_y=0.5, crop_x=200, crop_y=80)
+    predicted = SimpleNamespace(json={"res": {
+        "rec_texts": ["TOTAL 7.77"],
+        "rec_scores": [0.98],
+        "rec_boxes": [[10, 20, 110, 40]],
+        "rec_polys": [[[10, 20], [110, 20], [110, 40], [10, 40]]],
+    }})
+    result = _service()._build_result([predicted], transform)
+    region = result.text_regions[0]
+    assert region.box == [420, 200, 620, 240]
+    assert region.polygon == [[420, 200], [620, 200], [620, 240], [420, 240]]
+    assert (result.image_width, result.image_height) == (2000, 1000)
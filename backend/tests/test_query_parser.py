@@ -0,0 +1,95 @@
+from datetime import date
+
+import pytest
+
+from query_parser import parse_query
+
+TODAY = date(2024, 6, 15)
+MERCHANTS = [
+    "Walmart", "Costco Wholesale", "Trader Joe's", "Whole Foods Market", "Target",
+    "Best Buy", "Unknown Business", "Shell", "Home Depot", "Domino's Pizza",
+]
+
+
+def _merchants(query: str) -> list[str]:
+    return parse_query(query, today=TODAY, merchants=MERCHANTS).merchant_names
+
+
+@pytest.mark.parametrize("query", [
+    "what was my best month?",
+    "how much did the whole trip cost",
+    "how much do I spend on business lunches",
+    "am I on target this month?",
+    "what's the best buy I made",
+    "show me receipts from the market",
+])
+def test_ordinary_words_do_not_filter_by_merchant(query):
+    assert _merchants(query) == []
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("how much did I spend at target", ["Target"]),
+    ("receipts from Best Buy", ["Best Buy"]),
+    ("whole foods receipts", ["Whole Foods Market"]),
+    ("how much at costco last month", ["Costco Wholesale"]),
+    ("trader joe's receipts", ["Trader Joe's"]),
+    ("wal mart spending", ["Walmart"]),
+    ("dominos orders", ["Domino's Pizza"]),
+    ("home depot vs walmart", ["Walmart", "Home Depot"]),
+])
+def test_named_merchants_become_a_filter(query, expected):
+    assert _merchants(query) == expected
+
+
+def test_merchant_filter_uses_keys():
+    intent = parse_query("what did I buy at Whole Foods?", today=TODAY, merchants=MERCHANTS)
+    assert intent.merchants == ["wholefoodsmarket"]
+    assert intent.has_filters
+
+
+def test_pure_aggregate_skips_retrieval():
+    intent = parse_query("how much did I spend last month?", today=TODAY)
+    assert intent.aggregate and intent.summary_only
+    assert (intent.start, intent.end) == (20240501, 20240531)
+
+
+def test_aggregate_about_items_still_retrieves():
+    intent = parse_query("how much did I spend on coffee in march 2024", today=TODAY)
+    assert intent.aggregate and intent.mentions_documents and not intent.summary_only
+    assert (intent.start, intent.end, intent.period) == (20240301, 20240331, "March 2024")
+
+
+@pytest.mark.parametrize("query, group_by", [
+    ("spending by category this year", "category"),
+    ("which store did I spend the most at", "merchant"),
+    ("monthly spending", "month"),
+])
+def test_group_by(query, group_by):
+    assert parse_query(query, today=TODAY).group_by == group_by
+
+
+@pytest.mark.parametrize("query, start, end", [
+    ("what did I buy today", 20240615, 20240615),
+    ("receipts from the last 7 days", 20240609, 20240615),
+    ("spending this week", 20240610, 20240615),
+    ("how much in 2023", 20230101, 20231231),
+    ("receipts from december", 20231201, 20231231),
+])
+def test_periods(query, start, end):
+    intent = parse_query(query, today=TODAY)
+    assert (intent.start, intent.end) == (start, end)
+
+
+def test_may_is_only_a_month_with_a_preposition():
+    assert parse_query("may I see my receipts", today=TODAY).start is None
+    assert parse_query("receipts in may", today=TODAY).start == 20240501
+
+
+@pytest.mark.parametrize("query, low, high", [
+    ("receipts over $50", 50.0, None),
+    ("purchases under 20 dollars", None, 20.0),
+    ("receipts between $10 and $30", 10.0, 30.0),
+])
+def test_amounts(query, low, high):
+    intent = parse_query(query, today=TODAY)
+    assert (intent.min_total, intent.max_total) == (low, high)
@@ -0,0 +1,148 @@
+import asyncio
+import threading
+import time
+
+import rag_service
+
+
+def _receipt(merchant: str, day: str, total: float, items: list[str]) -> dict:
+    lines = "\n".join(f"- {item}: ${total / len(items):.2f} (qty: 1)" for item in items)
+    return {
+        "text": f"Receipt from: {merchant}\nDate: {day}\nTotal: ${total:.2f}\nTax: $0.00\n\nItems:\n{lines}",
+        "metadata": {"title": merchant, "date": day, "total": total, "item_count": len(items)},
+    }
+
+
+def test_single_add_is_not_held_up_by_a_bulk_import(rag, monkeypatch):
+    monkeypatch.setattr(rag_service, "CHROMA_WRITE_BATCH", 20)
+    bulk = [_receipt(f"Bulk Store {i}", "2024-01-05", 10 + i, [f"thing {i}"]) for i in range(600)]
+    version = rag.corpus_version
+    importer = threading.Thread(target=rag.add_receipts, args=(bulk,))
+    importer.start()
+    while rag.corpus_version == version:
+        time.sleep(0.001)
+
+    doc_id = rag.add_receipt(**_receipt("Corner Deli", "2024-01-06", 7.5, ["Bagel"]))
+    single_done = importer.is_alive()
+    importer.join()
+
+    # The single add got the lock between two chunks of the import
+    assert single_done
+    assert doc_id in rag.bm25
+
+
+def test_bulk_import_dedups_across_chunks(rag, monkeypatch):
+    monkeypatch.setattr(rag_service, "CHROMA_WRITE_BATCH", 3)
+    rows = [_receipt("Chunky Cafe", "2024-02-01", 4.0 + i, ["Tea"]) for i in range(4)]
+    ids = rag.add_receipts(rows + rows[:2])
+    assert len(set(ids)) == 4
+    assert ids[4:] == ids[:2]
+
+
+def test_failed_parses_are_not_deduped(rag):
+    failed = {
+        "text": "Receipt from: Unknown Business\nDate: Unknown\nTotal: $0.00\nTax: $0.00\n\nItems:\nNo items extracted",
+        "metadata": {"title": "Unknown Business", "date": "Unknown", "total": 0.0, "item_count": 0},
+    }
+    first = rag.add_receipt(**failed)
+    second = rag.add_receipt(**failed)
+    assert first != second
+    assert len(set(rag.add_receipts([failed, failed]))) == 2
+
+
+def test_repeated_receipt_is_deduped_but_different_items_are_kept(rag):
+    lunch = _receipt("Dedup Diner", "2024-03-01", 12.0, ["Soup"])
+    first = rag.add_receipt(**lunch)
+    assert rag.add_receipt(**lunch) == first
+    other = rag.add_receipt(**_receipt("Dedup Diner", "2024-03-01", 12.0, ["Salad"]))
+    assert other != first
+
+
+def test_retrieve_reuses_the_callers_intent(rag, monkeypatch):
+    rag.add_receipt(**_receipt("Intent Grocer", "2024-04-02", 9.0, ["Apples"]))
+    intent = rag.query_intent("apples at Intent Grocer")
+    assert intent.merchants == ["intentgrocer"]
+
+    def reparse(query):
+        raise AssertionError("intent parsed twice")
+
+    monkeypatch.setattr(rag, "query_intent", reparse)
+    hits = asyncio.run(rag.retrieve("apples at Intent Grocer", intent=intent))
+    assert hits and {hit["meta"]["title"] for hit in hits} == {"Intent Grocer"}
+
+
+def test_snapshot_is_written_in_the_background(rag, monkeypatch):
+    monkeypatch.setattr(rag_service, "BM25_SNAPSHOT_EVERY", 1)
+    release = threading.Event()
+    save = rag.bm25.save
+
+    def slow_save(path, tag=""):
+        release.wait(5)
+        save(path, tag=tag)
+
+    monkeypatch.setattr(rag.bm25, "save", slow_save)
+    rag.add_receipt(**_receipt("Snapshot Books", "2024-05-01", 15.0, ["Novel"]))
+    pending = rag._snapshot_pending
+    # The add returned while the snapshot was still waiting to be written
+    assert pending is not None and not pending.done()
+
+    release.set()
+    pending.result(timeout=10)
+    assert rag.bm25.delta_size == 0
+
+
+class _RecordingCollection:
+    """Passes every call through to the Chroma collection, logging `get` includes."""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self.includes = []
+
+    def get(self, *args, **kwargs):
+        self.includes.append((tuple(kwargs.get("include", ())), "ids" in kwargs))
+        return self._collection.get(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+
+def test_analytics_start_from_the_snapshot(rag, monkeypatch):
+    rag.add_receipt(**_receipt("Snapshot Hardware", "2024-06-01", 30.0, ["Nails"]))
+    rag.save_analytics_snapshot()
+    late = rag.add_receipt(**_receipt("Snapshot Hardware", "2024-06-02", 12.0, ["Glue"]))
+    expected = rag.analytics.summary()
+
+    recorder = _RecordingCollection(rag.collection)
+    monkeypatch.setattr(rag, "collection", recorder)
+    rag._load_analytics()
+
+    assert rag.analytics.summary() == expected
+    assert late in rag.analytics
+    # Only IDs for the whole store; metadata just for the receipt added after the snapshot
+    assert (("metadatas",), False) not in recorder.includes
+    assert (("metadatas",), True) in recorder.includes
+
+
+def test_analytics_snapshot_of_another_version_is_rebuilt(rag, monkeypatch):
+    rag.add_receipt(**_receipt("Versioned Books", "2024-06-03", 20.0, ["Atlas"]))
+    rag.save_analytics_snapshot()
+    expected = rag.analytics.summary()
+
+    monkeypatch.setattr(type(rag), "_METADATA_TAG", "filters-dedup-next")
+    recorder = _RecordingCollection(rag.collection)
+    monkeypatch.setattr(rag, "collection", recorder)
+    rag._load_analytics()
+
+    assert rag.analytics.summary() == expected
+    assert (("metadatas",), False) in recorder.includes
+
+
+def test_deleting_a_receipt_drops_its_cached_rerank_scores(rag):
+    doc_id = rag.add_receipt(**_receipt("Cached Florist", "2024-07-01", 18.0, ["Tulips"]))
+    other = rag.add_receipt(**_receipt("Cached Florist", "2024-07-02", 9.0, ["Roses"]))
+    rag.rerank_cache.put("tulips-pair", 1.0, tag=doc_id)
+    rag.rerank_cache.put("roses-pair", 2.0, tag=other)
+
+    assert rag.delete_receipt(doc_id)
+    assert rag.rerank_cache.get("tulips-pair") is None
+    assert rag.rerank_cache.get("roses-pair") == 2.0
@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+pytest.importorskip("chromadb")
+
+from rag_service import RerankBatcher  # noqa: E402
+
+
+class _Model:
+    """Scores a pair by its doc's number; can hold the first predict to let jobs queue up."""
+
+    def __init__(self, hold: bool = False, fail: bool = False):
+        self.batches = []
+        self.release = threading.Event()
+        self.started = threading.Event()
+        if not hold:
+            self.release.set()
+        self.fail = fail
+
+    def predict(self, pairs, batch_size):
+        self.started.set()
+        self.release.wait(5)
+        self.batches.append(len(pairs))
+        if self.fail:
+            raise RuntimeError("model exploded")
+        return [float(doc.split()[-1]) for _, doc in pairs]
+
+
+def _pairs(job: int, n: int) -> list[list[str]]:
+    return [["query", f"doc {job * 100 + i}"] for i in range(n)]
+
+
+def test_each_job_gets_its_own_scores():
+    model = _Model()
+    batcher = RerankBatcher(lambda: model, max_batch_pairs=64, max_wait_ms=50)
+    futures = [batcher.submit(_pairs(job, 3)) for job in range(4)]
+    results = [f.result(5) for f in futures]
+    batcher.close()
+    assert results == [[job * 100 + i for i in range(3)] for job in range(4)]
+    assert sum(model.batches) == 12 and len(model.batches) < 4
+
+
+def test_jobs_queued_behind_a_busy_model_share_a_batch():
+    model = _Model(hold=True)
+    batcher = RerankBatcher(lambda: model, max_batch_pairs=10, max_wait_ms=0)
+    first = batcher.submit(_pairs(0, 2))
+    assert model.started.wait(5)
+    queued = [batcher.submit(_pairs(job, 4)) for job in range(1, 4)]
+    model.release.set()
+    for future in [first, *queued]:
+        future.result(5)
+    batcher.close()
+    # 4 + 4 fit under the cap; the third job starts the next batch
+    assert model.batches == [2, 8, 4]
+    assert batcher.stats()["largest_batch_pairs"] == 8
+
+
+def test_empty_job_resolves_without_the_model():
+    model = _Model()
+    batcher = RerankBatcher(lambda: model)
+    assert batcher.submit([]).result(1) == []
+    batcher.close()
+    assert model.batches == []
+
+
+def test_failed_predict_fails_every_job_in_the_batch():
+    model = _Model(fail=True)
+    batcher = RerankBatcher(lambda: model, max_wait_ms=50)
+    futures = [batcher.submit(_pairs(job, 2)) for job in range(2)]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="model exploded"):
+            future.result(5)
+    # The worker survives and serves the next batch
+    model.fail = False
+    assert batcher.submit(_pairs(9, 1)).result(5) == [900.0]
+    batcher.close()
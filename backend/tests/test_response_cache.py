@@ -0,0 +1,50 @@
+from response_cache import SemanticResponseCache
+
+HISTORY = [{"role": "user", "content": "how much at Walmart?"}, {"role": "assistant", "content": "$40"}]
+
+
+def _cache(**kwargs) -> SemanticResponseCache:
+    cache = SemanticResponseCache(**kwargs)
+    fp = cache.fingerprint(["r1", "r2"])
+    cache.store("what did I buy?", [1.0, 0.0], fp, 1, "Milk and bread.", latency_s=2.0)
+    return cache
+
+
+def test_similar_question_over_the_same_receipts_hits():
+    cache = _cache(threshold=0.95)
+    fp = cache.fingerprint(["r2", "r1"])  # order of the hits does not matter
+    entry = cache.lookup([0.99, 0.05], fp, 1)
+    assert entry is not None and entry.answer == "Milk and bread."
+    assert cache.stats()["saved_latency_s"] == 2.0
+
+
+def test_dissimilar_question_misses():
+    cache = _cache(threshold=0.95)
+    assert cache.lookup([0.6, 0.8], cache.fingerprint(["r1", "r2"]), 1) is None
+
+
+def test_other_receipts_or_history_miss():
+    cache = _cache()
+    assert cache.lookup([1.0, 0.0], cache.fingerprint(["r1"]), 1) is None
+    assert cache.lookup([1.0, 0.0], cache.fingerprint(["r1", "r2"], HISTORY), 1) is None
+    assert cache.fingerprint(["r1"], HISTORY) != cache.fingerprint(["r1"], HISTORY[::-1])
+
+
+def test_corpus_change_drops_every_entry():
+    cache = _cache()
+    assert cache.lookup([1.0, 0.0], cache.fingerprint(["r1", "r2"]), 2) is None
+    assert cache.stats()["entries"] == 0 and cache.stats()["invalidations"] == 1
+
+
+def test_oldest_entry_is_evicted():
+    cache = SemanticResponseCache(max_entries=2)
+    for i, fp in enumerate(("a", "b", "c")):
+        cache.store(f"q{i}", [1.0, 0.0], fp, 1, f"answer {i}", latency_s=0.1)
+    assert cache.lookup([1.0, 0.0], "a", 1) is None
+    assert cache.lookup([1.0, 0.0], "c", 1).answer == "answer 2"
+    assert cache.stats()["entries"] == 2
+
+
+def test_chunks_replay_the_answer_verbatim():
+    answer = "You spent  $12.50\non groceries."
+    assert "".join(SemanticResponseCache.chunks(answer)) == answer
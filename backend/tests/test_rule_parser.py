@@ -0,0 +1,72 @@
+import pytest
+
+from rule_parser import RULE_PARSER_MIN_CONFIDENCE, parse_date, parse_receipt_rules
+
+RECEIPT = """WALMART
+123 Main St
+(555) 123-4567
+01/05/2024 14:32
+MILK 2% 3.49
+BREAD WHEAT 2.50
+2 x BANANAS 1.20
+SUBTOTAL 7.19
+TAX 0.58
+TOTAL 7.77
+VISA 7.77
+"""
+
+
+def test_clean_receipt_parses_with_high_confidence():
+    result = parse_receipt_rules(RECEIPT)
+    assert result.merchant == "WALMART"
+    assert result.date == "2024-01-05"
+    assert (result.subtotal, result.tax, result.total) == (7.19, 0.58, 7.77)
+    assert result.items == [
+        {"desc": "MILK 2%", "qty": 1.0, "price": 3.49},
+        {"desc": "BREAD WHEAT", "qty": 1.0, "price": 2.5},
+        {"desc": "BANANAS", "qty": 2.0, "price": 0.6},
+    ]
+    assert result.consistent
+    assert result.confidence >= RULE_PARSER_MIN_CONFIDENCE
+
+
+def test_items_that_do_not_add_up_fall_below_the_threshold():
+    result = parse_receipt_rules(RECEIPT.replace("BREAD WHEAT 2.50", "BREAD WHEAT 9.50"))
+    assert not result.consistent
+    assert result.confidence < RULE_PARSER_MIN_CONFIDENCE
+
+
+def test_empty_text():
+    result = parse_receipt_rules("")
+    assert result.confidence == 0.0 and result.items == []
+
+
+def test_regions_are_grouped_into_rows_by_position():
+    # Label and price are separate OCR regions; the price column is on the right
+    regions = [
+        {"text": "Corner Cafe", "box": [10, 0, 120, 10]},
+        {"text": "2024-03-02", "box": [10, 20, 90, 30]},
+        {"text": "Latte", "box": [10, 40, 50, 50]},
+        {"text": "4.50", "box": [160, 41, 190, 51]},
+        {"text": "Croissant", "box": [10, 60, 70, 70]},
+        {"text": "3.00", "box": [160, 59, 190, 69]},
+        {"text": "Total", "box": [10, 80, 50, 90]},
+        {"text": "7.50", "box": [160, 80, 190, 90]},
+    ]
+    result = parse_receipt_rules("", regions)
+    assert result.merchant == "Corner Cafe"
+    assert [(i["desc"], i["price"]) for i in result.items] == [("Latte", 4.5), ("Croissant", 3.0)]
+    assert result.total == 7.5 and result.consistent
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("2024-01-31", "2024-01-31"),
+    ("31/01/2024", "2024-01-31"),
+    ("01/31/24", "2024-01-31"),
+    ("31 Jan 2024", "2024-01-31"),
+    ("January 31, 2024", "2024-01-31"),
+    ("13/13/2024", None),
+    ("no date here", None),
+])
+def test_parse_date(text, expected):
+    assert parse_date(text) == expected
@@ -0,0 +1,128 @@
+import random
+
+import numpy as np
+import pytest
+
+from sparse_index import SparseIndex
+
+rank_bm25 = pytest.importorskip("rank_bm25")
+
+VOCAB = [f"w{i}" for i in range(60)] + ["milk", "bread", "costco", "fuel", "latte"]
+
+
+def _corpus(size: int, seed: int) -> dict[str, list[str]]:
+    rng = random.Random(seed)
+    # Skewed term choice, so some terms are in most documents (negative idf)
+    return {
+        f"doc{i}": [VOCAB[min(int(rng.expovariate(0.15)), len(VOCAB) - 1)] for _ in range(rng.randint(3, 30))]
+        for i in range(size)
+    }
+
+
+def _queries(seed: int) -> list[list[str]]:
+    rng = random.Random(seed)
+    return [rng.sample(VOCAB, rng.randint(1, 4)) for _ in range(25)] + [["w0", "w0"], ["unseen"]]
+
+
+def _index(docs: dict[str, list[str]]) -> SparseIndex:
+    index = SparseIndex()
+    for doc_id, tokens in docs.items():
+        index.add(doc_id, tokens)
+    return index
+
+
+def _assert_parity(index: SparseIndex, docs: dict[str, list[str]]):
+    ids = list(docs)
+    reference = rank_bm25.BM25Okapi([docs[doc_id] for doc_id in ids])
+    for query in _queries(len(ids)):
+        expected = reference.get_scores(query)
+        scores = index.get_scores(query)
+        got = np.array([scores[index.slot_of[doc_id]] for doc_id in ids])
+        np.testing.assert_allclose(got, expected, rtol=1e-9, atol=1e-12)
+
+        # top_k returns the same documents with the same scores (only matching ones)
+        top = index.top_k(query, 10)
+        matching = [i for i, doc_id in enumerate(ids) if set(query) & set(docs[doc_id])]
+        assert len(top) == min(10, len(matching))
+        assert {doc_id for doc_id, _ in top} <= {ids[i] for i in matching}
+        for doc_id, score in top:
+            assert score == pytest.approx(expected[ids.index(doc_id)], rel=1e-9, abs=1e-12)
+        head = sorted(expected[matching], reverse=True)[:10]
+        np.testing.assert_allclose([score for _, score in top], head, rtol=1e-9, atol=1e-12)
+
+
+def test_matches_rank_bm25_after_adds():
+    docs = _corpus(300, seed=1)
+    _assert_parity(_index(docs), docs)
+
+
+def test_matches_rank_bm25_after_removes():
+    docs = _corpus(300, seed=2)
+    index = _index(docs)
+
+    rng = random.Random(3)
+    for doc_id in rng.sample(list(docs), 90):
+        # Half with tokens, half via the posting-list scan
+        assert index.remove(doc_id, docs[doc_id] if rng.random() < 0.5 else None)
+        del docs[doc_id]
+    assert not index.remove("doc-unknown")
+    _assert_parity(index, docs)
+
+
+def test_readd_replaces_document():
+    docs = _corpus(50, seed=4)
+    index = _index(docs)
+    docs["doc7"] = ["milk", "milk", "bread"]
+    index.add("doc7", docs["doc7"])
+    assert len(index) == 50
+    _assert_parity(index, docs)
+
+
+def test_matches_rank_bm25_across_base_and_delta_tiers():
+    docs = _corpus(400, seed=5)
+    items = list(docs.items())
+    index = _index(dict(items[:250]))
+    index.merge()  # first 250 in the base tier, the rest in the delta
+    for doc_id, tokens in items[250:]:
+        index.add(doc_id, tokens)
+
+    rng = random.Random(6)
+    for doc_id in rng.sample(list(docs), 120):
+        assert index.remove(doc_id, docs[doc_id] if rng.random() < 0.5 else None)
+        del docs[doc_id]
+    _assert_parity(index, docs)
+
+    index.merge()
+    assert index.delta_size == 0
+    _assert_parity(index, docs)
+
+
+def test_snapshot_round_trip(tmp_path):
+    docs = _corpus(200, seed=7)
+    _index(docs).save(str(tmp_path), tag="v1")
+
+    loaded = SparseIndex()
+    assert not loaded.load(str(tmp_path), tag="v2")  # incompatible tag is rejected
+    assert loaded.load(str(tmp_path), tag="v1")
+    _assert_parity(loaded, docs)
+
+    # A loaded (memory-mapped) base still takes adds and removes
+    loaded.add("new", ["latte", "fuel"])
+    docs["new"] = ["latte", "fuel"]
+    assert loaded.remove("doc3")
+    del docs["doc3"]
+    _assert_parity(loaded, docs)
+
+
+def test_load_without_snapshot(tmp_path):
+    assert not SparseIndex().load(str(tmp_path / "missing"))
+
+
+def test_top_k_within_allowed_ids():
+    docs = _corpus(100, seed=6)
+    index = SparseIndex()
+    index.add_many(list(docs.items()))
+    allowed = [f"doc{i}" for i in range(0, 100, 3)]
+    top = index.top_k(["w0", "w1"], 5, allowed_ids=allowed)
+    assert top and {doc_id for doc_id, _ in top} <= set(allowed)
+    assert index.top_k(["w0"], 5, allowed_ids=["missing"]) == []
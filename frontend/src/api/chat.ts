@@ -1,3 +1,18 @@
+const SESSION_KEY = 'spendly.chatSessionId';
+
+/**
+ * ID of this browser's chat session; the backend keeps one conversation
+ * memory per session.
+ */
+export function getChatSessionId(): string {
+  let id = localStorage.getItem(SESSION_KEY);
+  if (!id) {
+    id = crypto.randomUUID();
+    localStorage.setItem(SESSION_KEY, id);
+  }
+  return id;
+}
+
 /**
  * Streams a chat response from the backend via SSE.
  * Calls `onToken` for every chunk received, and `onDone` when complete.
@@ -11,7 +26,7 @@ export async function streamChat(
   const response = await fetch('http://localhost:8000/ai/chat', {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({ query: message }),
+    body: JSON.stringify({ query: message, session_id: getChatSessionId() }),
   });
 
   if (!response.ok || !response.body) {
@@ -71,6 +86,8 @@ export async function streamChat(
 export async function clearChat() {
   const response = await fetch('http://localhost:8000/ai/chat/clear', {
     method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ session_id: getChatSessionId() }),
   });
 
   if (!response.ok) {
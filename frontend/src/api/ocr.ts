@@ -59,12 +59,15 @@ export const scanReceipt = async (file: File): Promise<ScanResponse> => {
   return response.json();
 };
 
-/** Step 2: LLM parse — sends raw_text, returns structured data */
-export const parseReceipt = async (rawText: string): Promise<ParseResponse> => {
+/** Step 2: Parse — sends raw_text (+ OCR boxes for the rule parser), returns structured data */
+export const parseReceipt = async (
+  rawText: string,
+  ocrRegions?: OCRRegions,
+): Promise<ParseResponse> => {
   const response = await fetch('http://localhost:8000/ocr/parse', {
     method: 'POST',
     headers: { 'Content-Type': 'application/json' },
-    body: JSON.stringify({ raw_text: rawText }),
+    body: JSON.stringify({ raw_text: rawText, ocr_regions: ocrRegions }),
   });
 
   if (!response.ok) {
@@ -69,7 +69,7 @@ export function ChatPage() {
     animationDoneRef.current = false;
 
     // 2. Fire LLM parse in the background (runs while animation plays)
-    parsePromiseRef.current = parseReceipt(scanResult.raw_text);
+    parsePromiseRef.current = parseReceipt(scanResult.raw_text, scanResult.ocr_regions);
   }, []);
 
   // Called when the scan overlay animation finishes